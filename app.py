@@ -1,12 +1,38 @@
 import os
 from dotenv import load_dotenv
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+from flask import (
+    Flask, render_template, stream_template, request, flash, redirect,
+    session, g, jsonify, abort, get_flashed_messages)
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased, joinedload
+from sqlalchemy.orm.exc import ObjectDeletedError
 
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm, CSRFForm
-from models import db, connect_db, User, Message, Like
+from models import (
+    db, connect_db, User, Message, Like, Follow,
+    create_message_search_index, create_username_search_indexes,
+    forget_follow_ids)
+import counters
+import migrations
+from assets import build as build_assets, connect_assets
+from conditional import connect_conditional_get
+from fragments import connect_message_cards
+from timelines import connect_timelines
+from sql_stats import connect_sql_stats
+from metrics import connect_metrics
+from user_cache import connect_user_cache
+from passwords import passwords
+from replicas import connect_replicas, replica_binds
+from lazy_globals import LazyGlobals, lazy, forget as forget_lazy_globals
+from user_search import (
+    AUTOCOMPLETE_LIMIT, connect_username_index, decode_user_cursor,
+    search_users)
+from message_search import connect_message_search, decode_result_cursor
+from pagination import (
+    MESSAGES_PER_PAGE, USERS_PER_PAGE, Page, cursor_args, decode_id_cursor,
+    paginate_messages, paginate_users, users_page_version)
 from werkzeug.exceptions import Unauthorized
 
 load_dotenv()
@@ -14,14 +40,82 @@ load_dotenv()
 CURR_USER_KEY = "curr_user"
 
 app = Flask(__name__)
+app.app_ctx_globals_class = LazyGlobals
 
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
-app.config['SQLALCHEMY_ECHO'] = True
+# read replicas of it, for the read-only pages (see replicas.py)
+app.config['SQLALCHEMY_BINDS'] = replica_binds(
+    os.environ.get('DATABASE_REPLICA_URLS', ''))
+# seconds a browser reads from the primary after it writes
+if os.environ.get('REPLICA_STICKY_SECONDS'):
+    app.config['REPLICA_STICKY_SECONDS'] = float(
+        os.environ['REPLICA_STICKY_SECONDS'])
+# log every SQL statement (slow; for debugging only)
+app.config['SQLALCHEMY_ECHO'] = os.environ.get('SQLALCHEMY_ECHO') == '1'
+# fraction of requests whose SQL is measured and reported (see sql_stats.py)
+app.config['SQL_STATS_SAMPLE_RATE'] = float(
+    os.environ.get('SQL_STATS_SAMPLE_RATE', 0))
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
+# where home timelines are kept: 'sqlite' (shared by the workers on a host)
+# or 'memory' (only for a single process; see timelines.py)
+app.config['TIMELINE_BACKEND'] = os.environ.get('TIMELINE_BACKEND', 'sqlite')
+app.config['TIMELINE_SQLITE_PATH'] = os.environ.get(
+    'TIMELINE_SQLITE_PATH', 'timelines.sqlite')
+# accounts with more followers than this aren't fanned out on write
+if os.environ.get('TIMELINE_FANOUT_THRESHOLD'):
+    app.config['TIMELINE_FANOUT_THRESHOLD'] = int(
+        os.environ['TIMELINE_FANOUT_THRESHOLD'])
+# seconds a worker may reuse a logged-in user's profile fields; 0 turns off
+if os.environ.get('USER_CACHE_TTL'):
+    app.config['USER_CACHE_TTL'] = int(os.environ['USER_CACHE_TTL'])
+# bcrypt work factor for new hashes; older hashes are upgraded on login
+if os.environ.get('BCRYPT_LOG_ROUNDS'):
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ['BCRYPT_LOG_ROUNDS'])
+# password hashing pool size (default: one per core)
+if os.environ.get('PASSWORD_POOL_WORKERS'):
+    app.config['PASSWORD_POOL_WORKERS'] = int(
+        os.environ['PASSWORD_POOL_WORKERS'])
+# where rendered message cards are kept: 'memory' (per worker) or 'sqlite'
+# (shared by the workers on a host; see fragments.py)
+app.config['FRAGMENT_CACHE_BACKEND'] = os.environ.get(
+    'FRAGMENT_CACHE_BACKEND', 'memory')
+app.config['FRAGMENT_CACHE_SQLITE_PATH'] = os.environ.get(
+    'FRAGMENT_CACHE_SQLITE_PATH', 'fragments.sqlite')
+if os.environ.get('FRAGMENT_CACHE_SIZE'):
+    app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ['FRAGMENT_CACHE_SIZE'])
+# where `flask build-assets` writes fingerprinted static files (see assets.py)
+if os.environ.get('ASSET_DIR'):
+    app.config['ASSET_DIR'] = os.environ['ASSET_DIR']
+# stream long list pages to the browser as they render; set to 0 to turn off
+app.config['STREAM_TEMPLATES'] = os.environ.get('STREAM_TEMPLATES', '1') == '1'
+app.config['STREAM_BLOCK_SIZE'] = 16 * 1024
+# page sizes of the user lists and message lists
+app.config['USERS_PER_PAGE'] = int(
+    os.environ.get('USERS_PER_PAGE', USERS_PER_PAGE))
+app.config['MESSAGES_PER_PAGE'] = int(
+    os.environ.get('MESSAGES_PER_PAGE', MESSAGES_PER_PAGE))
+# directory gunicorn workers share their request metrics through; it should
+# be emptied when the server starts (see metrics.py)
+if os.environ.get('METRICS_DIR'):
+    app.config['METRICS_DIR'] = os.environ['METRICS_DIR']
 # toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+replicas = connect_replicas(app)
+metrics = connect_metrics(app)
+sql_stats = connect_sql_stats(app)
+for engine in replicas.engines:
+    metrics.watch(engine)
+    sql_stats.watch(engine)
+passwords.init_app(app)
+timelines = connect_timelines(app)
+user_cache = connect_user_cache(app)
+usernames = connect_username_index(app)
+message_search = connect_message_search(app)
+conditional_get = connect_conditional_get(app)
+message_cards = connect_message_cards(app)
+assets = connect_assets(app)
 
 
 ##############################################################################
@@ -30,26 +124,70 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """Create reference to CSRF Form and ff we're logged in ...
-    add curr user to Flask global."""
+    """Reset the current user and CSRF form for this request.
+
+    Neither is worked out until something reads `g.user` or `g.csrf_form`
+    (see the loaders below), so requests that never do skip the user lookup
+    and the CSRF token.
+    """
+
+    # g is ALWAYS passed to every template
+    # dont have to say user=user
+    forget_lazy_globals()
+
+    # the session outlives the request, but those sets mustn't
+    forget_follow_ids()
+
+
+@lazy('user')
+def load_user():
+    """The logged-in user, or None."""
+
     if CURR_USER_KEY in session:
+        # session[CURR_USER_KEY] gives us back user.id; the user usually
+        # comes from this worker's cache, without a query
+        return user_cache.get(session[CURR_USER_KEY])
 
-        g.user = User.query.get(session[CURR_USER_KEY])
+    return None
 
-        # g is specific to this to request / response cycle
-        # g is gone and recreated with every request
-        # (why its in before_request route)
-        # g is ALWAYS passed to every template
-        # dont have to say user=user
-        # session[CURRE_USER_KEY] gives us back user.id
-        # When we do User.query.get, gives us a user instance,
-        # and store in g.user
 
-    else:
-        g.user = None
+@app.errorhandler(ObjectDeletedError)
+def logged_in_user_deleted(error):
+    """A user this worker had cached was deleted (by another worker) when
+    this request went to load the rest of their row: log them out and try
+    again as nobody. Any other deleted row is still an error."""
+
+    user_id = session.get(CURR_USER_KEY)
+    db.session.rollback()
+
+    if user_id is None:
+        raise error
+
+    user_cache.invalidate(user_id)
+    if user_cache.get(user_id) is not None:
+        raise error
+
+    do_logout()
+    return redirect(request.url)
+
+
+@lazy('csrf_form')
+def load_csrf_form():
+    """An empty form, for its CSRF token (rendered or validated)."""
+
+    return CSRFForm()
+
+
+def viewer_version():
+    """A scalar subquery of the logged-in user's version, for a view to
+    fetch along with its own page's versions (see conditional.py)."""
+
+    viewer = aliased(User)
+
+    return (db.select(viewer.version)
+            .where(viewer.id == g.user.id)
+            .scalar_subquery())
 
-    # define CSRF Form
-    g.csrf_form = CSRFForm()
 
 def do_login(user):
     """Log in user."""
@@ -97,6 +235,7 @@ def signup():
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        usernames.add(user.id, user.username)
         do_login(user)
 
         return redirect("/")
@@ -118,6 +257,9 @@ def login():
         )
 
         if user:
+            # save the user's password hash if authenticate upgraded it
+            db.session.commit()
+
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -142,14 +284,94 @@ def logout():
 
     return redirect("/")
 
+##############################################################################
+# Rendering long lists
+
+
+def render_list(template, **context):
+    """Render a list page, streamed if STREAM_TEMPLATES is on.
+
+    A streamed page's rows are read from the database as the template gets
+    to them (see pagination.StreamedPage), so the first bytes go out
+    before the whole page is loaded, and it is never all in memory at once.
+    The template's output is sent on in blocks of STREAM_BLOCK_SIZE
+    characters, rather than one write per template tag.
+    """
+
+    if app.config['STREAM_TEMPLATES']:
+        # take the flashed messages out of the session now: it's saved
+        # before the template gets to them
+        get_flashed_messages()
+
+        return app.response_class(
+            in_blocks(stream_template(template, **context),
+                      app.config['STREAM_BLOCK_SIZE']))
+
+    return render_template(template, **context)
+
+
+def in_blocks(chunks, size):
+    """Join the strings `chunks` into strings of about `size` characters."""
+
+    block = []
+    length = 0
+
+    for chunk in chunks:
+        block.append(chunk)
+        length += len(chunk)
+
+        if length >= size:
+            yield "".join(block)
+            block = []
+            length = 0
+
+    if block:
+        yield "".join(block)
+
+
+def record_follow_status(following):
+    """Callback for a page of users: put whether g.user follows each of
+    them in the dict `following`.
+
+    The template only needs the current chunk's, so earlier chunks' are
+    dropped; whatever `following` started with is kept.
+    """
+
+    keep = set(following)
+
+    def on_chunk(users):
+        for user_id in list(following):
+            if user_id not in keep:
+                del following[user_id]
+
+        following.update(
+            g.user.following_status([user.id for user in users]))
+
+    return on_chunk
+
+
+def record_liked_ids(liked_ids):
+    """Callback for a page of messages: put the ones g.user liked in the
+    set `liked_ids` (replacing the previous chunk's)."""
+
+    def on_chunk(messages):
+        liked_ids.clear()
+        liked_ids.update(
+            g.user.liked_message_ids([msg.id for msg in messages]))
+
+    return on_chunk
+
+
 ##############################################################################
 # General user routes:
 
 @app.get('/users')
+@replicas.read_only
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username, and an
+    'after' cursor for the next page of results.
     """
 
     if not g.user:
@@ -157,16 +379,46 @@ def list_users():
         return redirect("/")
 
     search = request.args.get('q')
+    after = request.args.get('after')
+    following = {}
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    users = search_users(
+        search,
+        after=decode_user_cursor(after) if after else None,
+        per_page=app.config['USERS_PER_PAGE'],
+        on_chunk=record_follow_status(following),
+        stream=app.config['STREAM_TEMPLATES'],
+    )
 
-    return render_template('users/index.html', users=users)
+    return render_list(
+        'users/index.html',
+        users=users,
+        search=search,
+        following=following,
+    )
+
+
+@app.get('/users/autocomplete')
+def autocomplete_users():
+    """JSON list of users whose username starts with the 'q' param."""
+
+    if not g.user:
+        raise Unauthorized()
+
+    prefix = request.args.get('q', '')
+
+    if not prefix:
+        return jsonify([])
+
+    return jsonify([
+        dict(id=user_id, username=username)
+        for user_id, username in usernames.complete(
+            prefix, limit=AUTOCOMPLETE_LIMIT)
+    ])
 
 
 @app.get('/users/<int:user_id>')
+@replicas.read_only
 def show_user(user_id):
     """Show user profile."""
 
@@ -174,34 +426,135 @@ def show_user(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    row = db.session.execute(
+        db.select(User, viewer_version()).where(User.id == user_id)).first()
+
+    if row is None:
+        abort(404)
+
+    user, version = row
+    etag = conditional_get.etag(user.version, version)
+
+    if not_modified := conditional_get.not_modified(etag):
+        return not_modified
 
-    return render_template('users/show.html', user=user)
+    before, after = cursor_args()
+
+    messages = paginate_messages(
+        Message.query.filter(Message.user_id == user_id),
+        before=before,
+        after=after,
+        per_page=app.config['MESSAGES_PER_PAGE'],
+    )
+
+    return render_template(
+        'users/show.html',
+        user=user,
+        messages=messages,
+        liked_ids=g.user.liked_message_ids([msg.id for msg in messages]),
+    )
 
 
 @app.get('/users/<int:user_id>/following')
+@replicas.read_only
 def show_following(user_id):
-    """Show list of people this user is following."""
+    """Show list of people this user is following, a page at a time."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    after = request.args.get('after')
+    after = decode_id_cursor(after) if after else None
+    query = (User
+             .query
+             .join(Follow, Follow.user_being_followed_id == User.id)
+             .filter(Follow.user_following_id == user_id))
+    per_page = app.config['USERS_PER_PAGE']
+
+    row = db.session.execute(
+        db.select(User,
+                  viewer_version(),
+                  users_page_version(query, Follow.user_being_followed_id, after, per_page))
+        .where(User.id == user_id)).first()
+
+    if row is None:
+        abort(404)
+
+    user, version, page_version = row
+    etag = conditional_get.etag(user.version, version, page_version)
+
+    if not_modified := conditional_get.not_modified(etag):
+        return not_modified
+
+    following = g.user.following_status([user_id])
 
-    return render_template('users/following.html', user=user)
+    users = paginate_users(
+        query,
+        position=Follow.user_being_followed_id,
+        after=after,
+        per_page=per_page,
+        on_chunk=record_follow_status(following),
+        stream=app.config['STREAM_TEMPLATES'],
+    )
+
+    return render_list(
+        'users/following.html',
+        user=user,
+        users=users,
+        following=following,
+    )
 
 
 @app.get('/users/<int:user_id>/followers')
+@replicas.read_only
 def show_followers(user_id):
-    """Show list of followers of this user."""
+    """Show list of followers of this user, a page at a time."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    after = request.args.get('after')
+    after = decode_id_cursor(after) if after else None
+    query = (User
+             .query
+             .join(Follow, Follow.user_following_id == User.id)
+             .filter(Follow.user_being_followed_id == user_id))
+    per_page = app.config['USERS_PER_PAGE']
+
+    row = db.session.execute(
+        db.select(User,
+                  viewer_version(),
+                  users_page_version(query, Follow.user_following_id, after, per_page))
+        .where(User.id == user_id)).first()
+
+    if row is None:
+        abort(404)
+
+    user, version, page_version = row
+    etag = conditional_get.etag(user.version, version, page_version)
+
+    if not_modified := conditional_get.not_modified(etag):
+        return not_modified
+
+    following = g.user.following_status([user_id])
+
+    users = paginate_users(
+        query,
+        position=Follow.user_following_id,
+        after=after,
+        per_page=per_page,
+        on_chunk=record_follow_status(following),
+        stream=app.config['STREAM_TEMPLATES'],
+    )
+
+    return render_list(
+        'users/followers.html',
+        user=user,
+        users=users,
+        following=following,
+    )
 
 
 @app.post('/users/follow/<int:follow_id>')
@@ -220,8 +573,16 @@ def start_following(follow_id):
 
         followed_user = User.query.get_or_404(follow_id)
         flash(f"Sucessfully following {followed_user.username}", "success")
-        g.user.following.append(followed_user)
-        db.session.commit()
+
+        if not g.user.is_following(followed_user):
+            db.session.add(Follow(
+                user_being_followed_id=follow_id,
+                user_following_id=g.user.id,
+            ))
+            counters.follow_changed(g.user.id, follow_id, 1)
+            db.session.commit()
+
+        timelines.on_follow(g.user.id, follow_id)
 
         return redirect(f"/users/{g.user.id}/following")
 
@@ -247,9 +608,20 @@ def stop_following(follow_id):
 
         followed_user = User.query.get_or_404(follow_id)
         flash(f"Sucessfully unfollowed {followed_user.username}", "success")
-        g.user.following.remove(followed_user)
+
+        unfollowed = (Follow
+                      .query
+                      .filter_by(user_being_followed_id=follow_id,
+                                 user_following_id=g.user.id)
+                      .delete())
+
+        if unfollowed:
+            counters.follow_changed(g.user.id, follow_id, -1)
+
         db.session.commit()
 
+        timelines.on_unfollow(g.user.id, follow_id)
+
         return redirect(f"/users/{g.user.id}/following")
 
     flash("Invalid request", 'danger')
@@ -280,8 +652,13 @@ def profile():
             g.user.image_url = form.image_url.data
             g.user.header_image_url = form.header_image_url.data
             g.user.bio = form.bio.data
+            # so pages showing them aren't revalidated (see conditional.py)
+            g.user.version = User.version + 1
 
             db.session.commit()
+            user_cache.invalidate(g.user.id)
+            usernames.add(g.user.id, g.user.username)
+            message_cards.on_profile_changed(g.user.id)
 
             return redirect(f"/users/{g.user.id}")
 
@@ -308,9 +685,30 @@ def delete_user():
 
         do_logout()
 
+        user_id = g.user.id
+
+        # messages don't cascade from their author in the ORM, and likes
+        # don't cascade at all, so settle everyone's counts and clear those
+        # rows out first
+        counters.user_deleted(user_id)
+
+        own_message_ids = db.select(Message.id).where(
+            Message.user_id == user_id)
+        Like.query.filter(db.or_(
+            Like.user_id == user_id,
+            Like.message_id.in_(own_message_ids),
+        )).delete(synchronize_session=False)
+        Message.query.filter_by(user_id=user_id).delete()
+
         db.session.delete(g.user)
         db.session.commit()
 
+        user_cache.invalidate(user_id)
+        usernames.remove(user_id)
+        message_search.on_user_deleted(user_id)
+        timelines.on_user_deleted(user_id)
+        message_cards.on_user_deleted(user_id)
+
         return redirect("/signup")
 
     flash("Invalid request", 'danger')
@@ -325,7 +723,29 @@ def get_liked_messages(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/show_liked.html', user=user)
+    before, after = cursor_args()
+
+    liked_ids = set()
+
+    messages = paginate_messages(
+        Message
+        .query
+        .options(joinedload(Message.user))
+        .join(Like)
+        .filter(Like.user_id == user_id),
+        before=before,
+        after=after,
+        per_page=app.config['MESSAGES_PER_PAGE'],
+        on_chunk=record_liked_ids(liked_ids),
+        stream=app.config['STREAM_TEMPLATES'],
+    )
+
+    return render_list(
+        'users/show_liked.html',
+        user=user,
+        messages=messages,
+        liked_ids=liked_ids,
+    )
 
 
 ##############################################################################
@@ -345,16 +765,21 @@ def add_message():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        counters.message_added(g.user.id)
         db.session.commit()
 
+        timelines.on_message_added(msg)
+        message_search.on_message_added(msg)
+
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/create.html', form=form)
 
 
 @app.get('/messages/<int:message_id>')
+@replicas.read_only
 def show_message(message_id):
     """Show a message."""
 
@@ -362,8 +787,62 @@ def show_message(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    row = db.session.execute(
+        db.select(Message, viewer_version())
+        .options(joinedload(Message.user))
+        .where(Message.id == message_id)).first()
+
+    if row is None:
+        abort(404)
+
+    msg, version = row
+    etag = conditional_get.etag(msg.version, msg.user.version, version)
+
+    if not_modified := conditional_get.not_modified(etag):
+        return not_modified
+
+    # the viewer's follow and like of just this message, not every one
+    return render_template(
+        'messages/show.html',
+        message=msg,
+        following=g.user.following_status([msg.user_id]),
+        liked_ids=g.user.liked_message_ids([msg.id]),
+    )
+
+
+@app.get('/messages/search')
+def search_messages():
+    """Search messages by their text.
+
+    Takes the search words in a 'q' param, 'scope' of 'everyone' (the
+    default) or 'following' (you and the people you follow), and an 'after'
+    cursor for the next page of results.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    search = request.args.get('q', '').strip()
+    scope = request.args.get('scope', 'everyone')
+    after = request.args.get('after')
+
+    if not search:
+        messages = []
+    else:
+        messages = message_search.search(
+            search,
+            viewer_id=g.user.id if scope == 'following' else None,
+            after=decode_result_cursor(after) if after else None,
+        )
+
+    return render_template(
+        'messages/search.html',
+        messages=messages,
+        search=search,
+        scope=scope,
+        liked_ids=g.user.liked_message_ids([msg.id for msg in messages]),
+    )
 
 
 @app.post('/messages/<int:message_id>/delete')
@@ -386,8 +865,14 @@ def delete_message(message_id):
 
         if g.user.id == msg.user_id:
 
+            counters.message_deleted(message_id, msg.user_id)
+            Like.query.filter_by(message_id=message_id).delete()
             db.session.delete(msg)
             db.session.commit()
+
+            timelines.on_message_deleted(message_id, g.user.id)
+            message_search.on_message_deleted(message_id)
+            message_cards.on_message_deleted(message_id)
         else:
             flash("Access Unauthorized", 'danger')
 
@@ -413,25 +898,18 @@ def toggle_like(message_id):
 
     if form.validate_on_submit():
 
-        # # TODO: We could potentially abstract this into the model akin to
-        # # is_following() / is_followed_by
-        # # double check the message isn't owned by the current user
-        # if message in g.user.messages:
-        #     # message is owned by user - not allowed; redirect back to home
-        #     flash("Error: Cannot like own messages.", 'danger')
-        #     return redirect(destination)
-
-        # # toggle like status
-        # if message in g.user.liked_messages:
-        #     g.user.liked_messages.remove(message)
-        # else:
-        #     g.user.liked_messages.append(message)
-
-        if not g.user.toggle_like(message):
+        if message.user_id == g.user.id:
             # message is owned by user - not allowed; redirect back to home
             flash("Error: Cannot like own messages.", 'danger')
             return redirect(destination)
 
+        change = g.user.toggle_like(message)
+
+        # a concurrent toggle may already have made this change (change == 0)
+        if change:
+            counters.like_changed(
+                g.user.id, message.id, message.user_id, change)
+
         db.session.commit()
 
         return redirect(destination)
@@ -445,27 +923,46 @@ def toggle_like(message_id):
 
 
 @app.get('/')
+@replicas.read_only
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of self & followed_users
+    - logged in: messages of self & followed_users, newest first, read a
+      page at a time from the user's precomputed home timeline
     """
 
     if g.user:
-        messages = (Message
-                    .query
-                    .filter(db.or_(
-                            Message.user_id == g.user.id,
-                            Message.user_id.in_(
-                                [user.id for user in g.user.following]
-                            )
-                    ))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages)
+        before, after = cursor_args()
+
+        # ask for one extra id so the page knows if there's more to come
+        message_ids = timelines.message_ids(
+            g.user.id,
+            limit=app.config['MESSAGES_PER_PAGE'] + 1,
+            before=before,
+            after=after,
+        )
+
+        # messages come back in arbitrary order; put them in timeline order
+        # (ids of messages deleted along with their author just drop out)
+        found = (Message
+                 .query
+                 .options(joinedload(Message.user))
+                 .filter(Message.id.in_(message_ids))
+                 .all())
+        by_id = {msg.id: msg for msg in found}
+        messages = Page(
+            [by_id[id] for id in message_ids if id in by_id],
+            app.config['MESSAGES_PER_PAGE'],
+            before=before,
+            after=after,
+        )
+
+        return render_template(
+            'home.html',
+            messages=messages,
+            liked_ids=g.user.liked_message_ids([msg.id for msg in messages]),
+        )
 
     else:
         return render_template('home-anon.html')
@@ -473,8 +970,94 @@ def homepage():
 
 @app.after_request
 def add_header(response):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers to responses that haven't set their own
+    (pages with an ETag, static files)."""
 
     # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
+    if 'Cache-Control' not in response.headers:
+        response.cache_control.no_store = True
     return response
+
+
+@app.get('/assets/<path:filename>')
+def show_asset(filename):
+    """A fingerprinted static file (see assets.py)."""
+
+    return assets.send(filename)
+
+
+@app.get('/metrics')
+def show_metrics():
+    """Request metrics for every worker, in Prometheus text format."""
+
+    return app.response_class(
+        metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+metrics.add_collector(
+    'warbler_user_cache_hits_total', 'counter',
+    "Logged-in user lookups answered by the user cache.",
+    lambda: user_cache.stats()['hits'])
+metrics.add_collector(
+    'warbler_user_cache_misses_total', 'counter',
+    "Logged-in user lookups that went to the database.",
+    lambda: user_cache.stats()['misses'])
+metrics.add_collector(
+    'warbler_message_card_hits_total', 'counter',
+    "Message cards served from the fragment cache.",
+    lambda: message_cards.stats()['hits'])
+metrics.add_collector(
+    'warbler_message_card_misses_total', 'counter',
+    "Message cards that had to be rendered.",
+    lambda: message_cards.stats()['misses'])
+metrics.add_collector(
+    'warbler_password_pool_in_use', 'gauge',
+    "Password hashes and checks running or waiting.",
+    lambda: passwords.in_use)
+metrics.add_collector(
+    'warbler_password_pool_rejected_total', 'counter',
+    "Password hashes and checks turned away because the pool was full.",
+    lambda: passwords.rejected)
+
+
+##############################################################################
+# Maintenance commands (run with `flask <command>`)
+
+
+@app.cli.command('recount')
+def recount_command():
+    """Rebuild the stored user and message counts from the database."""
+
+    counters.recount()
+    print("Counts rebuilt.")
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Bring an existing database's schema up to date."""
+
+    names = migrations.migrate()
+    for name in names:
+        print(f"Applied {name}.")
+    print("Schema is up to date.")
+
+
+@app.cli.command('search-indexes')
+def search_indexes_command():
+    """Add the username and message search indexes to an existing database."""
+
+    with db.engine.begin() as connection:
+        create_username_search_indexes(connection)
+        create_message_search_index(connection)
+    print("Search indexes created.")
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and compress the static files for /assets/."""
+
+    manifest = build_assets(app.static_folder, assets.directory)
+    assets.load(assets.directory)
+    print(f"Built {len(manifest['files'])} assets "
+          f"({sum(map(len, manifest['variants'].values()))} resized images) "
+          f"in {assets.directory}.")
@@ -0,0 +1,304 @@
+"""Fingerprinted, precompressed static files.
+
+Files under static/ used to be served by Flask's static route, which makes
+the browser revalidate each of them on every page. Instead, `flask
+build-assets` copies each of them into ASSET_DIR under a name that includes
+a hash of its contents (style.css -> style.3f2a1b9c0d.css), along with:
+
+- gzip and brotli compressed copies of text files (CSS, icons, ...), so they
+  aren't compressed again on every request
+- downscaled versions of the big JPEGs (IMAGE_VARIANTS), so a small card or
+  phone doesn't download a 1920px photo
+- manifest.json, mapping each original path to its fingerprinted file
+
+A fingerprinted file's URL changes whenever its contents do, so it's served
+from `/assets/` with a year-long `immutable` Cache-Control: the browser
+never asks about it again. References between files (`url(...)` in CSS)
+are rewritten to the fingerprinted URLs before the CSS itself is hashed,
+so changing an image changes the URL of the stylesheet that uses it too.
+
+Templates ask for files with `asset_url('stylesheets/style.css')` (or
+a "/static/..." URL, like the stored profile images). Without a built
+manifest (or for files that aren't in it) that's just the Flask static URL,
+so development works without building anything.
+
+Old fingerprinted files are left in ASSET_DIR, for pages still open from
+before a deploy.
+
+Brotli and downscaling need the brotli and Pillow packages; without them,
+the build skips those steps.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+
+from flask import request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+ASSET_DIR = 'assets'
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+# files worth compressing (images are compressed already)
+COMPRESSIBLE = {'.css', '.js', '.ico', '.svg', '.txt', '.json', '.map'}
+
+# image -> widths of the downscaled versions to make
+IMAGE_VARIANTS = {
+    'images/warbler-hero.jpg': (640, 1280),
+    'images/signed-out-home.jpg': (480,),
+}
+
+JPEG_QUALITY = 82
+
+# url(...) references to static files in CSS
+CSS_URL = re.compile(r"""url\(\s*(['"]?)/static/([^'")?#]+)\1\s*\)""")
+
+# (file extension, Content-Encoding), best first
+ENCODINGS = [('.br', 'br'), ('.gz', 'gzip')]
+
+
+##############################################################################
+# Building
+
+
+def fingerprint(path, data):
+    """`path` with a hash of `data` before its extension."""
+
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def build(static_folder, out_dir, variants=IMAGE_VARIANTS):
+    """Fingerprint, compress and downscale every file under
+    `static_folder` into `out_dir`, and write its manifest.json.
+
+    Returns the manifest.
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = dict(files={}, variants={})
+    paths = []
+
+    for root, dirs, files in os.walk(static_folder):
+        for name in files:
+            paths.append(os.path.relpath(os.path.join(root, name),
+                                         static_folder).replace(os.sep, '/'))
+
+    # CSS last, so the files it refers to already have their new names
+    for path in sorted(paths, key=lambda path: (path.endswith('.css'), path)):
+        with open(os.path.join(static_folder, path), 'rb') as file:
+            data = file.read()
+
+        if path.endswith('.css'):
+            data = _rewrite_css(data.decode(), manifest['files']).encode()
+
+        manifest['files'][path] = _write(out_dir, path, data)
+
+        if Image is not None and path in variants:
+            manifest['variants'][path] = {
+                str(width): _write(out_dir, name, data)
+                for width, name, data in _downscale(
+                    os.path.join(static_folder, path), path, variants[path])}
+
+    temp = os.path.join(out_dir, "manifest.json.tmp")
+    with open(temp, 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(temp, os.path.join(out_dir, "manifest.json"))
+
+    return manifest
+
+
+def _write(out_dir, path, data):
+    """Write `data` as the fingerprinted `path` (and its compressed
+    copies) in `out_dir`; returns the fingerprinted path."""
+
+    name = fingerprint(path, data)
+    target = os.path.join(out_dir, name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    with open(target, 'wb') as file:
+        file.write(data)
+
+    if os.path.splitext(path)[1] in COMPRESSIBLE:
+        compressed = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed['.br'] = brotli.compress(data)
+
+        for ext, packed in compressed.items():
+            if len(packed) < len(data):
+                with open(target + ext, 'wb') as file:
+                    file.write(packed)
+
+    return name
+
+
+def _downscale(source, path, widths):
+    """(width, path, JPEG data) for each of `widths` narrower than the
+    image at `source`."""
+
+    stem, ext = os.path.splitext(path)
+
+    with Image.open(source) as image:
+        for width in sorted(widths):
+            if width >= image.width:
+                continue
+
+            height = round(image.height * width / image.width)
+            small = image.convert('RGB').resize((width, height),
+                                                Image.LANCZOS)
+
+            output = io.BytesIO()
+            small.save(output, 'JPEG', quality=JPEG_QUALITY,
+                       optimize=True, progressive=True)
+
+            yield width, f"{stem}-{width}{ext}", output.getvalue()
+
+
+def _rewrite_css(css, files):
+    """`css` with its url(/static/...) references pointing at the
+    fingerprinted `files`."""
+
+    def replace(match):
+        path = match.group(2)
+
+        if path not in files:
+            return match.group(0)
+
+        return f'url("/assets/{files[path]}")'
+
+    return CSS_URL.sub(replace, css)
+
+
+##############################################################################
+# Serving
+
+
+class Assets:
+    """Looks up fingerprinted files in a built manifest, and serves them."""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.files = {}
+        self.variants = {}
+
+        # changes whenever the manifest does (None without one)
+        self.version = None
+
+        if directory:
+            self.load(directory)
+
+    def load(self, directory):
+        """Use the manifest built into `directory` (none there: serve
+        everything from /static)."""
+
+        self.directory = directory
+        self.files = {}
+        self.variants = {}
+        self.version = None
+
+        try:
+            with open(os.path.join(directory, "manifest.json"), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return
+
+        manifest = json.loads(data)
+        self.version = hashlib.sha256(data).hexdigest()[:10]
+
+        self.files = manifest['files']
+        self.variants = {
+            path: sorted((int(width), name) for width, name in sizes.items())
+            for path, sizes in manifest['variants'].items()}
+
+    def url(self, path, width=None):
+        """URL of the static file `path` ('images/x.png' or
+        '/static/images/x.png').
+
+        With `width`, the smallest downscaled version at least that wide,
+        if there is one. Anything that isn't a static file (an external
+        image URL) is returned as it is.
+        """
+
+        if not path or '://' in path:
+            return path
+
+        is_url = path.startswith('/')
+
+        if is_url and not path.startswith('/static/'):
+            return path
+
+        path = path.removeprefix('/static/')
+        name = self.files.get(path)
+
+        if name is None:
+            return f"/static/{path}" if is_url else url_for(
+                'static', filename=path)
+
+        if width is not None:
+            for variant_width, variant in self.variants.get(path, []):
+                if variant_width >= width:
+                    name = variant
+                    break
+
+        return f"/assets/{name}"
+
+    def send(self, filename):
+        """Response for /assets/`filename`, precompressed if the browser
+        takes it, cached for good."""
+
+        mimetype = None
+        encoding = None
+        sent = filename
+
+        for ext, name in ENCODINGS:
+            if (request.accept_encodings[name]
+                    and os.path.isfile(os.path.join(self.directory,
+                                                    filename + ext))):
+                sent = filename + ext
+                encoding = name
+                break
+
+        if encoding:
+            # the type of what's inside, not of a .br/.gz file
+            mimetype = (mimetypes.guess_type(filename)[0]
+                        or 'application/octet-stream')
+
+        response = send_from_directory(
+            self.directory, sent, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.immutable = True
+
+        return response
+
+
+def connect_assets(app):
+    """Set up fingerprinted assets for `app`.
+
+    ASSET_DIR is where `flask build-assets` writes them (relative to the
+    app); `asset_url` is added to the templates.
+    """
+
+    directory = os.path.join(app.root_path,
+                             app.config.get('ASSET_DIR', ASSET_DIR))
+
+    assets = Assets(directory)
+    app.jinja_env.globals['asset_url'] = assets.url
+    app.extensions['assets'] = assets
+
+    return assets
@@ -0,0 +1,134 @@
+"""Login bursts: bcrypt inline in each request vs. on the password pool.
+
+Simulates bursts of `--concurrency` simultaneous password checks arriving
+at one web worker process, one caller thread per request (as a threaded
+worker would run them), both ways:
+
+- inline: each request runs its own bcrypt check
+- pool:   each request hands its check to the PasswordPool and waits for
+          the result; the pool runs `--workers` (default: one per core) at
+          once and turns away requests that can't get a place in its queue
+          (counted as "busy"; they'd get a 503 asking them to retry)
+
+The request thread is tied up for its whole check either way, so the pool
+doesn't get more logins through. What it changes is how much CPU a burst
+can take ("cores": CPU seconds used per second, which inline grows with the
+burst, up to every core) and what happens past that: inline, every check
+slows down; on the pool, the ones it has no room for are turned away
+quickly instead. Try a `--workers` below the number of cores to see the
+cap.
+
+No database or HTTP is involved; this measures only the hashing part of a
+login, which is nearly all of its cost. "cores" only counts this process,
+so it isn't shown for `--kind process`.
+
+Run from the project root:
+
+    python -m benchmarks.bench_login --rounds 10 --logins 200
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+
+import bcrypt
+
+from passwords import PasswordPool, PasswordPoolBusy
+
+
+def burst(check, concurrency, logins):
+    """Run `logins` checks from `concurrency` threads.
+
+    Returns (logins/sec, p95 latency in ms, number turned away, CPU seconds
+    used per second).
+    """
+
+    latencies = []
+    busy = [0]
+    lock = threading.Lock()
+    per_thread = logins // concurrency
+
+    def requester():
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            try:
+                check()
+            except PasswordPoolBusy:
+                with lock:
+                    busy[0] += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=requester) for _ in range(concurrency)]
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    cores = (time.process_time() - cpu_start) / elapsed
+
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    return len(latencies) / elapsed, p95 * 1000, busy[0], cores
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rounds", type=int, default=10,
+                        help="bcrypt work factor (production uses 12)")
+    parser.add_argument("--logins", type=int, default=128)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="pool size (default: one per core)")
+    parser.add_argument("--max-waiting", type=int, default=None)
+    parser.add_argument("--kind", choices=["thread", "process"],
+                        default="thread")
+    args = parser.parse_args()
+
+    pool = PasswordPool(workers=args.workers, max_waiting=args.max_waiting,
+                        wait=0.5, rounds=args.rounds, kind=args.kind)
+    pw_hash = pool.hash("password")
+
+    single = statistics.median(
+        timed(bcrypt.checkpw, b"password", pw_hash.encode())
+        for _ in range(5))
+
+    print(f"{os.cpu_count()} cores, work factor {args.rounds} "
+          f"({single * 1000:.0f}ms per check), pool of {pool.workers} "
+          f"{args.kind}s with room for {pool.max_waiting} more waiting")
+    print()
+    print(f"{'concurrency':<13}{'inline/s':>9}{'p95':>9}{'cores':>7}"
+          f"{'pool/s':>9}{'p95':>9}{'cores':>7}{'busy':>6}")
+
+    for concurrency in [1, 2, 4, 8, 16, 32]:
+        if concurrency > args.logins:
+            break
+
+        inline = burst(lambda: bcrypt.checkpw(b"password", pw_hash.encode()),
+                       concurrency, args.logins)
+        pooled = burst(lambda: pool.check(pw_hash, "password"),
+                       concurrency, args.logins)
+        pool_cores = (f"{pooled[3]:>7.1f}" if args.kind == "thread"
+                      else f"{'-':>7}")
+
+        print(f"{concurrency:<13}{inline[0]:>9.1f}{inline[1]:>7.0f}ms"
+              f"{inline[3]:>7.1f}{pooled[0]:>9.1f}{pooled[1]:>7.0f}ms"
+              f"{pool_cores}{pooled[2]:>6}")
+
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
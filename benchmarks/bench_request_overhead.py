@@ -0,0 +1,141 @@
+"""Measure the fixed per-request cost of Warbler's request setup.
+
+Compares:
+
+- eager: the old before_request, which looked up the logged-in user and
+         built a CSRF form (and its token) on every request
+- lazy:  today's, where `g.user` and `g.csrf_form` load on first use
+
+on requests that use neither (anonymous pages, unauthorized redirects) and,
+for reference, on ones that use both.
+
+Run from the project root (uses a throwaway SQLite database):
+
+    python -m benchmarks.bench_request_overhead --requests 2000
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+DB_FILE = tempfile.NamedTemporaryFile(suffix=".sqlite", delete=False).name
+os.environ['DATABASE_URL'] = f"sqlite:///{DB_FILE}"
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+from flask import g  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app import app, user_cache, CURR_USER_KEY  # noqa: E402
+from models import db, User  # noqa: E402
+
+# (name, url, logged in?)
+CASES = [
+    ("anon home", "/", False),
+    ("anon redirect", "/users", False),
+    ("logged-in home", "/", True),
+    ("logged-in 404", "/users/999999", True),
+]
+
+
+ROUNDS = 10
+
+EAGER = False
+
+
+@app.before_request
+def eager_setup():
+    """What add_user_to_g used to do up front (when EAGER is on)."""
+
+    if EAGER:
+        g.user
+        g.csrf_form
+
+
+def run(client, url, num_requests):
+    """Per-request times (in seconds) for `num_requests` GETs of `url`."""
+
+    times = []
+
+    for _ in range(num_requests):
+        start = time.perf_counter()
+        client.get(url)
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--no-user-cache", action="store_true",
+                        help="look the user up in the database every time")
+    args = parser.parse_args()
+
+    db.engine.echo = False
+    db.drop_all()
+    db.create_all()
+
+    user = User(username="bench", email="bench@example.com", password="x")
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+
+    if args.no_user_cache:
+        user_cache.ttl = 0
+
+    queries = []
+    event.listen(db.engine, 'before_cursor_execute',
+                 lambda *args: queries.append(args))
+
+    # anonymous visitors arrive without a session cookie (so a CSRF token
+    # has to be made and a session cookie set for them every time)
+    clients = {False: app.test_client(use_cookies=False),
+               True: app.test_client()}
+    with clients[True].session_transaction() as sess:
+        sess[CURR_USER_KEY] = user_id
+
+    global EAGER
+    times = {}
+    query_counts = {}
+
+    # alternate between the modes in short rounds, so drift in machine
+    # speed hits both alike
+    for name, url, logged_in in CASES:
+        client = clients[logged_in]
+        run(client, url, 50)  # warm up
+
+        for mode in ["eager", "lazy"]:
+            EAGER = mode == "eager"
+            del queries[:]
+            run(client, url, 10)
+            query_counts[mode, name] = len(queries) / 10
+
+        for _ in range(ROUNDS):
+            for mode in ["eager", "lazy"]:
+                EAGER = mode == "eager"
+                times.setdefault((mode, name), []).extend(
+                    run(client, url, args.requests // ROUNDS))
+
+    print(f"{args.requests} requests per case"
+          + (", user cache off" if args.no_user_cache else ""))
+    print()
+    print(f"{'case':<16}{'eager µs':>10}{'lazy µs':>10}{'saved':>8}"
+          f"{'eager q/req':>13}{'lazy q/req':>12}")
+
+    for name, _, _ in CASES:
+        eager_us = statistics.median(times["eager", name]) * 1e6
+        lazy_us = statistics.median(times["lazy", name]) * 1e6
+        eager_queries = query_counts["eager", name]
+        lazy_queries = query_counts["lazy", name]
+
+        print(f"{name:<16}{eager_us:>10.0f}{lazy_us:>10.0f}"
+              f"{(eager_us - lazy_us) / eager_us:>8.0%}"
+              f"{eager_queries:>13.2f}{lazy_queries:>12.2f}")
+
+    os.unlink(DB_FILE)
+
+
+if __name__ == "__main__":
+    main()
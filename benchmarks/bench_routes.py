@@ -0,0 +1,308 @@
+"""Latency, throughput and query counts of Warbler's main routes.
+
+Seeds a dataset of the chosen size (made by generator/create_csvs.py and
+loaded with bulk_load), then times a run of requests to each of:
+
+    homepage, show_user, show_followers, list_users,   (reads)
+    toggle_like, add_message, login                    (writes)
+
+as the user who follows the most people, looking at the most-followed
+user. Reports p50 / p90 / p99 latency, requests per second (one client, one
+request at a time) and database queries per request.
+
+Results can be saved as JSON (--output). If a baseline exists for the
+database and size (benchmarks/baselines/<database>-<size>.json, or
+--baseline), each route is checked against it, and the run exits with
+status 1 if any got slower by more than --tolerance at p50 or p90, or makes
+more queries. --update-baseline saves this run as the new baseline.
+
+Timings only compare on the same machine, so no baselines are committed:
+make one on the machine that will run the comparison, from the commit to
+compare against, with the same size and database:
+
+    git checkout main
+    python -m benchmarks.bench_routes --size 100k --update-baseline
+    git checkout -
+    python -m benchmarks.bench_routes --size 100k
+
+Run from the project root. By default it uses a throwaway SQLite database;
+pass --database to use PostgreSQL instead (everything in it is dropped):
+
+    python -m benchmarks.bench_routes --size 100k
+    python -m benchmarks.bench_routes --size 1m \\
+        --database postgresql:///warbler_bench --output results.json
+
+With --no-seed, a database seeded by an earlier run of the same size is
+used as it is.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# number of messages; users, follows and likes scale with it
+SIZES = {
+    '1k': 1000,
+    '100k': 100000,
+    '1m': 1000000,
+}
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines')
+
+PASSWORD = "password"  # of every generated user
+
+
+def dataset_args(messages):
+    """Sizes to pass to the generator for `messages` messages."""
+
+    return ["--messages", str(messages),
+            "--users", str(max(100, messages // 10)),
+            "--follows", str(messages * 2),
+            "--likes", str(messages)]
+
+
+def seed(messages, seed_value):
+    """Generate a dataset and bulk load it; returns the load's Steps."""
+
+    from bulk_load import load
+
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run(
+            [sys.executable, "generator/create_csvs.py", "--out", directory,
+             "--seed", str(seed_value), *dataset_args(messages)],
+            check=True, stderr=subprocess.DEVNULL)
+
+        return load(directory, parallel=True)
+
+
+def cases(ids):
+    """(route, method, url, form data) for each route to time."""
+
+    return [
+        ("homepage", "GET", "/", None),
+        ("show_user", "GET", f"/users/{ids['popular']}", None),
+        ("show_followers", "GET", f"/users/{ids['popular']}/followers", None),
+        ("list_users", "GET", "/users", None),
+        ("toggle_like", "POST",
+         f"/messages/{ids['message']}/toggle_like?page=", None),
+        ("add_message", "POST", "/messages/new", {"text": "Benchmarking."}),
+        ("login", "POST", "/login",
+         {"username": ids['username'], "password": PASSWORD}),
+    ]
+
+
+def run(client, method, url, data, num_requests, queries):
+    """(per-request seconds, queries made, errors) for `num_requests`."""
+
+    times = []
+    errors = 0
+    del queries[:]
+
+    for _ in range(num_requests):
+        start = time.perf_counter()
+        resp = client.open(url, method=method, data=data)
+        resp.get_data()
+        resp.close()
+        times.append(time.perf_counter() - start)
+
+        if resp.status_code >= 400:
+            errors += 1
+
+    return times, len(queries), errors
+
+
+def summarize(times, num_queries, errors):
+    cuts = statistics.quantiles(times, n=100, method='inclusive')
+
+    return dict(
+        requests=len(times),
+        errors=errors,
+        p50_ms=cuts[49] * 1000,
+        p90_ms=cuts[89] * 1000,
+        p99_ms=cuts[98] * 1000,
+        mean_ms=statistics.fmean(times) * 1000,
+        requests_per_second=len(times) / sum(times),
+        queries_per_request=num_queries / len(times),
+    )
+
+
+def regressions(results, baseline, tolerance):
+    """Descriptions of every way `results` is worse than `baseline`."""
+
+    found = []
+
+    for route, now in results['routes'].items():
+        then = baseline['routes'].get(route)
+        if then is None:
+            continue
+
+        for stat in ['p50_ms', 'p90_ms']:
+            if now[stat] > then[stat] * (1 + tolerance):
+                found.append(f"{route}: {stat} {then[stat]:.1f} -> "
+                             f"{now[stat]:.1f}")
+
+        if now['queries_per_request'] > then['queries_per_request'] + 0.5:
+            found.append(f"{route}: queries/request "
+                         f"{then['queries_per_request']:.1f} -> "
+                         f"{now['queries_per_request']:.1f}")
+
+    return found
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--size", choices=SIZES, default="1k",
+                        help="number of messages in the dataset")
+    parser.add_argument("--database",
+                        help="database URL (default: a throwaway SQLite "
+                             "file)")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="timed requests per route")
+    parser.add_argument("--login-requests", type=int, default=20,
+                        help="timed requests for login (each runs bcrypt)")
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="untimed requests per route first")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for the generated dataset")
+    parser.add_argument("--no-seed", action="store_true",
+                        help="use the database as it is")
+    parser.add_argument("--output", help="file to save results to, as JSON")
+    parser.add_argument("--baseline",
+                        help="results file to compare against (default: "
+                             "benchmarks/baselines/<database>-<size>.json)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="save these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="how much slower counts as a regression")
+    args = parser.parse_args()
+
+    db_file = None
+    if args.database is None:
+        db_file = tempfile.NamedTemporaryFile(
+            suffix=".sqlite", delete=False).name
+        args.database = f"sqlite:///{db_file}"
+
+    os.environ['DATABASE_URL'] = args.database
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+    from sqlalchemy import event
+
+    from app import app, timelines, message_cards, CURR_USER_KEY
+    from models import db, User, Message
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    db.engine.echo = False
+    dialect = db.engine.dialect.name
+
+    if not args.no_seed:
+        print(f"Seeding {args.size} on {dialect}...", file=sys.stderr)
+        for step in seed(SIZES[args.size], args.seed):
+            rate = f" ({step.rate:,.0f} rows/s)" if step.rows else ""
+            print(f"  {step.name}: {step.seconds:.1f}s{rate}",
+                  file=sys.stderr)
+
+        # timelines are keyed by user id, and the ids have all been reused
+        timelines.store.clear()
+        message_cards.store.clear()
+
+    viewer = User.query.order_by(User.following_count.desc()).first()
+    ids = dict(
+        username=viewer.username,
+        popular=db.session.scalar(
+            db.select(User.id).order_by(User.followers_count.desc())),
+        message=db.session.scalar(
+            db.select(Message.id)
+            .where(Message.user_id != viewer.id)
+            .order_by(Message.timestamp.desc())),
+    )
+    viewer_id = viewer.id
+    db.session.commit()
+
+    queries = []
+    event.listen(db.engine, 'before_cursor_execute',
+                 lambda *args: queries.append(args))
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = viewer_id
+
+    results = dict(
+        database=dialect,
+        size=args.size,
+        commit=git_commit(),
+        python=platform.python_version(),
+        started=datetime.now().isoformat(timespec='seconds'),
+        routes={},
+    )
+
+    for route, method, url, data in cases(ids):
+        num_requests = (args.login_requests if route == "login"
+                        else args.requests)
+
+        run(client, method, url, data, args.warmup, queries)
+        results['routes'][route] = summarize(
+            *run(client, method, url, data, num_requests, queries))
+
+    print(f"{args.size} messages on {dialect}")
+    print()
+    print(f"{'route':<16}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}"
+          f"{'req/s':>9}{'q/req':>8}{'errors':>8}")
+
+    for route, stats in results['routes'].items():
+        print(f"{route:<16}{stats['p50_ms']:>9.1f}{stats['p90_ms']:>9.1f}"
+              f"{stats['p99_ms']:>9.1f}{stats['requests_per_second']:>9.0f}"
+              f"{stats['queries_per_request']:>8.1f}{stats['errors']:>8}")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    baseline_path = args.baseline or os.path.join(
+        BASELINES, f"{dialect}-{args.size}.json")
+    found = []
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(baseline_path) or ".", exist_ok=True)
+        with open(baseline_path, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"\nSaved baseline {baseline_path}")
+
+    elif os.path.exists(baseline_path):
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+
+        found = regressions(results, baseline, args.tolerance)
+        print(f"\nCompared with {baseline_path} "
+              f"(commit {baseline.get('commit')}): "
+              f"{len(found) or 'no'} regressions")
+        for regression in found:
+            print(f"  {regression}")
+
+    else:
+        print(f"\nNo baseline at {baseline_path} to compare with "
+              f"(--update-baseline saves one)")
+
+    if db_file:
+        os.unlink(db_file)
+
+    sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Buffered vs. streamed rendering of big list pages.
+
+For each list page and page size, renders the page:
+
+- buffered: render_template, the whole page loaded and rendered in memory
+            before the first byte is sent
+- streamed: stream_template over a server-side cursor (STREAM_TEMPLATES)
+
+and reports time to first byte, total time, and peak Python memory while
+serving the request (measured in a separate run, under tracemalloc).
+
+Run from the project root (uses a throwaway SQLite database):
+
+    python -m benchmarks.bench_streaming --sizes 1000,10000,100000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+DB_FILE = tempfile.NamedTemporaryFile(suffix=".sqlite", delete=False).name
+os.environ['DATABASE_URL'] = f"sqlite:///{DB_FILE}"
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+from app import app, CURR_USER_KEY  # noqa: E402
+from models import db, User, Message, Follow, Like  # noqa: E402
+
+
+def seed(num_rows):
+    """`num_rows` users, all following user 1, each with a message user 1
+    liked."""
+
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(db.insert(User), [
+        dict(id=i, email=f"user{i}@example.com", username=f"user{i}",
+             password="x")
+        for i in range(1, num_rows + 2)
+    ])
+    db.session.execute(db.insert(Follow), [
+        dict(user_being_followed_id=1, user_following_id=i)
+        for i in range(2, num_rows + 2)
+    ])
+
+    start = datetime(2023, 1, 1)
+    db.session.execute(db.insert(Message), [
+        dict(id=i, text=f"message {i}", user_id=i,
+             timestamp=start + timedelta(seconds=i))
+        for i in range(2, num_rows + 2)
+    ])
+    db.session.execute(db.insert(Like), [
+        dict(user_id=1, message_id=i) for i in range(2, num_rows + 2)
+    ])
+    db.session.commit()
+
+
+def fetch(client, url):
+    """(seconds to first byte, seconds to last byte, bytes) for GET url."""
+
+    start = time.perf_counter()
+    resp = client.get(url, buffered=False)
+
+    chunks = iter(resp.response)
+    size = len(next(chunks, b""))
+    first = time.perf_counter() - start
+
+    for chunk in chunks:
+        size += len(chunk)
+    resp.close()
+
+    return first, time.perf_counter() - start, size
+
+
+def peak_memory(client, url):
+    """Peak bytes allocated by Python while serving GET url."""
+
+    db.session.expunge_all()
+    tracemalloc.start()
+    fetch(client, url)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma-separated page sizes (rows) to try")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    db.engine.echo = False
+    seed(max(sizes))
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = 1
+
+    pages = [
+        ("users", "/users"),
+        ("followers", "/users/1/followers"),
+        ("liked", "/users/1/liked_messages"),
+    ]
+
+    print(f"{'page':<11}{'rows':>8}{'mode':>10}{'first byte':>12}"
+          f"{'total':>10}{'peak mem':>11}{'size':>10}")
+
+    for name, url in pages:
+        for size in sizes:
+            app.config['USERS_PER_PAGE'] = size
+            app.config['MESSAGES_PER_PAGE'] = size
+
+            for mode in ["buffered", "streamed"]:
+                app.config['STREAM_TEMPLATES'] = mode == "streamed"
+
+                db.session.expunge_all()
+                first, total, num_bytes = fetch(client, url)
+                peak = peak_memory(client, url)
+
+                print(f"{name:<11}{size:>8}{mode:>10}"
+                      f"{first * 1000:>10.0f}ms{total * 1000:>8.0f}ms"
+                      f"{peak / 2 ** 20:>9.1f}MB"
+                      f"{num_bytes / 2 ** 20:>8.1f}MB")
+
+    os.unlink(DB_FILE)
+
+
+if __name__ == "__main__":
+    main()
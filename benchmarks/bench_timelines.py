@@ -0,0 +1,216 @@
+"""Compare pull, push and hybrid home timelines on a power-law follow graph.
+
+- pull:   today's query over everyone the viewer follows, on every read
+- push:   every post is fanned out to all followers' timelines on write
+- hybrid: push, except for accounts above --threshold followers, whose
+          posts are merged in from their outbox at read time
+
+Run from the project root (uses a throwaway SQLite database):
+
+    python -m benchmarks.bench_timelines --users 5000 --threshold 250
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DB_FILE = tempfile.NamedTemporaryFile(suffix=".sqlite", delete=False).name
+os.environ['DATABASE_URL'] = f"sqlite:///{DB_FILE}"
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+from app import app  # noqa: E402
+from models import db, User, Message, Follow  # noqa: E402
+from counters import recount  # noqa: E402
+from timelines import HomeTimelines, MemoryTimelineStore  # noqa: E402
+
+
+class CountingStore(MemoryTimelineStore):
+    """Memory store that counts how many timelines each write touches."""
+
+    pushed = 0
+
+    def push(self, keys, entry):
+        self.pushed += len(keys)
+        super().push(keys, entry)
+
+
+def seed(num_users, num_messages, avg_following, alpha, rng):
+    """Fill the database with users, a power-law follow graph and messages.
+
+    User popularity follows a Zipf-like law: the user with popularity rank r
+    is picked as a follow target with weight 1 / r ** alpha.
+    """
+
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(db.insert(User), [
+        dict(email=f"user{i}@example.com", username=f"user{i}",
+             password="x")
+        for i in range(1, num_users + 1)
+    ])
+
+    user_ids = list(range(1, num_users + 1))
+    ranked = user_ids[:]
+    rng.shuffle(ranked)
+    weights = [1 / (rank ** alpha) for rank in range(1, num_users + 1)]
+
+    follows = []
+    for follower in user_ids:
+        count = min(num_users - 1,
+                    max(1, int(rng.expovariate(1 / avg_following))))
+        targets = set(rng.choices(ranked, weights, k=count))
+        targets.discard(follower)
+        follows.extend(dict(user_following_id=follower,
+                            user_being_followed_id=followed)
+                       for followed in targets)
+
+    db.session.execute(db.insert(Follow), follows)
+
+    start = datetime.utcnow() - timedelta(days=30)
+    db.session.execute(db.insert(Message), [
+        dict(text="history",
+             user_id=rng.choice(user_ids),
+             timestamp=start + timedelta(seconds=rng.uniform(0, 30 * 86400)))
+        for _ in range(num_messages)
+    ])
+
+    db.session.commit()
+    recount()
+
+    return len(follows)
+
+
+def pull_read(user_id, limit):
+    """The homepage query as it was before precomputed timelines."""
+
+    followed_ids = (db.session
+                    .query(Follow.user_being_followed_id)
+                    .filter(Follow.user_following_id == user_id))
+
+    return (Message
+            .query
+            .filter(db.or_(Message.user_id == user_id,
+                           Message.user_id.in_(followed_ids)))
+            .order_by(Message.timestamp.desc())
+            .limit(limit)
+            .all())
+
+
+def timeline_read(timelines, user_id, limit):
+    """The homepage read path with a precomputed timeline."""
+
+    message_ids = timelines.message_ids(user_id, limit)
+    return Message.query.filter(Message.id.in_(message_ids)).all()
+
+
+def percentiles(samples):
+    """(p50, p95, max) of `samples`, in milliseconds."""
+
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    return (statistics.median(samples) * 1000, p95 * 1000,
+            samples[-1] * 1000)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--posts", type=int, default=500,
+                        help="new messages written during the write phase")
+    parser.add_argument("--reads", type=int, default=300)
+    parser.add_argument("--avg-following", type=int, default=40)
+    parser.add_argument("--alpha", type=float, default=1.1,
+                        help="power-law exponent of user popularity")
+    parser.add_argument("--threshold", type=int, default=250,
+                        help="follower count above which hybrid mode pulls")
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    db.engine.echo = False
+
+    num_follows = seed(args.users, args.messages, args.avg_following,
+                       args.alpha, rng)
+
+    follower_counts = sorted(
+        (count for _, count in (db.session
+                                .query(Follow.user_being_followed_id,
+                                       db.func.count())
+                                .group_by(Follow.user_being_followed_id)
+                                .all())),
+        reverse=True)
+    pulled = sum(1 for count in follower_counts if count > args.threshold)
+
+    print(f"{args.users} users, {num_follows} follows, "
+          f"{args.messages} messages (db: {DB_FILE})")
+    print(f"most followed: {follower_counts[:5]}; "
+          f"{pulled} accounts above the hybrid threshold of {args.threshold}")
+    print()
+
+    readers = [rng.randint(1, args.users) for _ in range(args.reads)]
+    authors = [rng.randint(1, args.users) for _ in range(args.posts)]
+
+    results = {}
+
+    results['pull'] = dict(
+        write=[0.0],
+        read=[timed(pull_read, user_id, args.limit) for user_id in readers],
+        pushed=0)
+
+    modes = [('push', None), ('hybrid', args.threshold)]
+    for name, threshold in modes:
+        store = CountingStore()
+        timelines = HomeTimelines(store, fanout_threshold=threshold)
+
+        for user_id in range(1, args.users + 1):
+            timelines.rebuild(user_id)
+
+        # the same new messages are posted in each mode, so undo the last
+        # mode's posts before writing them again
+        Message.query.filter(Message.text == "new post").delete()
+        db.session.commit()
+
+        writes = []
+        for author_id in authors:
+            msg = Message(text="new post", user_id=author_id)
+            db.session.add(msg)
+            db.session.commit()
+            writes.append(timed(timelines.on_message_added, msg))
+
+        reads = [timed(timeline_read, timelines, user_id, args.limit)
+                 for user_id in readers]
+
+        results[name] = dict(write=writes, read=reads, pushed=store.pushed)
+
+    print(f"{'mode':<8}{'write p50':>11}{'write p95':>11}{'write max':>11}"
+          f"{'read p50':>11}{'read p95':>11}{'read max':>11}"
+          f"{'entries/post':>14}")
+
+    for name, result in results.items():
+        write = percentiles(result['write'])
+        read = percentiles(result['read'])
+        per_post = result['pushed'] / args.posts
+
+        print(f"{name:<8}"
+              + "".join(f"{ms:>9.2f}ms" for ms in write + read)
+              + f"{per_post:>14.1f}")
+
+    os.unlink(DB_FILE)
+
+
+if __name__ == "__main__":
+    main()
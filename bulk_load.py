@@ -0,0 +1,303 @@
+"""Bulk loading of CSV data into a fresh database, for `seed.py`.
+
+Reading every row through the ORM (`bulk_insert_mappings` over a
+DictReader) is far too slow for a realistic dataset. Instead each table is
+filled from `<table name>.csv` in one go:
+
+- On PostgreSQL the file is streamed straight into the table with COPY, a
+  buffer at a time, without Python ever looking at a row.
+- Elsewhere (SQLite) rows are read in chunks of `chunk_size` and inserted
+  with one executemany per chunk.
+
+Either way, a table's indexes and constraints are dropped before it is
+filled and put back afterwards, so each index is built once from the loaded
+rows instead of being updated row by row. On PostgreSQL that's every index,
+unique constraint and foreign key that isn't a primary key (read back from
+the catalog, so the search indexes are included). SQLite can't drop a
+constraint, so there it's just the indexes; it doesn't check foreign keys
+unless asked to anyway.
+
+Tables are loaded in dependency order. With `parallel`, tables that don't
+reference each other (messages and follows) are loaded at the same time,
+each on its own connection; SQLite only allows one writer at a time, so
+there `parallel` is ignored.
+
+Each table commits on its own, so a load that fails part way leaves a
+partly loaded database; run it again (it starts by dropping everything).
+"""
+
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.schema import CreateIndex
+
+import counters
+from models import db
+
+CSV_DIRECTORY = 'generator'
+
+CHUNK_SIZE = 10000
+
+# bytes per read when streaming a file to COPY
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# non-primary-key indexes, except those backing a constraint
+PG_INDEXES_SQL = db.text("""
+    SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+    FROM pg_index i
+    WHERE i.indrelid::regclass::text = ANY(:tables)
+      AND NOT EXISTS (
+          SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+""")
+
+# foreign keys and unique constraints, foreign keys first
+PG_CONSTRAINTS_SQL = db.text("""
+    SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+    FROM pg_constraint
+    WHERE contype IN ('f', 'u')
+      AND conrelid::regclass::text = ANY(:tables)
+    ORDER BY contype = 'f' DESC
+""")
+
+
+class Step:
+    """How long one step of a load took, and how many rows it wrote."""
+
+    def __init__(self, name, seconds, rows=None):
+        self.name = name
+        self.seconds = seconds
+        self.rows = rows
+
+    @property
+    def rate(self):
+        """Rows per second, or None for steps that don't load rows."""
+
+        if self.rows is None:
+            return None
+
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+
+def load(directory=CSV_DIRECTORY, parallel=False, chunk_size=CHUNK_SIZE,
+         use_copy=None):
+    """Recreate every table and fill them from the CSV files in `directory`.
+
+    Tables without a CSV file are left empty. Column defaults set in
+    Python aren't applied, so a file must have every non-null column that
+    lacks a server default. `use_copy` defaults to
+    whether the database is PostgreSQL. Stored counts are rebuilt at the
+    end.
+
+    Returns a list of Steps, one per table loaded plus the recount and the
+    index rebuild.
+    """
+
+    tables = [table for table in db.metadata.sorted_tables
+              if os.path.exists(_csv_path(directory, table))]
+
+    # check every file's columns before dropping anything
+    for table in tables:
+        with open(_csv_path(directory, table), newline='') as file:
+            _columns(table, next(csv.reader(file)))
+
+    # the session mustn't be holding locks on the tables being dropped
+    db.session.close()
+
+    engine = db.engine
+
+    if use_copy is None:
+        use_copy = engine.dialect.name == 'postgresql'
+
+    db.drop_all()
+    db.create_all()
+
+    with engine.begin() as connection:
+        restore = _drop_indexes(connection, db.metadata.sorted_tables)
+
+    steps = []
+
+    def load_table(table):
+        start = time.perf_counter()
+
+        with engine.begin() as connection:
+            path = _csv_path(directory, table)
+            if use_copy:
+                rows = _copy(connection, table, path)
+            else:
+                rows = _insert(connection, table, path, chunk_size)
+
+        return Step(table.name, time.perf_counter() - start, rows)
+
+    for wave in _waves(tables):
+        if parallel and engine.dialect.name != 'sqlite' and len(wave) > 1:
+            with ThreadPoolExecutor(max_workers=len(wave)) as executor:
+                steps.extend(executor.map(load_table, wave))
+        else:
+            steps.extend(load_table(table) for table in wave)
+
+    # before the indexes are back, so the updates don't have to maintain them
+    start = time.perf_counter()
+    counters.recount()
+    steps.append(Step("counts", time.perf_counter() - start))
+
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        for statement in restore:
+            connection.execute(statement)
+        connection.execute(db.text("ANALYZE"))
+    steps.append(Step("indexes", time.perf_counter() - start))
+
+    return steps
+
+
+def _csv_path(directory, table):
+    return os.path.join(directory, f"{table.name}.csv")
+
+
+def _columns(table, header):
+    """The columns of `table` named by a CSV `header` row.
+
+    Raises ValueError for a name that isn't a column of the table.
+    """
+
+    unknown = [name for name in header if name not in table.columns]
+
+    if unknown:
+        raise ValueError(
+            f"{table.name}.csv has unknown columns: {', '.join(unknown)}")
+
+    return [table.columns[name] for name in header]
+
+
+def _copy(connection, table, path):
+    """Stream the CSV file at `path` into `table` with COPY; returns the
+    number of rows loaded."""
+
+    quote = connection.dialect.identifier_preparer.quote
+
+    with open(path, newline='') as file:
+        columns = _columns(table, next(csv.reader(file)))
+        file.seek(0)
+
+        # an empty field is an empty string, as on the insert path, not NULL
+        text_columns = [quote(column.name) for column in columns
+                        if isinstance(column.type, db.String)]
+        options = "FORMAT csv, HEADER true"
+        if text_columns:
+            options += f", FORCE_NOT_NULL ({', '.join(text_columns)})"
+
+        statement = (
+            f"COPY {quote(table.name)} "
+            f"({', '.join(quote(column.name) for column in columns)}) "
+            f"FROM STDIN WITH ({options})")
+
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(statement, file, size=COPY_BUFFER_SIZE)
+        rows = cursor.rowcount
+
+    _reset_sequence(connection, table, columns)
+
+    return rows
+
+
+def _insert(connection, table, path, chunk_size):
+    """Insert the rows of the CSV file at `path` into `table`, one
+    executemany per `chunk_size` rows; returns the number of rows loaded."""
+
+    quote = connection.dialect.identifier_preparer.quote
+    rows = 0
+
+    with open(path, newline='') as file:
+        reader = csv.reader(file)
+        columns = _columns(table, next(reader))
+        params = [f"c{i}" for i in range(len(columns))]
+
+        # a plain text statement: values go to the driver as read, with no
+        # per-value type processing
+        statement = db.text(
+            f"INSERT INTO {quote(table.name)} "
+            f"({', '.join(quote(column.name) for column in columns)}) "
+            f"VALUES ({', '.join(f':{param}' for param in params)})")
+
+        while True:
+            chunk = [dict(zip(params, row))
+                     for _, row in zip(range(chunk_size), reader)]
+            if not chunk:
+                break
+
+            connection.execute(statement, chunk)
+            rows += len(chunk)
+
+    _reset_sequence(connection, table, columns)
+
+    return rows
+
+
+def _reset_sequence(connection, table, columns):
+    """Move a PostgreSQL id sequence past ids loaded from the file, so the
+    next row inserted doesn't collide with them."""
+
+    if connection.dialect.name != 'postgresql':
+        return
+
+    key = list(table.primary_key.columns)
+
+    if len(key) == 1 and key[0] in columns and key[0].autoincrement:
+        connection.execute(
+            db.text(f"SELECT setval(pg_get_serial_sequence(:table, :column), "
+                    f"max({key[0].name})) FROM {table.name}"),
+            dict(table=table.name, column=key[0].name))
+
+
+def _drop_indexes(connection, tables):
+    """Drop the indexes (and on PostgreSQL, constraints) of `tables`.
+
+    Returns the statements that put them back, in the order to run them.
+    """
+
+    if connection.dialect.name == 'postgresql':
+        names = [table.name for table in tables]
+        quote = connection.dialect.identifier_preparer.quote
+
+        indexes = connection.execute(
+            PG_INDEXES_SQL, dict(tables=names)).all()
+        constraints = connection.execute(
+            PG_CONSTRAINTS_SQL, dict(tables=names)).all()
+
+        for table, name, _ in constraints:
+            connection.execute(db.text(
+                f"ALTER TABLE {table} DROP CONSTRAINT {quote(name)}"))
+        for name, _ in indexes:
+            connection.execute(db.text(f"DROP INDEX {name}"))
+
+        return ([db.text(definition) for _, definition in indexes]
+                + [db.text(f"ALTER TABLE {table} "
+                           f"ADD CONSTRAINT {quote(name)} {definition}")
+                   for table, name, definition in reversed(constraints)])
+
+    indexes = [index for table in tables for index in table.indexes]
+
+    for index in indexes:
+        index.drop(connection)
+
+    return [CreateIndex(index) for index in indexes]
+
+
+def _waves(tables):
+    """Split `tables` (in dependency order) into groups that only reference
+    tables in earlier groups, so each group's tables can load together."""
+
+    waves = []
+
+    for table in tables:
+        depends_on = {key.column.table for key in table.foreign_keys
+                      if key.column.table is not table}
+
+        if waves and not depends_on & set(waves[-1]):
+            waves[-1].append(table)
+        else:
+            waves.append([table])
+
+    return waves
@@ -0,0 +1,125 @@
+"""Conditional GET for pages that rarely change between visits.
+
+Every response used to be sent with `Cache-Control: no-store`, so going back
+to a profile or a message re-ran all of its queries and rendered it again.
+Pages that support conditional GET are instead sent with a weak ETag and
+`Cache-Control: private, no-cache`: the browser keeps its copy, asks
+whether it's still good with If-None-Match, and gets a bodiless
+`304 Not Modified` when it is. The view works that out from one cheap
+query, before it loads or renders anything else.
+
+An ETag is a hash of everything the page shows, by proxy:
+
+- the `version` of each user and message on it. Every change to a row that
+  its pages show bumps its version: the stored counts (counters.py) and
+  profile edits.
+- who's looking, and their version, since a page shows which of its users
+  they follow and which of its messages they've liked
+- the URL, so each page of a list has its own
+- the templates and the built static files, so a deploy that changes them
+  doesn't serve old pages
+- how old the page's CSRF token may be (see `csrf_window`)
+
+Pages with a flashed message waiting aren't conditional at all: the
+message would be lost in a 304.
+
+These ETags are weak because two renders of the same version aren't
+byte-for-byte the same (CSRF tokens differ).
+"""
+
+import hashlib
+import os
+import time
+
+from flask import after_this_request, current_app, g, request, session
+
+
+class ConditionalGet:
+    """Makes and checks the ETags of pages that support conditional GET."""
+
+    def __init__(self, salt="", csrf_window=None):
+        self.salt = salt
+        self.csrf_window = csrf_window
+
+    def etag(self, *versions):
+        """The current viewer's ETag for this page, given the `versions`
+        it's built from; None when it can't be cached."""
+
+        if session.get('_flashes'):
+            return None
+
+        viewer = g.user
+        assets = current_app.extensions.get('assets')
+        parts = [
+            self.salt,
+            assets and assets.version,
+            request.full_path,
+            viewer.id if viewer else None,
+            int(time.time() // self.csrf_window) if self.csrf_window else None,
+            *versions,
+        ]
+
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def not_modified(self, etag):
+        """A 304 response if the browser's copy of this page has `etag`.
+
+        Otherwise None, and the page (if it's a 200) goes out with `etag`.
+        """
+
+        if etag is None:
+            return None
+
+        if request.if_none_match.contains_weak(etag):
+            return self.cacheable(current_app.response_class(status=304), etag)
+
+        @after_this_request
+        def add_etag(response):
+            if response.status_code == 200:
+                self.cacheable(response, etag)
+
+            return response
+
+        return None
+
+    def cacheable(self, response, etag):
+        """Let the browser keep `response`, revalidating it with `etag`."""
+
+        response.set_etag(etag, weak=True)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+
+        return response
+
+
+def templates_digest(folder):
+    """A hash of every template under `folder`."""
+
+    digest = hashlib.sha1()
+
+    for root, dirs, files in sorted(os.walk(folder)):
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as file:
+                digest.update(name.encode())
+                digest.update(file.read())
+
+    return digest.hexdigest()
+
+
+def connect_conditional_get(app):
+    """Set up conditional GET for `app`.
+
+    A page's CSRF token stops being accepted WTF_CSRF_TIME_LIMIT seconds
+    after it was made, so ETags change every half of that: a page kept
+    through 304s then never has a token more than half-expired.
+    """
+
+    time_limit = app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+
+    conditional_get = ConditionalGet(
+        salt=templates_digest(
+            os.path.join(app.root_path, app.template_folder)),
+        csrf_window=time_limit / 2 if time_limit else None)
+    app.extensions['conditional_get'] = conditional_get
+
+    return conditional_get
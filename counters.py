@@ -0,0 +1,162 @@
+"""Stored counts on users and messages.
+
+Profile stats used to be computed with `user.followers | length` and
+friends, which loads a whole relationship just to count it. Instead, users
+and messages carry counter columns that every write path adjusts with an
+`UPDATE ... SET n = n + 1` in the same transaction as the write itself, so
+a count can't commit without the row it counts (or vice versa).
+
+Each adjustment also bumps the rows' `version`, which the pages showing
+them use as their ETag (see conditional.py).
+
+The adjustments don't touch objects already loaded in the session; those
+pick up the new counts when the transaction commits and they expire.
+
+If the counts ever do drift, `flask recount` rebuilds them all from the
+`follows`, `likes` and `messages` tables.
+"""
+
+from models import db, User, Message, Follow, Like
+
+
+def adjust(model, ids, **deltas):
+    """Add each of `deltas` to the named counters of the `ids` rows of `model`.
+
+    `ids` is a list of primary keys or a select of them.
+    """
+
+    db.session.execute(
+        db.update(model)
+        .where(model.id.in_(ids))
+        .values(version=model.version + 1,
+                **{name: getattr(model, name) + delta
+                   for name, delta in deltas.items()})
+        .execution_options(synchronize_session=False))
+
+
+def _subtract_counts(model, counter, counts):
+    """Subtract per-row amounts from `counter` in one statement.
+
+    `counts` selects (id, n) rows: `n` is taken off row `id`.
+    """
+
+    counts = counts.subquery()
+
+    db.session.execute(
+        db.update(model)
+        .where(model.id == counts.c.id)
+        .values({counter: getattr(model, counter) - counts.c.n,
+                 'version': model.version + 1})
+        .execution_options(synchronize_session=False))
+
+
+def message_added(author_id):
+    """Count a new message by `author_id`."""
+
+    adjust(User, [author_id], messages_count=1)
+
+
+def message_deleted(message_id, author_id):
+    """Un-count a message that is about to be deleted, and its likes."""
+
+    num_likes = Like.query.filter_by(message_id=message_id).count()
+
+    adjust(User,
+           db.select(Like.user_id).where(Like.message_id == message_id),
+           likes_count=-1)
+    adjust(User, [author_id],
+           messages_count=-1,
+           likes_received_count=-num_likes)
+
+
+def follow_changed(follower_id, followed_id, delta):
+    """Count (+1) or un-count (-1) `follower_id` following `followed_id`."""
+
+    adjust(User, [follower_id], following_count=delta)
+    adjust(User, [followed_id], followers_count=delta)
+
+
+def like_changed(user_id, message_id, author_id, delta):
+    """Count (+1) or un-count (-1) `user_id` liking a message."""
+
+    adjust(User, [user_id], likes_count=delta)
+    adjust(User, [author_id], likes_received_count=delta)
+    adjust(Message, [message_id], likes_count=delta)
+
+
+def user_deleted(user_id):
+    """Settle everyone else's counts before `user_id` and their rows go.
+
+    That's the people they followed or were followed by, the messages they
+    liked (and those messages' authors), and whoever liked their messages.
+    """
+
+    adjust(User,
+           db.select(Follow.user_being_followed_id)
+           .where(Follow.user_following_id == user_id),
+           followers_count=-1)
+    adjust(User,
+           db.select(Follow.user_following_id)
+           .where(Follow.user_being_followed_id == user_id),
+           following_count=-1)
+
+    adjust(Message,
+           db.select(Like.message_id).where(Like.user_id == user_id),
+           likes_count=-1)
+    _subtract_counts(
+        User, 'likes_received_count',
+        db.select(Message.user_id.label('id'), db.func.count().label('n'))
+        .join(Like, Like.message_id == Message.id)
+        .where(Like.user_id == user_id)
+        .group_by(Message.user_id))
+
+    _subtract_counts(
+        User, 'likes_count',
+        db.select(Like.user_id.label('id'), db.func.count().label('n'))
+        .join(Message, Like.message_id == Message.id)
+        .where(Message.user_id == user_id)
+        .group_by(Like.user_id))
+
+
+def recount():
+    """Rebuild every stored count from scratch, in one transaction.
+
+    Zeroes all counters, then sets each from a single grouped count over
+    its source table (rather than one correlated count per row).
+    """
+
+    no_sync = dict(synchronize_session=False)
+
+    db.session.execute(db.update(User).values(
+        messages_count=0,
+        followers_count=0,
+        following_count=0,
+        likes_count=0,
+        likes_received_count=0,
+        version=User.version + 1,
+    ), execution_options=no_sync)
+    db.session.execute(
+        db.update(Message).values(likes_count=0, version=Message.version + 1),
+        execution_options=no_sync)
+
+    def grouped(column):
+        return (db.select(column.label('id'), db.func.count().label('n'))
+                .group_by(column))
+
+    for model, counter, counts in [
+        (User, 'messages_count', grouped(Message.user_id)),
+        (User, 'followers_count', grouped(Follow.user_being_followed_id)),
+        (User, 'following_count', grouped(Follow.user_following_id)),
+        (User, 'likes_count', grouped(Like.user_id)),
+        (User, 'likes_received_count',
+         grouped(Message.user_id).join(Like, Like.message_id == Message.id)),
+        (Message, 'likes_count', grouped(Like.message_id)),
+    ]:
+        counts = counts.subquery()
+        db.session.execute(
+            db.update(model)
+            .where(model.id == counts.c.id)
+            .values({counter: counts.c.n}),
+            execution_options=no_sync)
+
+    db.session.commit()
@@ -0,0 +1,326 @@
+"""Cache of rendered message cards.
+
+Every message list (the homepage, profiles, likes, search) and the message
+page renders each message's card: the author's avatar and username, the
+timestamp and the text. None of that depends on who is looking, so each
+card is rendered once and its HTML kept, rather than rendered again for
+every page that shows it.
+
+What does depend on the viewer (the like star, follow and delete buttons)
+is rendered by the page itself, into "slots" left in the card. A cached card
+is the list of HTML pieces between its slots:
+
+    {% set card = message_card(msg) %}
+    {{ card[0] }} ...the viewer's star... {{ card[1] }}
+
+A card's key is the message id plus a version of everything it shows: its
+text and timestamp, and its author's id, username and avatar. So a profile
+edit changes the keys of that author's cards, and a reused id (after a
+database is reloaded) can't bring back another message's card. The keys
+also include a digest of the templates and the version of the built assets
+(see assets.py), so a deploy that changes the cards or the files they link
+to doesn't serve old ones.
+
+Old entries are forgotten when their message is deleted or their author
+edits their profile or is deleted (`on_*`), to make room; that only
+reaches other workers' memory stores as they evict them.
+
+Cards live in a pluggable store, as timelines do:
+
+- MemoryFragmentStore: an LRU in this process's memory.
+- SQLiteFragmentStore: a SQLite file that every worker on a box can share.
+"""
+
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from flask import current_app, render_template
+from markupsafe import Markup
+
+from conditional import templates_digest
+
+FRAGMENT_CACHE_SIZE = 10000
+
+CARD_TEMPLATE = 'messages/card.html'
+
+# marks the slots in a freshly rendered card; it's never stored, so it only
+# needs to be unguessable by message authors
+SLOT = f"<!-- slot {secrets.token_hex(8)} -->"
+
+
+##############################################################################
+# Stores
+#
+# A store holds lists of HTML strings under string keys, remembering the
+# message and author each one was rendered from.
+
+
+class FragmentStore:
+    """Interface every fragment backend implements."""
+
+    def __init__(self, max_size=FRAGMENT_CACHE_SIZE):
+        self.max_size = max_size
+
+    def get(self, key):
+        """The pieces stored under `key`, or None."""
+
+        raise NotImplementedError
+
+    def set(self, key, message_id, author_id, pieces):
+        """Store `pieces` under `key`, evicting old entries past
+        `max_size`."""
+
+        raise NotImplementedError
+
+    def forget_message(self, message_id):
+        """Forget every entry rendered from `message_id`."""
+
+        raise NotImplementedError
+
+    def forget_author(self, author_id):
+        """Forget every entry rendered from a message by `author_id`."""
+
+        raise NotImplementedError
+
+    def clear(self):
+        """Forget every entry."""
+
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemoryFragmentStore(FragmentStore):
+    """Fragments held in this process's memory."""
+
+    def __init__(self, max_size=FRAGMENT_CACHE_SIZE):
+        super().__init__(max_size)
+
+        # key -> (message id, author id, pieces), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, message_id, author_id, pieces):
+        with self._lock:
+            self._entries[key] = (message_id, author_id, pieces)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def forget_message(self, message_id):
+        self._forget(lambda entry: entry[0] == message_id)
+
+    def forget_author(self, author_id):
+        self._forget(lambda entry: entry[1] == author_id)
+
+    def _forget(self, matches):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items()
+                        if matches(entry)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteFragmentStore(FragmentStore):
+    """Fragments kept in a SQLite file shared by every worker on the host.
+
+    So that a hit doesn't have to write, this evicts the entries stored
+    longest ago (lowest rowid) rather than the least recently used.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS fragments (
+            key TEXT PRIMARY KEY,
+            message_id INTEGER NOT NULL,
+            author_id INTEGER NOT NULL,
+            pieces TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS fragments_message_id
+            ON fragments (message_id);
+        CREATE INDEX IF NOT EXISTS fragments_author_id
+            ON fragments (author_id);
+    """
+
+    def __init__(self, path, max_size=FRAGMENT_CACHE_SIZE):
+        super().__init__(max_size)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def get(self, key):
+        row = self._conn.execute(
+            "SELECT pieces FROM fragments WHERE key = ?", (key,)).fetchone()
+
+        return None if row is None else json.loads(row[0])
+
+    def set(self, key, message_id, author_id, pieces):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO fragments VALUES (?, ?, ?, ?)",
+                (key, message_id, author_id, json.dumps(pieces)))
+            self._conn.execute(
+                """DELETE FROM fragments WHERE rowid <=
+                   (SELECT max(rowid) FROM fragments) - ?""",
+                (self.max_size,))
+
+    def forget_message(self, message_id):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM fragments WHERE message_id = ?", (message_id,))
+
+    def forget_author(self, author_id):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM fragments WHERE author_id = ?", (author_id,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM fragments")
+
+    def __len__(self):
+        return self._conn.execute(
+            "SELECT count(*) FROM fragments").fetchone()[0]
+
+
+FRAGMENT_BACKENDS = {
+    'memory': MemoryFragmentStore,
+    'sqlite': SQLiteFragmentStore,
+}
+
+
+##############################################################################
+# Message cards
+
+
+class MessageCards:
+    """Renders message cards through a FragmentStore.
+
+    The write routes call the `on_*` hooks after they commit; templates call
+    `card` (as `message_card`).
+    """
+
+    def __init__(self, store, salt=""):
+        self.store = store
+        self.salt = salt
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def card(self, message, template=CARD_TEMPLATE):
+        """The pieces of `message`'s card, as rendered by `template`, to
+        put between the page's own slot contents."""
+
+        author = message.user
+        key = self.key(message, author, template)
+        pieces = self.store.get(key)
+
+        with self._lock:
+            if pieces is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if pieces is None:
+            pieces = render_template(
+                template, message=message, author=author,
+                slot=Markup(SLOT)).split(SLOT)
+            self.store.set(key, message.id, author.id, pieces)
+
+        return [Markup(piece) for piece in pieces]
+
+    def key(self, message, author, template=CARD_TEMPLATE):
+        """Store key for `message`'s card: its id and a hash of everything
+        the card shows."""
+
+        assets = current_app.extensions.get('assets')
+
+        version = hashlib.blake2b(repr((
+            self.salt,
+            assets and assets.version,
+            template,
+            message.text,
+            message.timestamp.isoformat(),
+            author.id,
+            author.username,
+            author.image_url,
+        )).encode(), digest_size=12).hexdigest()
+
+        return f"{message.id}:{version}"
+
+    def on_message_deleted(self, message_id):
+        self.store.forget_message(message_id)
+
+    def on_profile_changed(self, user_id):
+        self.store.forget_author(user_id)
+
+    def on_user_deleted(self, user_id):
+        self.store.forget_author(user_id)
+
+    def stats(self):
+        """Hit/miss counts since the worker started, as a dict."""
+
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                size=len(self.store),
+                hit_rate=self.hits / lookups if lookups else 0.0,
+            )
+
+
+def connect_message_cards(app):
+    """Create the message card cache configured for `app`.
+
+    FRAGMENT_CACHE_BACKEND picks the store ('memory' or 'sqlite');
+    FRAGMENT_CACHE_SQLITE_PATH is the file the sqlite backend uses, and
+    FRAGMENT_CACHE_SIZE the most cards it keeps.
+    """
+
+    backend = app.config.get('FRAGMENT_CACHE_BACKEND', 'memory')
+    max_size = app.config.get('FRAGMENT_CACHE_SIZE', FRAGMENT_CACHE_SIZE)
+
+    if backend == 'sqlite':
+        store = SQLiteFragmentStore(
+            app.config.get('FRAGMENT_CACHE_SQLITE_PATH', 'fragments.sqlite'),
+            max_size=max_size)
+    else:
+        store = FRAGMENT_BACKENDS[backend](max_size=max_size)
+
+    cards = MessageCards(
+        store,
+        salt=templates_digest(
+            os.path.join(app.root_path, app.template_folder)))
+    app.jinja_env.globals['message_card'] = cards.card
+    app.extensions['message_cards'] = cards
+
+    return cards
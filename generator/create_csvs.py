@@ -1,89 +1,254 @@
-"""Generate CSVs of random data for Warbler.
+"""Generate CSVs of synthetic data for Warbler.
 
 Students won't need to run this for the exercise; they will just use the CSV
-files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+files that this generates. Run it to build bigger datasets, e.g. for
+benchmarks:
+
+    python generator/create_csvs.py --users 1000000 --messages 20000000 \\
+        --follows 50000000 --likes 50000000 --out /data/warbler
+
+then load them with `python seed.py --dir /data/warbler --parallel`.
+
+It works offline and in constant memory at any size:
+
+- Text, names and places come from small local word lists, and images from
+  a pool of the app's own static images (see helpers.py); nothing is
+  fetched over the network.
+- Each table is cut into shards of about --shard-size rows. Worker
+  processes each write a shard to a part file, and the parts are appended
+  to the CSV in order as they finish.
+- Every shard has its own random generator, seeded from --seed and the
+  shard's position, so the same arguments give the same files no matter how
+  many --workers run.
+
+The social graph is skewed the way real ones are: who gets followed, who
+posts, and which messages get liked each follow a power law (exponent
+--skew; 0 makes them uniform). Each user follows and likes a number of
+things drawn around the average (--follows / --users, --likes / --users), so
+those two totals are approximate.
 """
 
-import os
-from dotenv import load_dotenv
-
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
-
-load_dotenv()
+import os
+import random
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+from multiprocessing import Pool
 
-UNSPLASH_CID = os.environ['UNSPLASH_CID']
+from helpers import (
+    CITIES, FIRST_NAMES, HEADER_IMAGE_URLS, IMAGE_URLS, LAST_NAMES, Scatter,
+    get_random_datetime, hash_unit, power_law_rank, sentence)
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+NUM_FOLLOWS = 5000
+NUM_LIKES = 2000
 
-fake = Faker()
+# bcrypt hash of "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-# Generate random profile image URLs to use for users
+SHARD_SIZE = 100000
 
-image_urls = [
-    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
-    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
-    for i in range(count)
-]
+# message timestamps fall in the two years before this; fixed, so that
+# output doesn't depend on when it's run
+END = datetime(2023, 8, 1)
 
-# Generate random header image URLs to use for users
-# NOTE: You will need to create a dev account at unsplash.com, 
-# generate an access key and set that to an environment
-# variable to successfully ping the API. 
 
-header_image_urls = [
-    requests.get(
-        "https://api.unsplash.com/topics/wallpapers/photos" \
-        f"?per_page=30&orientation=landscape&client_id={UNSPLASH_CID}"
-    ).json()[i]['urls']['regular'] for i in range(0,29)
+class Dataset:
+    """The sizes and shape of the dataset to generate (sent to workers)."""
+
+    def __init__(self, seed, users, messages, follows, likes, skew, end):
+        self.seed = seed
+        self.users = users
+        self.messages = messages
+        self.follows = follows
+        self.likes = likes
+        self.skew = skew
+        self.end = end
+
+        self.followed = Scatter(users, offset=seed)
+        self.posters = Scatter(users, offset=seed + 1)
+        self.liked = Scatter(max(messages, 1), offset=seed)
+
+    def rng(self, table, shard):
+        return random.Random(f"{self.seed}:{table}:{shard}")
+
+    def author(self, message_id):
+        """Who wrote message `message_id` (a pure function of the id, so
+        likes can tell without the messages at hand)."""
+
+        u = hash_unit(self.seed, message_id)
+        return self.posters(power_law_rank(u, self.users, self.skew))
+
+    def degree(self, rng, total):
+        """How many follows or likes one user makes, out of `total`."""
+
+        return round(rng.expovariate(self.users / total)) if total else 0
+
+    def pick(self, rng, k, n, scatter, skip):
+        """Up to `k` distinct ids in 1..n, power-law distributed, none in
+        `skip`."""
+
+        picked = set()
+        k = min(k, n - len(skip))
+
+        # give up on a handful past the point where only rare ids are left
+        for _ in range(k * 20):
+            if len(picked) >= k:
+                break
+            choice = scatter(power_law_rank(rng.random(), n, self.skew))
+            if choice not in skip:
+                picked.add(choice)
+
+        return sorted(picked)
+
+
+def users(dataset, rng, start, stop):
+    for user_id in range(start, stop):
+        username = (f"{rng.choice(FIRST_NAMES)}{rng.choice(LAST_NAMES)}"
+                    f"{user_id}")
+
+        yield [
+            user_id,
+            f"{username}@example.com",
+            username,
+            rng.choice(IMAGE_URLS),
+            PASSWORD,
+            sentence(rng, 3, 8),
+            rng.choice(HEADER_IMAGE_URLS),
+            rng.choice(CITIES),
+        ]
+
+
+def messages(dataset, rng, start, stop):
+    for message_id in range(start, stop):
+        yield [
+            message_id,
+            sentence(rng, 4, 30, MAX_WARBLER_LENGTH),
+            get_random_datetime(rng, dataset.end),
+            dataset.author(message_id),
+        ]
+
+
+def follows(dataset, rng, start, stop):
+    for follower_id in range(start, stop):
+        k = dataset.degree(rng, dataset.follows)
+        for followed_id in dataset.pick(rng, k, dataset.users,
+                                        dataset.followed, {follower_id}):
+            yield [followed_id, follower_id]
+
+
+def likes(dataset, rng, start, stop):
+    for user_id in range(start, stop):
+        k = dataset.degree(rng, dataset.likes)
+        picked = dataset.pick(rng, k, dataset.messages, dataset.liked, set())
+
+        # users can't like their own messages
+        for message_id in picked:
+            if dataset.author(message_id) != user_id:
+                yield [user_id, message_id]
+
+
+# (name, headers, row generator, number of ids, rows per id)
+TABLES = [
+    ('users', USERS_CSV_HEADERS, users,
+     lambda dataset: dataset.users, lambda dataset: 1),
+    ('messages', MESSAGES_CSV_HEADERS, messages,
+     lambda dataset: dataset.messages, lambda dataset: 1),
+    ('follows', FOLLOWS_CSV_HEADERS, follows,
+     lambda dataset: dataset.users,
+     lambda dataset: dataset.follows / dataset.users),
+    ('likes', LIKES_CSV_HEADERS, likes,
+     lambda dataset: dataset.users,
+     lambda dataset: dataset.likes / dataset.users),
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+GENERATORS = {name: generate for name, _, generate, _, _ in TABLES}
+
+
+def write_shard(task):
+    """Write one shard's rows to a part file; returns its path."""
+
+    dataset, name, shard, start, stop, directory = task
+
+    path = os.path.join(directory, f"{name}.{shard}.part")
+    rng = dataset.rng(name, shard)
+
+    with open(path, 'w', newline='') as part:
+        csv.writer(part).writerows(
+            GENERATORS[name](dataset, rng, start, stop))
+
+    return path
+
+
+def shards(dataset, shard_size, directory):
+    """(table name, headers, tasks) for every table."""
+
+    for name, headers, _, num_ids, rows_per_id in TABLES:
+        n = num_ids(dataset)
+        step = max(1, int(shard_size / max(rows_per_id(dataset), 1)))
+
+        tasks = [(dataset, name, shard, start, min(start + step, n + 1),
+                  directory)
+                 for shard, start in enumerate(range(1, n + 1, step))]
+
+        yield name, headers, tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=NUM_USERS)
+    parser.add_argument("--messages", type=int, default=NUM_MESSAGES)
+    parser.add_argument("--follows", type=int, default=NUM_FOLLOWS,
+                        help="about how many follows to make")
+    parser.add_argument("--likes", type=int, default=NUM_LIKES,
+                        help="about how many likes to make")
+    parser.add_argument("--skew", type=float, default=1.0,
+                        help="power-law exponent of popularity (0: uniform)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--end", type=datetime.fromisoformat, default=END,
+                        help="newest possible message timestamp")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="processes to generate with")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE,
+                        help="rows per unit of work")
+    parser.add_argument("--out", default=os.path.dirname(__file__) or ".",
+                        help="directory to write the CSVs to")
+    args = parser.parse_args()
+
+    if args.users < 2:
+        parser.error("--users must be at least 2")
+
+    dataset = Dataset(args.seed, args.users, args.messages, args.follows,
+                      args.likes, args.skew, args.end)
+
+    os.makedirs(args.out, exist_ok=True)
+
+    with (tempfile.TemporaryDirectory(dir=args.out) as parts,
+          Pool(args.workers) as pool):
+        for name, headers, tasks in shards(dataset, args.shard_size, parts):
+            with open(os.path.join(args.out, f"{name}.csv"), 'w',
+                      newline='') as out:
+                csv.writer(out).writerow(headers)
+
+                # parts come back in order, as soon as each is written
+                for path in pool.imap(write_shard, tasks):
+                    with open(path, newline='') as part:
+                        shutil.copyfileobj(part, out)
+                    os.unlink(path)
+
+            print(f"{name}.csv done", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
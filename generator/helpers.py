@@ -1,14 +1,132 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+import math
+from datetime import timedelta
 
+FIRST_NAMES = [
+    "alex", "amara", "ben", "carla", "chen", "dana", "diego", "elena",
+    "farah", "gus", "hana", "ivan", "jade", "jonas", "kai", "lena", "luis",
+    "maya", "mei", "nadia", "noor", "omar", "priya", "quinn", "rosa", "sam",
+    "sofia", "tariq", "uma", "vera", "wes", "xin", "yara", "zoe",
+]
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+LAST_NAMES = [
+    "adams", "baker", "cruz", "diaz", "evans", "fischer", "garcia", "hall",
+    "ito", "jensen", "kim", "lopez", "moreau", "nguyen", "okafor", "patel",
+    "quist", "rossi", "silva", "tanaka", "ueda", "vance", "wong", "xu",
+    "young", "zhang",
+]
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+CITIES = [
+    "Springfield", "Riverton", "Lakeside", "Fairview", "Oakdale", "Milford",
+    "Greenville", "Ashland", "Bristol", "Clayton", "Dover", "Franklin",
+    "Georgetown", "Hudson", "Kingston", "Lexington", "Madison", "Newport",
+    "Oxford", "Salem",
+]
 
-    return datetime.fromtimestamp(random_timestamp)
+WORDS = """
+    a about above across after again air all almost along also always and
+    another any are around as at away back be because been before began
+    being below best better between big bird birds both bright but by call
+    came can city close cold come could country day did different do does
+    down each early earth end enough even every eye far feet few find first
+    food for form found four from get give go good great green ground group
+    had hand hard has have he head hear heard here high his home house how
+    idea if important in into is it just keep kind know land large last
+    late learn leave left let life light like line little live long look
+    made make many may me might more morning most mountain move much music
+    must my name near need never new next night no not now number of off
+    often old on once one only open or other our out over own paper part
+    people place plant play point quick read real right river road room run
+    said same saw say sea second see seem sentence set she should show side
+    small so some something song sound spring start state still stop story
+    study such sun take talk tell than that the their them then there these
+    they thing think this those thought three through time to together too
+    took tree try turn two under until up us use very walk want warble
+    warbler was watch water way we well went were what when where which
+    while white who why will wind with word work world would write year you
+    young your
+""".split()
+
+# profile and header images served by this app itself, so the generated
+# data never points at the network
+IMAGE_URLS = [
+    "/static/images/default-pic.png",
+]
+
+HEADER_IMAGE_URLS = [
+    "/static/images/warbler-hero.jpg",
+    "/static/images/signed-out-home.jpg",
+    "/static/images/nav-bg.png",
+]
+
+MASK_64 = (1 << 64) - 1
+
+
+def get_random_datetime(rng, end, year_gap=2):
+    """Get a random datetime within the few years before `end`."""
+
+    span = timedelta(days=365 * year_gap)
+    return end - span * rng.random()
+
+
+def sentence(rng, min_words, max_words, max_length=None):
+    """A capitalized sentence of random words, cut to `max_length`."""
+
+    text = " ".join(rng.choices(WORDS, k=rng.randint(min_words, max_words)))
+    text = text.capitalize() + "."
+
+    return text[:max_length] if max_length else text
+
+
+def hash_unit(seed, n):
+    """A float in [0, 1) that is a fixed, well-mixed function of (seed, n).
+
+    For values that must be derived from an id alone, without a random
+    generator's state (splitmix64).
+    """
+
+    x = (seed * 0x9E3779B97F4A7C15 + n * 0xBF58476D1CE4E5B9) & MASK_64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK_64
+    x ^= x >> 31
+
+    return x / 2 ** 64
+
+
+def power_law_rank(u, n, skew):
+    """Rank in [0, n) for a uniform `u` in [0, 1), Zipf-like with exponent
+    `skew`: rank 0 is the most likely. A skew of 0 is uniform.
+
+    Uses the inverse of the continuous power law's CDF, so it's O(1) with no
+    table of weights.
+    """
+
+    if skew == 1:
+        rank = n ** u
+    else:
+        rank = ((n ** (1 - skew) - 1) * u + 1) ** (1 / (1 - skew))
+
+    return min(int(rank) - 1, n - 1)
+
+
+class Scatter:
+    """A fixed shuffle of the ids 1..n, without storing it.
+
+    Maps ranks from `power_law_rank` to ids, so the popular ids are spread
+    over the range rather than all being the lowest ones. Different
+    `offset`s give different shuffles.
+    """
+
+    def __init__(self, n, offset=0):
+        self.n = n
+        self.offset = offset
+
+        # any step coprime with n visits every id exactly once
+        step = int(n * 0.6180339887) | 1
+        while math.gcd(step, n) != 1:
+            step += 2
+        self.step = step
+
+    def __call__(self, rank):
+        return (rank * self.step + self.offset) % self.n + 1
@@ -0,0 +1,52 @@
+"""Request globals that are only worked out when something uses them.
+
+`g.user` and `g.csrf_form` used to be set up in a before_request hook for
+every request, which costs a user lookup and a fresh CSRF token even for
+requests that never look at either (anonymous pages, "Access unauthorized"
+redirects).
+
+With LazyGlobals as the app's `g` class, a name registered with `lazy` is
+loaded the first time it's read from `g` in a request and then kept on `g`
+for the rest of that request, so it's a plain attribute (a real User, a
+real form) from then on. Setting it directly works as usual too.
+
+Warbler keeps one app context (and so one `g`) alive for the whole process,
+so each request must start with `forget` to drop the last one's values.
+"""
+
+from flask import g
+from flask.ctx import _AppCtxGlobals
+
+
+class LazyGlobals(_AppCtxGlobals):
+    """`g` whose registered attributes load on first access."""
+
+    loaders = {}
+
+    def __getattr__(self, name):
+        loader = self.loaders.get(name)
+
+        if loader is None:
+            raise AttributeError(name)
+
+        value = loader()
+        setattr(self, name, value)
+
+        return value
+
+
+def lazy(name):
+    """Decorator: load `g.<name>` with the decorated function when needed."""
+
+    def register(loader):
+        LazyGlobals.loaders[name] = loader
+        return loader
+
+    return register
+
+
+def forget():
+    """Drop every lazily-loaded value, so the next read loads it afresh."""
+
+    for name in LazyGlobals.loaders:
+        g.pop(name, None)
@@ -0,0 +1,307 @@
+"""Full-text search over messages.
+
+Searching `Message.text` with LIKE means reading every message. Instead,
+searches go to an inverted index (word -> the messages containing it):
+
+- PostgresMessageSearch uses PostgreSQL's own full-text search: a GIN index
+  over `to_tsvector('english', text)` (see `models.create_message_search_index`),
+  which PostgreSQL keeps up to date as messages are written and deleted.
+  Words are stemmed, so "running" finds "runs".
+- MemoryMessageSearch is a pure-Python index, private to one process, for
+  local development on SQLite. It's built from the database on first use
+  and then kept up to date by the routes that add and delete messages.
+
+Either way, every word of the query must appear in a message for it to
+match. Results are ranked by relevance, newest first among equals, and
+come a page at a time with a cursor holding the (rank, timestamp, id) of
+the last result shown. A search can be limited to the viewer and the
+people they follow.
+"""
+
+import math
+import re
+import threading
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import REAL
+from sqlalchemy.orm import joinedload
+
+from models import db, Message, Follow
+from pagination import pack_cursor, unpack_cursor
+from werkzeug.exceptions import BadRequest
+
+RESULTS_PER_PAGE = 50
+
+SEARCH_CONFIG = db.literal_column("'english'::regconfig")
+
+
+def encode_result_cursor(rank, message):
+    """Opaque cursor string for a search result's position."""
+
+    return pack_cursor(
+        repr(float(rank)), message.timestamp.isoformat(), str(message.id))
+
+
+def decode_result_cursor(cursor):
+    """(rank, timestamp, id) from a cursor made by `encode_result_cursor`.
+
+    Raises BadRequest for anything that isn't a valid cursor.
+    """
+
+    rank, timestamp, message_id = unpack_cursor(cursor, 3)
+
+    try:
+        return float(rank), datetime.fromisoformat(timestamp), int(message_id)
+
+    except ValueError:
+        raise BadRequest("Invalid page cursor.")
+
+
+class SearchPage:
+    """One page of search results, best first, with a cursor to the next
+    page (or None)."""
+
+    def __init__(self, messages, after):
+        self.messages = messages
+        self.after = after
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __len__(self):
+        return len(self.messages)
+
+
+def _followed_by(viewer_id):
+    """Select of the ids of `viewer_id` and everyone they follow."""
+
+    return (db.select(Follow.user_being_followed_id)
+            .where(Follow.user_following_id == viewer_id)
+            .union(db.select(db.literal(viewer_id))))
+
+
+class PostgresMessageSearch:
+    """Search with PostgreSQL full-text search and a GIN index."""
+
+    def search(self, q, viewer_id=None, after=None,
+               per_page=RESULTS_PER_PAGE):
+        """The page of messages matching `q` that comes after `after`.
+
+        With `viewer_id`, only messages by that user and the people they
+        follow are searched.
+        """
+
+        document = db.func.to_tsvector(SEARCH_CONFIG, Message.text)
+        query = db.func.websearch_to_tsquery(SEARCH_CONFIG, q)
+        rank = db.func.ts_rank(document, query)
+
+        found = (Message
+                 .query
+                 .options(joinedload(Message.user))
+                 .filter(document.op('@@')(query))
+                 .add_columns(rank))
+
+        if viewer_id is not None:
+            found = found.filter(Message.user_id.in_(_followed_by(viewer_id)))
+
+        if after is not None:
+            # ts_rank is a `real`; compare as one, since the cursor's copy
+            # of it went through text and a double
+            after_rank, timestamp, message_id = after
+            found = found.filter(
+                db.tuple_(rank, Message.timestamp, Message.id)
+                < db.tuple_(db.cast(after_rank, REAL), timestamp, message_id))
+
+        rows = (found
+                .order_by(rank.desc(),
+                          Message.timestamp.desc(),
+                          Message.id.desc())
+                .limit(per_page + 1)
+                .all())
+
+        return _page(rows, per_page)
+
+    def on_message_added(self, message):
+        """Nothing to do: PostgreSQL updates the index itself."""
+
+    def on_message_deleted(self, message_id):
+        """Nothing to do: PostgreSQL updates the index itself."""
+
+    def on_user_deleted(self, user_id):
+        """Nothing to do: PostgreSQL updates the index itself."""
+
+
+class MemoryMessageSearch:
+    """Pure-Python inverted index, for when there's no PostgreSQL.
+
+    Maps each word to {message id: times it appears}, and keeps each
+    message's timestamp and author for ordering and filtering (and its
+    words, to find its postings again when it's deleted). Ranks with
+    tf-idf: words that appear in fewer messages count for more.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._messages = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def search(self, q, viewer_id=None, after=None,
+               per_page=RESULTS_PER_PAGE):
+        """The page of messages matching `q` that comes after `after`.
+
+        With `viewer_id`, only messages by that user and the people they
+        follow are searched.
+        """
+
+        authors = None
+        if viewer_id is not None:
+            authors = set(db.session.scalars(_followed_by(viewer_id)))
+
+        with self._lock:
+            self._load()
+            results = self._rank(words(q), authors)
+
+        if after is not None:
+            results = [result for result in results if result < after]
+
+        results = results[:per_page + 1]
+
+        by_id = {msg.id: msg for msg in (
+            Message
+            .query
+            .options(joinedload(Message.user))
+            .filter(Message.id.in_(
+                [message_id for _, _, message_id in results])))}
+
+        return _page([(by_id[message_id], rank)
+                      for rank, _, message_id in results
+                      if message_id in by_id],
+                     per_page)
+
+    def on_message_added(self, message):
+        """Index a new message."""
+
+        with self._lock:
+            if self._loaded:
+                self._add(message.id, message.text, message.timestamp,
+                          message.user_id)
+
+    def on_message_deleted(self, message_id):
+        """Drop a deleted message from the index."""
+
+        with self._lock:
+            self._remove(message_id)
+
+    def on_user_deleted(self, user_id):
+        """Drop all of a deleted user's messages from the index."""
+
+        with self._lock:
+            for message_id, (_, author_id, _, _) in list(
+                    self._messages.items()):
+                if author_id == user_id:
+                    self._remove(message_id)
+
+    def _rank(self, terms, authors):
+        """(rank, timestamp, id) of every match, best first."""
+
+        if not terms:
+            return []
+
+        postings = [self._postings.get(term, {}) for term in terms]
+        matches = set.intersection(*(set(posting) for posting in postings))
+
+        if authors is not None:
+            matches = {message_id for message_id in matches
+                       if self._messages[message_id][1] in authors}
+
+        total = len(self._messages)
+        results = []
+
+        for message_id in matches:
+            timestamp, _, length, _ = self._messages[message_id]
+            rank = sum(
+                posting[message_id] / length
+                * math.log(1 + total / len(posting))
+                for posting in postings)
+            results.append((rank, timestamp, message_id))
+
+        results.sort(reverse=True)
+        return results
+
+    def _add(self, message_id, text, timestamp, author_id):
+        counts = Counter(words(text))
+
+        for term, count in counts.items():
+            self._postings.setdefault(term, {})[message_id] = count
+
+        self._messages[message_id] = (
+            timestamp, author_id, sum(counts.values()) or 1, tuple(counts))
+
+    def _remove(self, message_id):
+        entry = self._messages.pop(message_id, None)
+
+        if entry is None:
+            return
+
+        for term in entry[3]:
+            posting = self._postings[term]
+            del posting[message_id]
+            if not posting:
+                del self._postings[term]
+
+    def _load(self):
+        if self._loaded:
+            return
+
+        rows = db.session.query(
+            Message.id, Message.text, Message.timestamp, Message.user_id)
+
+        for row in rows:
+            self._add(*row)
+
+        self._loaded = True
+
+
+def words(text):
+    """The lowercased words of `text`."""
+
+    return re.findall(r"\w+", text.lower())
+
+
+def _page(rows, per_page):
+    """SearchPage from up to `per_page + 1` (message, rank) rows."""
+
+    messages = [msg for msg, _ in rows[:per_page]]
+
+    if len(rows) > per_page:
+        rank = rows[per_page - 1][1]
+        return SearchPage(messages, encode_result_cursor(rank, messages[-1]))
+
+    return SearchPage(messages, None)
+
+
+SEARCH_BACKENDS = {
+    'postgres': PostgresMessageSearch,
+    'memory': MemoryMessageSearch,
+}
+
+
+def connect_message_search(app):
+    """Create the message search configured for `app`.
+
+    MESSAGE_SEARCH_BACKEND picks 'postgres' or 'memory'; by default it's
+    'postgres' when the database is PostgreSQL.
+    """
+
+    backend = app.config.get('MESSAGE_SEARCH_BACKEND')
+
+    if backend is None:
+        backend = ('postgres' if db.engine.dialect.name == 'postgresql'
+                   else 'memory')
+
+    search = SEARCH_BACKENDS[backend]()
+    app.extensions['message_search'] = search
+
+    return search
@@ -0,0 +1,396 @@
+"""Request metrics, in Prometheus text format for `/metrics`.
+
+For every request this records, by endpoint:
+
+- how long it took, start to finish (including rendering a streamed body)
+- how long it spent waiting on the database
+- the response size, when it's known up front (not for streamed pages)
+- how many requests are being handled right now
+
+plus how long each template took to render. Durations and sizes go into
+histograms, so Prometheus can work out percentiles across workers.
+
+Each gunicorn worker is its own process with its own numbers, and a scrape
+of `/metrics` reaches just one of them. So with METRICS_DIR set, every
+worker writes a snapshot of its numbers to its own file in that directory
+(at most every METRICS_FLUSH_INTERVAL seconds, as requests finish, and when
+it exits), and `/metrics` adds up all the files. Counts from workers that
+have since exited are kept, so totals don't go backwards when a worker is
+replaced; their in-flight gauges are dropped. The directory should be
+emptied whenever the server (re)starts. Without METRICS_DIR, `/metrics`
+only reports the worker that answers it.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import before_render_template, request, template_rendered
+from sqlalchemy import event
+
+from models import db
+
+METRICS_FLUSH_INTERVAL = 5
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'warbler_requests_total': (
+        'counter', "Requests handled.", None),
+    'warbler_request_duration_seconds': (
+        'histogram', "Time to handle a request, including streaming the body.",
+        DURATION_BUCKETS),
+    'warbler_request_db_seconds': (
+        'histogram', "Time a request spent running SQL.", DURATION_BUCKETS),
+    'warbler_response_size_bytes': (
+        'histogram', "Size of responses whose length is known up front.",
+        SIZE_BUCKETS),
+    'warbler_template_render_seconds': (
+        'histogram', "Time to render a template.", DURATION_BUCKETS),
+    'warbler_requests_in_flight': (
+        'gauge', "Requests being handled.", None),
+}
+
+# the request being handled: [start, endpoint, db seconds]
+_current = ContextVar('metrics_request', default=None)
+
+# templates being rendered in this context: [start, ...]
+_rendering = ContextVar('metrics_rendering', default=None)
+
+
+class Metrics:
+    """Per-worker metrics, optionally shared through files in `directory`."""
+
+    def __init__(self, directory=None, flush_interval=METRICS_FLUSH_INTERVAL,
+                 clock=time.monotonic):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.clock = clock
+
+        self.metrics = dict(METRICS)
+        self._lock = threading.Lock()
+        self._reset()
+
+        # name -> function returning this worker's current value
+        self._collectors = {}
+
+    def _reset(self):
+        self._counters = {}
+        self._histograms = {}
+        self.in_flight = 0
+        self._pid = os.getpid()
+        self._flushed_at = self.clock()
+
+    def init_app(self, app, engine):
+        """Measure `app`'s requests, and the SQL they run on `engine`."""
+
+        self.watch(engine)
+
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._rendered, app)
+
+        app.before_request(self._start)
+        app.after_request(self._response)
+        app.teardown_request(self._finish)
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def watch(self, engine):
+        """Also measure the SQL run on `engine` (a replica's)."""
+
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    ##########################################################################
+    # Recording
+
+    def inc(self, name, labels, amount=1):
+        """Add `amount` to a counter."""
+
+        key = (name, _label_key(labels))
+
+        with self._lock:
+            self._check_pid()
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """Add `value` to a histogram."""
+
+        key = (name, _label_key(labels))
+        buckets = self.metrics[name][2]
+
+        with self._lock:
+            self._check_pid()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # a count per bucket (not cumulative), then sum and count
+                histogram = self._histograms[key] = [0] * len(buckets) + [
+                    0.0, 0]
+
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def add_collector(self, name, kind, help, collect):
+        """Report `collect()` (this worker's value of a counter or gauge)
+        as metric `name`."""
+
+        self.metrics[name] = (kind, help, None)
+        self._collectors[name] = collect
+
+    def _check_pid(self):
+        # a worker forked from a process that already counted something
+        # starts from zero
+        if os.getpid() != self._pid:
+            self._reset()
+
+    ##########################################################################
+    # Request hooks
+
+    def _start(self):
+        with self._lock:
+            self._check_pid()
+            self.in_flight += 1
+
+        _current.set([time.perf_counter(), _endpoint(), 0.0])
+
+    def _response(self, response):
+        state = _current.get()
+
+        if state is not None:
+            labels = dict(endpoint=state[1], method=request.method)
+            self.inc('warbler_requests_total',
+                     dict(labels, status=str(response.status_code)))
+
+            if response.content_length is not None:
+                self.observe('warbler_response_size_bytes', labels,
+                             response.content_length)
+
+        return response
+
+    def _finish(self, exc):
+        state = _current.get()
+
+        if state is None:
+            return
+
+        _current.set(None)
+        start, endpoint, db_seconds = state
+        labels = dict(endpoint=endpoint, method=request.method)
+
+        self.observe('warbler_request_duration_seconds', labels,
+                     time.perf_counter() - start)
+        self.observe('warbler_request_db_seconds', labels, db_seconds)
+
+        with self._lock:
+            self.in_flight -= 1
+            due = self.clock() - self._flushed_at >= self.flush_interval
+
+        if self.directory and due:
+            self.flush()
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        if _current.get() is not None:
+            conn.info['metrics_start'] = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        state = _current.get()
+        start = conn.info.pop('metrics_start', None)
+
+        if state is not None and start is not None:
+            state[2] += time.perf_counter() - start
+
+    def _before_render(self, app, template, context, **extra):
+        starts = _rendering.get()
+        if starts is None:
+            starts = []
+            _rendering.set(starts)
+
+        starts.append(time.perf_counter())
+
+    def _rendered(self, app, template, context, **extra):
+        starts = _rendering.get()
+
+        if starts:
+            self.observe('warbler_template_render_seconds',
+                         dict(template=template.name or "<string>"),
+                         time.perf_counter() - starts.pop())
+
+    ##########################################################################
+    # Sharing and reporting
+
+    def snapshot(self):
+        """This worker's numbers, as a JSON-friendly dict."""
+
+        with self._lock:
+            self._check_pid()
+
+            counters = [[name, labels, value]
+                        for (name, labels), value in self._counters.items()]
+            histograms = [[name, labels, values]
+                          for (name, labels), values
+                          in self._histograms.items()]
+            gauges = [['warbler_requests_in_flight', [], self.in_flight]]
+
+        for name, collect in self._collectors.items():
+            kind = self.metrics[name][0]
+            (counters if kind == 'counter' else gauges).append(
+                [name, [], collect()])
+
+        return dict(pid=self._pid, counters=counters, histograms=histograms,
+                    gauges=gauges)
+
+    def flush(self):
+        """Write this worker's snapshot to its file in `directory`."""
+
+        if not self.directory:
+            return
+
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        temp = f"{path}.tmp"
+
+        with open(temp, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temp, path)
+
+        with self._lock:
+            self._flushed_at = self.clock()
+
+    def collect(self):
+        """The snapshots of every worker (just this one without a
+        `directory`)."""
+
+        if not self.directory:
+            return [self.snapshot()]
+
+        self.flush()
+        snapshots = []
+
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json"):
+                continue
+
+            try:
+                with open(os.path.join(self.directory, filename)) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                # written over or removed while being read
+                continue
+
+            if not _is_running(snapshot['pid']):
+                snapshot['gauges'] = []
+            snapshots.append(snapshot)
+
+        return snapshots
+
+    def render(self):
+        """Every worker's numbers, added up, in Prometheus text format."""
+
+        samples = {}
+
+        for snapshot in self.collect():
+            for section in ['counters', 'gauges']:
+                for name, labels, value in snapshot[section]:
+                    key = (name, tuple(map(tuple, labels)))
+                    samples[key] = samples.get(key, 0) + value
+
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = samples.get(key)
+                samples[key] = (values if total is None
+                                else [a + b for a, b in zip(total, values)])
+
+        lines = []
+
+        for name, (kind, help, buckets) in self.metrics.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for (sample_name, labels), value in sorted(samples.items()):
+                if sample_name != name:
+                    continue
+
+                if kind != 'histogram':
+                    lines.append(f"{name}{_labels(labels)} {value}")
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(buckets, value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket"
+                                 f"{_labels(labels, le=repr(bound))} "
+                                 f"{cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} "
+                             f"{value[-1]}")
+                lines.append(f"{name}_sum{_labels(labels)} {value[-2]}")
+                lines.append(f"{name}_count{_labels(labels)} {value[-1]}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _endpoint():
+    return request.url_rule.endpoint if request.url_rule else "unmatched"
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _labels(labels, **extra):
+    """Prometheus label set, like {a="1",b="2"}."""
+
+    pairs = list(labels) + list(extra.items())
+
+    if not pairs:
+        return ""
+
+    escape = (lambda value: str(value).replace("\\", "\\\\")
+              .replace('"', '\\"').replace("\n", "\\n"))
+
+    return "{" + ",".join(f'{name}="{escape(value)}"'
+                          for name, value in pairs) + "}"
+
+
+def _is_running(pid):
+    if pid == os.getpid():
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def connect_metrics(app):
+    """Set up request metrics for `app`.
+
+    METRICS_DIR is the directory workers share their numbers through
+    (unset: each worker reports only its own); METRICS_FLUSH_INTERVAL is
+    how often, in seconds, a worker writes its numbers there.
+    """
+
+    metrics = Metrics(
+        directory=app.config.get('METRICS_DIR'),
+        flush_interval=app.config.get(
+            'METRICS_FLUSH_INTERVAL', METRICS_FLUSH_INTERVAL))
+    metrics.init_app(app, db.engine)
+    app.extensions['metrics'] = metrics
+
+    return metrics
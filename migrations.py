@@ -0,0 +1,176 @@
+"""Bringing an existing database's schema up to date.
+
+`db.create_all()` makes the tables a new database needs, but never changes
+a table that already exists: a database made before a column or index was
+added to models.py just goes without it. So each such change also has a
+migration here, a function that makes it on an older database.
+
+`flask migrate` runs, in order, the migrations a database hasn't had yet,
+recording each one in the `schema_migrations` table as it commits. A
+database made from scratch by `create_all` already has everything, so
+making it records every migration as applied.
+
+Migrations check before they change anything, so they're safe on a
+database that already has their change (one patched by hand, or by the
+older `flask search-indexes`).
+
+Later migrations may not have run yet when one does, so a migration can't
+use the models to fill in what it added. Instead it returns a function to
+do that, which is run once every migration has.
+
+To change the schema: change models.py, then add a function to MIGRATIONS
+(at the end; never reorder or rename them) that makes the same change.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import event
+
+import counters
+from models import (
+    db, User, Message, Follow, Like, create_message_search_index,
+    create_username_search_indexes)
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('name', db.String(100), primary_key=True),
+    db.Column('applied_at', db.DateTime, nullable=False,
+              default=datetime.utcnow),
+)
+
+
+def _add_columns(table, names):
+    """Add the columns `names` of `table` that the database lacks; returns
+    the names added."""
+
+    connection = db.session.connection()
+    existing = {column['name']
+                for column in db.inspect(connection).get_columns(table.name)}
+    added = []
+
+    for name in names:
+        if name in existing:
+            continue
+
+        column = table.c[name]
+        connection.execute(db.text(
+            f"ALTER TABLE {table.name} ADD COLUMN {name} "
+            f"{column.type.compile(connection.dialect)} NOT NULL "
+            f"DEFAULT {column.server_default.arg}"))
+        added.append(name)
+
+    return added
+
+
+def add_counters():
+    """Stored counts on users and messages (see counters.py)."""
+
+    added = _add_columns(User.__table__, [
+        'messages_count', 'followers_count', 'following_count',
+        'likes_count', 'likes_received_count'])
+    added += _add_columns(Message.__table__, ['likes_count'])
+
+    if added:
+        return counters.recount
+
+
+def add_search_indexes():
+    """Username and message search indexes."""
+
+    create_username_search_indexes(db.session.connection())
+    create_message_search_index(db.session.connection())
+
+
+def add_versions():
+    """Row versions for ETags (see conditional.py)."""
+
+    _add_columns(User.__table__, ['version'])
+    _add_columns(Message.__table__, ['version'])
+
+
+def add_hot_query_indexes():
+    """Indexes for reading a user's messages newest first, and their likes
+    (see test_query_plans.py)."""
+
+    for index in [*Message.__table__.indexes, *Like.__table__.indexes]:
+        index.create(db.session.connection(), checkfirst=True)
+
+
+def add_follows_index():
+    """Index for reading who a user follows (add_hot_query_indexes missed
+    it)."""
+
+    for index in Follow.__table__.indexes:
+        index.create(db.session.connection(), checkfirst=True)
+
+
+MIGRATIONS = [
+    add_counters,
+    add_search_indexes,
+    add_versions,
+    add_hot_query_indexes,
+    add_follows_index,
+]
+
+
+def applied():
+    """Names of the migrations this database has had."""
+
+    return set(db.session.scalars(db.select(schema_migrations.c.name)))
+
+
+def pending():
+    """The migrations this database hasn't had yet, in order."""
+
+    schema_migrations.create(db.session.connection(), checkfirst=True)
+    done = applied()
+
+    return [migration for migration in MIGRATIONS
+            if migration.__name__ not in done]
+
+
+def database_id(connection=None):
+    """When this database's schema was made (or first migrated), as a str.
+
+    A database dropped and made again (as seed.py does) gets a new one, so
+    anything kept outside it (see timelines.py) can tell that the ids it
+    holds have been reused.
+    """
+
+    applied_at = (connection or db.session).scalar(
+        db.select(db.func.min(schema_migrations.c.applied_at)))
+
+    return applied_at and applied_at.isoformat()
+
+
+def migrate():
+    """Run every pending migration, each in its own transaction, then
+    what they left to do; returns the names of the migrations run."""
+
+    names = []
+    afterwards = []
+
+    for migration in pending():
+        then = migration()
+        db.session.execute(
+            db.insert(schema_migrations).values(name=migration.__name__))
+        db.session.commit()
+
+        names.append(migration.__name__)
+        if then is not None:
+            afterwards.append(then)
+
+    for then in afterwards:
+        then()
+        db.session.commit()
+
+    return names
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _record_migrations(metadata, connection, tables=(), **kw):
+    # only when create_all made the whole schema: otherwise older tables
+    # may still need their migrations
+    if set(metadata.tables.values()) <= set(tables):
+        connection.execute(db.insert(schema_migrations), [
+            dict(name=migration.__name__) for migration in MIGRATIONS])
@@ -2,11 +2,14 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from passwords import passwords
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 DEFAULT_IMAGE_URL = (
     "https://icon-library.com/images/default-user-icon/" +
@@ -17,12 +20,34 @@ DEFAULT_HEADER_IMAGE_URL = (
     "rb-4.0.3&ixid=MnwxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8&auto=for" +
     "mat&fit=crop&w=2070&q=80")
 
+# Used by User.toggle_like: +1 if it added a like, -1 if it removed one
+TOGGLE_LIKE_SQL = db.text("""
+    WITH deleted AS (
+        DELETE FROM likes
+        WHERE user_id = :user_id AND message_id = :message_id
+        RETURNING 1
+    ), inserted AS (
+        INSERT INTO likes (user_id, message_id)
+        SELECT :user_id, :message_id
+        WHERE NOT EXISTS (SELECT 1 FROM deleted)
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    )
+    SELECT (SELECT count(*) FROM inserted) - (SELECT count(*) FROM deleted)
+""")
+
 
 class Follow(db.Model):
     """Connection of a follower <-> followed_user."""
 
     __tablename__ = 'follows'
 
+    # the primary key serves "who follows X"; this serves "who X follows"
+    __table_args__ = (
+        db.Index('ix_follows_following', 'user_following_id',
+                 'user_being_followed_id'),
+    )
+
     user_being_followed_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete="cascade"),
@@ -87,6 +112,54 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Stored counts, kept up to date by the write routes (see counters.py)
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # likes this user has given...
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # ... and likes their messages have received
+    likes_received_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # bumped by every change to what the user's pages show (see
+    # conditional.py)
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
     messages = db.relationship('Message', backref="user")
 
     followers = db.relationship(
@@ -115,7 +188,7 @@ class User(db.Model):
         Hashes password and adds user to session.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash(password)
 
         user = User(
             username=username,
@@ -137,59 +210,217 @@ class User(db.Model):
 
         If this can't find matching user (or if password is wrong), returns
         False.
+
+        If the user's hash was made with an old work factor, it is replaced
+        with one made with the current factor (commit to save it).
+
+        The bcrypt work runs on the password pool; if that's too busy, this
+        raises PasswordPoolBusy.
         """
 
         user = cls.query.filter_by(username=username).one_or_none()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check(user.password, password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash(password)
                 return user
 
         return False
 
-    # TODO: We can change these two methods to be 'other_user in self.followers'
+    def following_ids(self):
+        """Ids of everyone this user follows, as a set.
+
+        Loaded with one query on `follows` the first time it's needed, then
+        kept on this instance for the rest of the request (see
+        `forget_follow_ids`), or until it is expired sooner, so repeat checks
+        cost nothing.
+        """
+
+        if '_following_ids' not in self.__dict__:
+            rows = (db.session
+                    .query(Follow.user_being_followed_id)
+                    .filter(Follow.user_following_id == self.id)
+                    .all())
+            self._following_ids = {user_id for user_id, in rows}
+
+        return self._following_ids
+
+    def follower_ids(self):
+        """Ids of everyone following this user, as a set.
+
+        Cached the same way as `following_ids`.
+        """
+
+        if '_follower_ids' not in self.__dict__:
+            rows = (db.session
+                    .query(Follow.user_following_id)
+                    .filter(Follow.user_being_followed_id == self.id)
+                    .all())
+            self._follower_ids = {user_id for user_id, in rows}
+
+        return self._follower_ids
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [
-            user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
-
-        # return other_user in self.followers
+        return other_user.id in self.follower_ids()
 
     def is_following(self, other_user):
+        """Is this user following `other_user`?"""
+
+        return other_user.id in self.following_ids()
+
+    def following_status(self, user_ids):
+        """Map each of `user_ids` to whether this user follows them.
+
+        For list pages: answers for a whole page with at most one query,
+        filtered to just those ids, rather than loading everyone this user
+        follows (unless that's already cached).
+        """
+
+        if '_following_ids' in self.__dict__ or not user_ids:
+            followed = self.following_ids()
+        else:
+            rows = (db.session
+                    .query(Follow.user_being_followed_id)
+                    .filter(Follow.user_following_id == self.id,
+                            Follow.user_being_followed_id.in_(user_ids))
+                    .all())
+            followed = {user_id for user_id, in rows}
+
+        return {user_id: user_id in followed for user_id in user_ids}
+
+    def liked_message_ids(self, message_ids):
+        """Which of `message_ids` has this user liked? Returns a set.
 
-        """Is this user following `other_use`?"""
+        Checks just those ids with one query on `likes`, rather than loading
+        all of `liked_messages`.
+        """
+
+        if not message_ids:
+            return set()
 
-        found_user_list = [
-            user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        rows = (db.session
+                .query(Like.message_id)
+                .filter(Like.user_id == self.id,
+                        Like.message_id.in_(message_ids))
+                .all())
 
-        # return other_user in self.following
+        return {message_id for message_id, in rows}
 
     def toggle_like(self, message):
         """ Toggles the like status of a message for this user.
-        If the user owns this message, does not toggle and returns false. """
 
-        # if message is owned by user, return False
-        if message in self.messages:
-            return False
+        Works directly on the `likes` table (never loading `messages` or
+        `liked_messages`), so it takes the same time however much the user
+        has written or liked. Collections already loaded in the session
+        catch up when the transaction commits.
 
-        # user doesn't own message, so we're good to toggle
-        if message in self.liked_messages:
-            self.liked_messages.remove(message)
-        else:
-            self.liked_messages.append(message)
+        Returns 1 if the message is now liked, -1 if it was unliked, and 0
+        if nothing changed: the user owns this message, or a concurrent
+        toggle (say, a double click) already made the same change. """
+
+        # if message is owned by user, don't toggle
+        if message.user_id == self.id:
+            return 0
+
+        if message.id is None:
+            db.session.add(message)
+            db.session.flush()
+
+        params = dict(user_id=self.id, message_id=message.id)
+
+        if db.session.get_bind().dialect.name == 'postgresql':
+            # delete the like if there is one, otherwise insert it, as one
+            # atomic statement
+            return db.session.execute(TOGGLE_LIKE_SQL, params).scalar()
+
+        # elsewhere (i.e. SQLite, which only has one writer at a time
+        # anyway), the same thing in two steps
+        deleted = db.session.execute(
+            db.delete(Like).filter_by(**params)).rowcount
+
+        if deleted:
+            return -1
+
+        inserted = db.session.execute(
+            sqlite_insert(Like).values(**params).on_conflict_do_nothing())
+
+        return inserted.rowcount
+
+
+@event.listens_for(User, 'expire')
+@event.listens_for(User, 'refresh')
+def _forget_follow_ids(user, *args):
+    """Drop cached follow id sets whenever a user's attributes are reloaded."""
+
+    # a rollback also expires users that have since been garbage collected
+    if user is None:
+        return
+
+    user.__dict__.pop('_following_ids', None)
+    user.__dict__.pop('_follower_ids', None)
+
+
+def forget_follow_ids():
+    """Drop the cached follow id sets of every user in the session.
+
+    Called as each request starts: the session outlives requests, and one
+    that only reads never commits or rolls back, so its users would keep
+    their sets (and they'd go stale) otherwise.
+    """
+
+    for instance in db.session.identity_map.values():
+        if isinstance(instance, User):
+            _forget_follow_ids(instance)
+
+
+def create_username_search_indexes(connection):
+    """Index usernames for `/users` search (PostgreSQL only).
+
+    A btree over lower(username) serves prefix matches. Where the pg_trgm
+    extension is available, a trigram GIN index also serves matches
+    anywhere in the name; without it those fall back to a table scan.
+
+    Safe to run again on a database that already has them.
+    """
+
+    if connection.dialect.name != 'postgresql':
+        return
+
+    connection.execute(db.text(
+        "CREATE INDEX IF NOT EXISTS ix_users_username_lower "
+        "ON users (lower(username) text_pattern_ops)"))
+
+    has_trigrams = connection.execute(db.text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    )).scalar()
+
+    if has_trigrams:
+        connection.execute(db.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        connection.execute(db.text(
+            "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+            "ON users USING gin (lower(username) gin_trgm_ops)"))
+
+
+@event.listens_for(User.__table__, 'after_create')
+def _create_username_search_indexes(table, connection, **kw):
+    create_username_search_indexes(connection)
 
-        # return True since we were able to toggle
-        return True
 
 class Message(db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
 
+    # a user's messages newest first: profiles, timelines, deleting a user
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp',
+                 'id'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -212,12 +443,53 @@ class Message(db.Model):
         nullable=False,
     )
 
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # bumped along with likes_count (see conditional.py)
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+
+def create_message_search_index(connection):
+    """Add the full-text index used by message search (PostgreSQL only).
+
+    A GIN index over each message's words, as `to_tsvector('english',
+    text)`; see message_search.py. Safe to run again on a database that
+    already has it.
+    """
+
+    if connection.dialect.name != 'postgresql':
+        return
+
+    connection.execute(db.text(
+        "CREATE INDEX IF NOT EXISTS ix_messages_text_search "
+        "ON messages USING gin (to_tsvector('english'::regconfig, text))"))
+
+
+@event.listens_for(Message.__table__, 'after_create')
+def _create_message_search_index(table, connection, **kw):
+    create_message_search_index(connection)
+
 
 class Like(db.Model):
     """A user like of a message ("warble")."""
 
     __tablename__ = 'likes'
 
+    # the primary key serves "who liked X"; this serves "what X liked"
+    __table_args__ = (
+        db.Index('ix_likes_user_id', 'user_id', 'message_id'),
+    )
+
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id'),
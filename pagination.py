@@ -0,0 +1,318 @@
+"""Keyset ("cursor") pagination for lists of messages and users.
+
+Pages are found by comparing against the (timestamp, id) of the last
+message already shown rather than with OFFSET, so the database can jump
+straight to the right spot in its index: page 500 costs the same as page 1.
+
+The position is handed to the browser as an opaque cursor string in a
+`before` (older messages) or `after` (newer messages) query parameter.
+
+Pages can also be streamed (see StreamedPage): rows are read with a
+server-side cursor while the template renders, so a big page never has to
+be held in memory all at once.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from datetime import datetime
+from itertools import islice
+
+from flask import request
+from werkzeug.exceptions import BadRequest
+
+from models import db, Message, User
+
+MESSAGES_PER_PAGE = 100
+USERS_PER_PAGE = 48
+
+# rows read from the database at a time when streaming a page
+STREAM_CHUNK_SIZE = 500
+
+
+def pack_cursor(*parts):
+    """Opaque cursor string holding the strings `parts`."""
+
+    raw = "|".join(parts)
+    return urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def unpack_cursor(cursor, num_parts):
+    """The `num_parts` strings in a cursor made by `pack_cursor`.
+
+    Only the last part may itself contain a "|". Raises BadRequest for
+    anything that isn't a valid cursor.
+    """
+
+    try:
+        raw = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+
+    except (DecodeError, UnicodeDecodeError, ValueError):
+        raise BadRequest("Invalid page cursor.")
+
+    parts = raw.split("|", num_parts - 1)
+
+    if len(parts) != num_parts:
+        raise BadRequest("Invalid page cursor.")
+
+    return parts
+
+
+def encode_cursor(message):
+    """Opaque cursor string for the position of `message`."""
+
+    return pack_cursor(message.timestamp.isoformat(), str(message.id))
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) position from a cursor made by `encode_cursor`.
+
+    Raises BadRequest for anything that isn't a valid cursor.
+    """
+
+    timestamp, message_id = unpack_cursor(cursor, 2)
+
+    try:
+        return datetime.fromisoformat(timestamp), int(message_id)
+
+    except ValueError:
+        raise BadRequest("Invalid page cursor.")
+
+
+def encode_id_cursor(id):
+    """Opaque cursor string for a position in a list ordered by id."""
+
+    return pack_cursor(str(id))
+
+
+def decode_id_cursor(cursor):
+    """The id in a cursor made by `encode_id_cursor`.
+
+    Raises BadRequest for anything that isn't a valid cursor.
+    """
+
+    id, = unpack_cursor(cursor, 1)
+
+    try:
+        return int(id)
+
+    except ValueError:
+        raise BadRequest("Invalid page cursor.")
+
+
+def cursor_args():
+    """(before, after) positions from the request's query string."""
+
+    before = request.args.get('before')
+    after = request.args.get('after')
+
+    return (before and decode_cursor(before), after and decode_cursor(after))
+
+
+class Page:
+    """One page of messages, newest first, with cursors to its neighbours.
+
+    `older` / `newer` are cursor strings for the next page in each direction,
+    or None when there is nothing more that way.
+    """
+
+    def __init__(self, messages, per_page, before=None, after=None):
+        """Build a page from up to `per_page + 1` messages, newest first.
+
+        The extra message, if present, only tells us there is another page;
+        it is at the old end for a `before` (or first) page and at the new
+        end for an `after` page.
+        """
+
+        has_more = len(messages) > per_page
+
+        if after is not None:
+            self.messages = messages[-per_page:]
+            has_newer, has_older = has_more, True
+        else:
+            self.messages = messages[:per_page]
+            has_newer, has_older = before is not None, has_more
+
+        self.newer = (encode_cursor(self.messages[0])
+                      if has_newer and self.messages else None)
+        self.older = (encode_cursor(self.messages[-1])
+                      if has_older and self.messages else None)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __len__(self):
+        return len(self.messages)
+
+
+class StreamedPage:
+    """A page whose rows are read from the database as it's iterated.
+
+    `query` is already filtered to start at the page's position and put in
+    page order. It runs with a server-side cursor (`yield_per`), `chunk_size`
+    rows at a time, and each chunk is passed to `on_chunk` before any of
+    its rows are handed out, so per-row lookups (follow status, likes) can
+    be made a chunk at a time too.
+
+    `item` turns a row into what the page holds, and `cursor` a row into a
+    cursor string. Whether there's a next page is only known once the rows
+    run out, so templates must only read `older` / `after` after looping
+    over the page; `newer` can be read any time after the first row.
+
+    The page can only be iterated once.
+    """
+
+    def __init__(self, query, per_page, cursor, item=None, on_chunk=None,
+                 has_newer=False, chunk_size=STREAM_CHUNK_SIZE):
+        self.query = query
+        self.per_page = per_page
+        self.cursor = cursor
+        self.item = item or (lambda row: row)
+        self.on_chunk = on_chunk
+        self.has_newer = has_newer
+        self.chunk_size = chunk_size
+
+        self.first = None
+        self.last = None
+        self.has_more = False
+
+    def __iter__(self):
+        rows = iter(self.query
+                    .limit(self.per_page + 1)
+                    .yield_per(self.chunk_size))
+        shown = 0
+
+        while shown < self.per_page:
+            chunk = list(islice(
+                rows, min(self.chunk_size, self.per_page - shown)))
+            if not chunk:
+                break
+
+            if self.first is None:
+                self.first = chunk[0]
+            self.last = chunk[-1]
+            shown += len(chunk)
+
+            items = [self.item(row) for row in chunk]
+            if self.on_chunk:
+                self.on_chunk(items)
+
+            yield from items
+
+        self.has_more = next(rows, None) is not None
+
+    @property
+    def newer(self):
+        if self.has_newer and self.first is not None:
+            return self.cursor(self.first)
+
+    @property
+    def older(self):
+        if self.has_more:
+            return self.cursor(self.last)
+
+    after = older
+
+
+def paginate_messages(query, before=None, after=None,
+                      per_page=MESSAGES_PER_PAGE, on_chunk=None,
+                      stream=False):
+    """Page through the messages selected by `query`, newest first.
+
+    `on_chunk` is called with the page's messages (in chunks, if streamed).
+    With `stream`, returns a StreamedPage; pages of newer messages (with
+    `after`) are read in the opposite order and so are never streamed.
+    """
+
+    position = db.tuple_(Message.timestamp, Message.id)
+
+    if after is not None:
+        rows = (query
+                .filter(position > after)
+                .order_by(Message.timestamp, Message.id)
+                .limit(per_page + 1)
+                .all())
+        rows.reverse()
+    else:
+        if before is not None:
+            query = query.filter(position < before)
+
+        query = query.order_by(Message.timestamp.desc(), Message.id.desc())
+
+        if stream:
+            return StreamedPage(query, per_page, encode_cursor,
+                                on_chunk=on_chunk,
+                                has_newer=before is not None)
+
+        rows = query.limit(per_page + 1).all()
+
+    page = Page(rows, per_page, before=before, after=after)
+
+    if on_chunk:
+        on_chunk(page.messages)
+
+    return page
+
+
+class UserPage:
+    """One page of users, with a cursor to the next page (or None)."""
+
+    def __init__(self, users, after):
+        self.users = users
+        self.after = after
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __len__(self):
+        return len(self.users)
+
+
+def paginate_users(query, position, after=None, per_page=USERS_PER_PAGE,
+                   on_chunk=None, stream=False):
+    """Page through the users selected by `query`, in order of `position`.
+
+    `position` is a column holding each user's id (User.id, or the
+    matching column of a table joined to users, when that's what the
+    query's index is ordered by). `after` is the id the page starts after.
+
+    `on_chunk` is called with the page's users (in chunks, if streamed).
+    With `stream`, returns a StreamedPage.
+    """
+
+    if after is not None:
+        query = query.filter(position > after)
+
+    query = query.order_by(position)
+
+    if stream:
+        return StreamedPage(query, per_page,
+                            lambda user: encode_id_cursor(user.id),
+                            on_chunk=on_chunk)
+
+    users = query.limit(per_page + 1).all()
+    page = UserPage(users[:per_page],
+                    encode_id_cursor(users[per_page - 1].id)
+                    if len(users) > per_page else None)
+
+    if on_chunk:
+        on_chunk(page.users)
+
+    return page
+
+
+def users_page_version(query, position, after=None, per_page=USERS_PER_PAGE):
+    """A scalar subquery adding up the versions of the users on the page
+    `paginate_users` would show (for its ETag: it changes when any of them
+    does)."""
+
+    if after is not None:
+        query = query.filter(position > after)
+
+    page = (query
+            .with_entities(User.version)
+            .order_by(position)
+            .limit(per_page)
+            .subquery())
+
+    return (db.select(db.func.coalesce(db.func.sum(page.c.version), 0))
+            .scalar_subquery())
@@ -0,0 +1,173 @@
+"""Password hashing and checking on a bounded pool of workers.
+
+bcrypt is slow on purpose: at the default work factor of 12, one hash or
+check takes about a quarter of a second of CPU. With every web worker and
+thread hashing at once, a burst of logins can take every core, starving the
+rest of the site.
+
+Here the bcrypt calls run on a small pool instead (threads by default:
+bcrypt releases the GIL while it works, so threads really do run in
+parallel). The pool is sized to the machine's cores rather than to the
+number of web workers or threads, which limits how many hashes run at
+once. The request's thread still waits for its result, so the pool doesn't
+free it for other requests; instead it only lets so many calls wait for a
+turn. Past that, `PasswordPoolBusy` (a 503 asking the client to retry) is
+raised right away, rather than letting requests pile up behind minutes of
+hashing.
+
+Hashes record the work factor they were made with. `needs_rehash` tells a
+successful login that the user's hash was made with a different factor than
+the configured one, so it can be replaced while the password is at hand.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bcrypt
+from werkzeug.exceptions import ServiceUnavailable
+
+# flask_bcrypt's default, which existing hashes were made with
+BCRYPT_LOG_ROUNDS = 12
+
+
+class PasswordPoolBusy(ServiceUnavailable):
+    """Too many password checks are already waiting; try again shortly."""
+
+    description = "Too many sign-ins right now. Please try again shortly."
+
+    def __init__(self, retry_after=1):
+        super().__init__(retry_after=retry_after)
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _check(pw_hash, password):
+    return bcrypt.checkpw(password.encode(), pw_hash.encode())
+
+
+class PasswordPool:
+    """Runs bcrypt hashes and checks on a bounded pool, limiting how many run
+    at once (each caller still waits for its own).
+
+    `workers` calls run at once and up to `max_waiting` more may queue for a
+    turn; a call that can't get a place within `wait` seconds raises
+    PasswordPoolBusy. `kind` is 'thread' or 'process'.
+
+    The pool itself is only started on first use, so it is created in the
+    web worker that uses it (after gunicorn forks), not in its parent.
+    """
+
+    def __init__(self, workers=None, max_waiting=None, wait=0.5,
+                 rounds=BCRYPT_LOG_ROUNDS, kind='thread'):
+        self._lock = threading.Lock()
+        self.configure(workers, max_waiting, wait, rounds, kind)
+
+    def configure(self, workers=None, max_waiting=None, wait=0.5,
+                  rounds=BCRYPT_LOG_ROUNDS, kind='thread'):
+        """(Re)configure the pool; takes effect on the next call.
+
+        Calls already running finish on the old pool, and give their place
+        back to it.
+        """
+
+        self.shutdown(wait=False)
+
+        self.workers = workers or os.cpu_count() or 1
+        self.max_waiting = (max_waiting if max_waiting is not None
+                            else 4 * self.workers)
+        self.wait = wait
+        self.rounds = rounds
+        self.kind = kind
+
+        self._slots = threading.BoundedSemaphore(
+            self.workers + self.max_waiting)
+        self._executor = None
+
+        self.in_use = 0
+        self.rejected = 0
+
+    def init_app(self, app):
+        """Configure from `app`'s PASSWORD_POOL_* and BCRYPT_LOG_ROUNDS."""
+
+        self.configure(
+            workers=app.config.get('PASSWORD_POOL_WORKERS'),
+            max_waiting=app.config.get('PASSWORD_POOL_MAX_WAITING'),
+            wait=app.config.get('PASSWORD_POOL_WAIT', 0.5),
+            rounds=app.config.get('BCRYPT_LOG_ROUNDS', BCRYPT_LOG_ROUNDS),
+            kind=app.config.get('PASSWORD_POOL_KIND', 'thread'),
+        )
+        app.extensions['passwords'] = self
+
+    def hash(self, password):
+        """bcrypt hash (a str) of `password` at the configured work factor."""
+
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        """Does `password` match `pw_hash`?"""
+
+        return self._run(_check, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made with a different work factor than configured?
+
+        A bcrypt hash looks like `$2b$12$...`, where 12 is its work factor.
+        """
+
+        try:
+            return int(pw_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def shutdown(self, wait=True):
+        """Stop the pool's workers (it starts again if used), waiting for
+        running calls unless `wait` is false."""
+
+        executor = getattr(self, '_executor', None)
+        if executor is not None:
+            executor.shutdown(wait=wait)
+            self._executor = None
+
+    def _run(self, fn, *args):
+        """Run fn(*args) on the pool, waiting for the result.
+
+        Raises PasswordPoolBusy if the pool and its queue stay full for
+        longer than `wait` seconds.
+        """
+
+        # configure() may swap in new slots meanwhile: this call gives back
+        # the one it took, and only counts against the pool it took it from
+        slots = self._slots
+
+        if not slots.acquire(timeout=self.wait):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordPoolBusy()
+
+        with self._lock:
+            counted = slots is self._slots
+            if counted:
+                self.in_use += 1
+
+        try:
+            return self._pool().submit(fn, *args).result()
+        finally:
+            with self._lock:
+                if counted and slots is self._slots:
+                    self.in_use -= 1
+            slots.release()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                executor_class = (ProcessPoolExecutor if self.kind == 'process'
+                                  else ThreadPoolExecutor)
+                self._executor = executor_class(max_workers=self.workers)
+
+            return self._executor
+
+
+passwords = PasswordPool()
@@ -0,0 +1,137 @@
+"""Counting the SQL a request runs, for query-budget tests.
+
+A view that quietly turns into an N+1 (one query per row shown) still
+passes every functional test. Query-budget tests catch it: each route has a
+budget, the most statements one request to it may run, and is checked
+against it with both a little data and a lot, so a count that grows with
+the data fails even while it's under budget.
+
+    class MyTestCase(QueryBudgetMixin, TestCase):
+        QUERY_BUDGETS = {'homepage': 4}
+
+        def test_homepage(self):
+            resp, queries = self.request_within_budget(client, "GET", "/")
+
+Or, to count anything else:
+
+    with count_queries() as queries:
+        ...
+    queries.count, queries.kinds(), queries.parameters
+"""
+
+import re
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from sqlalchemy import event
+
+from models import db
+
+# the kinds of statement counted separately
+KINDS = ('select', 'insert', 'update', 'delete')
+
+# the first word of a statement that changes data, inside a WITH statement
+CHANGE_WORD = re.compile(r'\b(insert|update|delete)\b', re.IGNORECASE)
+
+
+def statement_kind(statement):
+    """'select', 'insert', 'update', 'delete' or 'other' for a SQL
+    statement (by its first word).
+
+    A WITH statement is the kind of the first statement in it that changes
+    data (its common table expressions' included), or a select if none does.
+    """
+
+    words = statement.split(None, 1)
+    kind = words[0].lower() if words else ''
+
+    if kind == 'with':
+        change = CHANGE_WORD.search(statement)
+        kind = change.group(1).lower() if change else 'select'
+
+    return kind if kind in KINDS else 'other'
+
+
+class QueryLog:
+    """The statements run inside a `count_queries` block, in order."""
+
+    def __init__(self):
+        self.statements = []
+
+        # each statement's parameters (a list of them for an executemany)
+        self.parameters = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def kinds(self):
+        """Counter of statements by kind (see `statement_kind`)."""
+
+        return Counter(statement_kind(statement)
+                       for statement in self.statements)
+
+    def __str__(self):
+        kinds = ", ".join(f"{count} {kind}"
+                          for kind, count in sorted(self.kinds().items()))
+        lines = [f"{self.count} queries ({kinds})"]
+        lines.extend(f"  {i}. {' '.join(statement.split())}"
+                     for i, statement in enumerate(self.statements, 1))
+
+        return "\n".join(lines)
+
+
+@contextmanager
+def count_queries(engine=None):
+    """Record every statement run on `engine` (default: the app's) inside
+    the block, in the QueryLog it yields."""
+
+    engine = engine or db.engine
+    log = QueryLog()
+
+    def record(conn, cursor, statement, parameters, *args):
+        log.statements.append(statement)
+        log.parameters.append(parameters)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield log
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+class QueryBudgetMixin:
+    """TestCase mixin: check requests against per-route query budgets.
+
+    QUERY_BUDGETS maps endpoint names (view function names) to the most
+    statements a request to that route may run.
+    """
+
+    QUERY_BUDGETS = {}
+
+    def request_within_budget(self, client, method, url, data=None):
+        """Make a request (reading the whole response, in case it's
+        streamed) and fail if it ran more queries than its route's budget.
+
+        Returns (response, QueryLog).
+        """
+
+        path = urlsplit(url).path
+        endpoint, _ = client.application.url_map.bind('').match(
+            path, method=method)
+
+        self.assertIn(endpoint, self.QUERY_BUDGETS,
+                      f"no query budget for {endpoint}")
+        budget = self.QUERY_BUDGETS[endpoint]
+
+        with count_queries() as queries:
+            resp = client.open(url, method=method, data=data)
+            resp.get_data()
+
+        self.assertLessEqual(
+            queries.count, budget,
+            f"{method} {url} ({endpoint}) is over its budget of {budget}: "
+            f"{queries}")
+
+        return resp, queries
@@ -0,0 +1,180 @@
+"""Sending read-only pages' queries to read replicas.
+
+Every query used to go to the one database in SQLALCHEMY_DATABASE_URI, so
+the primary served every profile and timeline read as well as the writes.
+With replicas configured (DATABASE_REPLICA_URLS, which become binds
+named replica1, replica2, ...), the views marked `@replicas.read_only` run
+their SELECTs on a replica instead, one picked at random per request.
+Everything else stays on the primary:
+
+- any statement that isn't a SELECT (including flushes), even in a
+  read-only view
+- SELECTs in a `with primary():` block, for reads whose results
+  are kept (a rebuilt timeline would keep missing what the replica hadn't
+  caught up on yet; a cached user would be stale for its whole TTL)
+- every other view, and anything outside a request
+
+Replicas lag behind the primary a little, so a user who has just made a
+change could load a page that doesn't show it yet. After any request that
+sends a write to the primary, that browser's session is marked to read from
+the primary too for REPLICA_STICKY_SECONDS, long enough for the replicas
+to catch up. The mark is in the (signed) session cookie, so it holds
+whichever worker the next request reaches.
+
+Other users may see someone's change a moment late, as with any replica.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from flask import request, session
+from flask_sqlalchemy.session import Session
+
+REPLICA_STICKY_SECONDS = 10
+
+# session key: until when (a time.time()) this browser reads from the primary
+STICKY_KEY = 'primary_until'
+
+# methods that can be sent to a replica
+READ_METHODS = {'GET', 'HEAD'}
+
+
+class Routing:
+    """Where the request being handled sends its reads."""
+
+    def __init__(self):
+        # the replica engine SELECTs go to, or None for the primary
+        self.replica = None
+
+        # whether it's sent anything but a SELECT to the primary
+        self.wrote = False
+
+
+_current = ContextVar('replica_routing', default=None)
+
+
+@contextmanager
+def primary():
+    """Send the block's SELECTs to the primary, even in a read-only view."""
+
+    routing = _current.get()
+
+    if routing is None or routing.replica is None:
+        yield
+        return
+
+    replica = routing.replica
+    routing.replica = None
+    try:
+        yield
+    finally:
+        routing.replica = replica
+
+
+class RoutingSession(Session):
+    """`db.session`, sending SELECTs to the request's replica if it has
+    one (see the module docstring)."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        routing = _current.get()
+
+        if routing is not None and bind is None:
+            is_select = (not self._flushing
+                         and getattr(clause, 'is_select', False))
+
+            if is_select and routing.replica is not None:
+                return routing.replica
+
+            if not is_select:
+                routing.wrote = True
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+class ReplicaRouter:
+    """Picks where each request reads from (see the module docstring)."""
+
+    def __init__(self, engines=(), sticky_seconds=REPLICA_STICKY_SECONDS,
+                 clock=time.time, choose=random.choice):
+        self.engines = list(engines)
+        self.sticky_seconds = sticky_seconds
+        self.clock = clock
+        self.choose = choose
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._response)
+        app.teardown_request(self._finish)
+
+    def read_only(self, view):
+        """Decorator: send `view`'s SELECTs to a replica (for GET and HEAD
+        requests, unless this browser has just written)."""
+
+        @wraps(view)
+        def read_from_replica(*args, **kwargs):
+            routing = _current.get()
+
+            if (routing is not None and self.engines
+                    and request.method in READ_METHODS
+                    and session.get(STICKY_KEY, 0) <= self.clock()):
+                routing.replica = self.choose(self.engines)
+
+            return view(*args, **kwargs)
+
+        return read_from_replica
+
+    def current(self):
+        """The replica engine the request being handled reads from, or None
+        for the primary."""
+
+        routing = _current.get()
+
+        return routing and routing.replica
+
+    def _start(self):
+        _current.set(Routing())
+
+    def _response(self, response):
+        routing = _current.get()
+
+        if routing is not None and routing.wrote:
+            session[STICKY_KEY] = self.clock() + self.sticky_seconds
+
+        return response
+
+    def _finish(self, exc):
+        _current.set(None)
+
+
+def replica_binds(urls):
+    """SQLALCHEMY_BINDS entries for the replica database `urls` (separated
+    by commas or whitespace)."""
+
+    return {f"replica{i}": url
+            for i, url in enumerate(urls.replace(',', ' ').split(), 1)}
+
+
+def connect_replicas(app):
+    """Set up read replica routing for `app`, over the binds named
+    replica1, replica2, ... (see `replica_binds`).
+
+    REPLICA_STICKY_SECONDS is how long a browser reads from the primary
+    after a write.
+    """
+
+    db = app.extensions['sqlalchemy']
+
+    replicas = ReplicaRouter(
+        engines=[db.engines[key] for key in sorted(
+            key for key in db.engines if key and key.startswith('replica'))],
+        sticky_seconds=app.config.get('REPLICA_STICKY_SECONDS',
+                                      REPLICA_STICKY_SECONDS),
+    )
+    replicas.init_app(app)
+    app.extensions['replicas'] = replicas
+
+    return replicas
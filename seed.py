@@ -1,23 +1,42 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follow, Like
+    python seed.py [--dir generator] [--parallel] [--chunk-size 10000]
 
-db.drop_all()
-db.create_all()
+Drops and recreates every table, then bulk loads users.csv, messages.csv,
+follows.csv and likes.csv (whichever exist) from the directory; see
+bulk_load.py. Prints how fast each table loaded.
+"""
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+import argparse
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+from app import db, timelines, message_cards
+from bulk_load import load, CHUNK_SIZE, CSV_DIRECTORY
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follow, DictReader(follows))
 
-db.session.commit()
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dir", default=CSV_DIRECTORY,
+                        help="directory holding the CSV files")
+    parser.add_argument("--parallel", action="store_true",
+                        help="load independent tables at the same time")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="rows per insert when COPY isn't available")
+    args = parser.parse_args()
 
-like1 = Like(user_id=1, message_id=1)
-db.session.add(like1)
-db.session.commit()
+    db.engine.echo = False
+
+    steps = load(args.dir, parallel=args.parallel, chunk_size=args.chunk_size)
+
+    # timelines are keyed by user id, and the ids have all been reused
+    timelines.store.clear()
+    message_cards.store.clear()
+
+    print(f"{'step':<10}{'rows':>12}{'seconds':>10}{'rows/sec':>12}")
+    for step in steps:
+        rows = "" if step.rows is None else step.rows
+        rate = "" if step.rate is None else f"{step.rate:,.0f}"
+        print(f"{step.name:<10}{rows:>12}{step.seconds:>10.2f}{rate:>12}")
+
+
+if __name__ == "__main__":
+    main()
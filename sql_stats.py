@@ -0,0 +1,231 @@
+"""Per-request SQL instrumentation.
+
+SQLALCHEMY_ECHO formats and logs every statement of every request, which
+costs real CPU and I/O and produces a wall of text nobody can read, so it's
+now off unless the SQLALCHEMY_ECHO environment variable is 1. Instead, a
+sample of requests (SQL_STATS_SAMPLE_RATE, from 0 to 1) is measured
+through engine events, keeping for each:
+
+- how many statements ran, and the total time spent in the database
+- the slowest few statements (SQL_STATS_SLOWEST)
+- statements that ran at least SQL_STATS_DUPLICATES times: the mark of an
+  N+1, where a query runs once per row of an earlier one
+
+Statements are compared as SQL text with their placeholders, not their
+parameters, so the N queries of an N+1 count as one statement.
+
+Each sampled request gets a `Server-Timing: db;dur=<ms>;desc="<n> queries"`
+header, which browsers show in their dev tools. The header goes out with
+the response, so for a streamed page it doesn't count the queries run while
+the body renders. The complete record is logged as one JSON line on the
+`warbler.sql` logger when the request finishes.
+
+Requests that aren't sampled only pay for a context variable lookup per
+statement.
+"""
+
+import heapq
+import json
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from flask import request
+from flask.logging import default_handler, has_level_handler
+from sqlalchemy import event
+
+from models import db
+
+SQL_STATS_SLOWEST = 3
+SQL_STATS_DUPLICATES = 5
+
+# longest statement text put in a log line
+MAX_STATEMENT_LENGTH = 300
+
+logger = logging.getLogger('warbler.sql')
+
+# the QueryStats of the request being handled, if it's sampled
+_current = ContextVar('sql_stats', default=None)
+
+
+class QueryStats:
+    """The statements run while handling one request."""
+
+    def __init__(self, slowest=SQL_STATS_SLOWEST,
+                 duplicates=SQL_STATS_DUPLICATES):
+        self.num_slowest = slowest
+        self.duplicate_threshold = duplicates
+
+        self.count = 0
+        self.seconds = 0.0
+        self.status = None
+
+        # statement -> [times run, total seconds]
+        self.statements = {}
+        # min-heap of the slowest (seconds, statement) runs
+        self._slowest = []
+
+    def record(self, statement, seconds):
+        """Count one run of `statement` that took `seconds`."""
+
+        self.count += 1
+        self.seconds += seconds
+
+        totals = self.statements.setdefault(statement, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+        if len(self._slowest) < self.num_slowest:
+            heapq.heappush(self._slowest, (seconds, statement))
+        elif self._slowest and seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (seconds, statement))
+
+    def slowest(self):
+        """(seconds, statement) of the slowest runs, slowest first."""
+
+        return sorted(self._slowest, reverse=True)
+
+    def duplicates(self):
+        """(times run, statement) of likely N+1s, most repeated first."""
+
+        return sorted(
+            ((count, statement)
+             for statement, (count, _) in self.statements.items()
+             if count >= self.duplicate_threshold),
+            reverse=True)
+
+    def server_timing(self):
+        """Value for a Server-Timing header."""
+
+        return f'db;dur={self.seconds * 1000:.1f};desc="{self.count} queries"'
+
+    def as_dict(self):
+        """Everything recorded, ready to be logged as JSON."""
+
+        return dict(
+            queries=self.count,
+            db_ms=round(self.seconds * 1000, 2),
+            slowest=[dict(ms=round(seconds * 1000, 2),
+                          statement=_shorten(statement))
+                     for seconds, statement in self.slowest()],
+            duplicates=[dict(count=count, statement=_shorten(statement))
+                        for count, statement in self.duplicates()],
+        )
+
+
+def _shorten(statement):
+    statement = " ".join(statement.split())
+
+    if len(statement) > MAX_STATEMENT_LENGTH:
+        return statement[:MAX_STATEMENT_LENGTH] + "..."
+
+    return statement
+
+
+class SQLStats:
+    """Samples requests and measures their SQL (see the module docstring)."""
+
+    def __init__(self, sample_rate=0.0, slowest=SQL_STATS_SLOWEST,
+                 duplicates=SQL_STATS_DUPLICATES, header=True, log=True,
+                 random=random.random):
+        self.sample_rate = sample_rate
+        self.slowest = slowest
+        self.duplicates = duplicates
+        self.header = header
+        self.log = log
+        self.random = random
+
+    def init_app(self, app, engine):
+        """Measure the SQL `app`'s requests run on `engine`."""
+
+        self.watch(engine)
+
+        app.before_request(self._start)
+        app.after_request(self._add_header)
+        app.teardown_request(self._finish)
+
+    def watch(self, engine):
+        """Also measure the SQL run on `engine` (a replica's)."""
+
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    def current(self):
+        """The QueryStats of the request being handled, or None if it isn't
+        sampled."""
+
+        return _current.get()
+
+    def _start(self):
+        sampled = self.sample_rate and self.random() < self.sample_rate
+        _current.set(
+            QueryStats(self.slowest, self.duplicates) if sampled else None)
+
+    def _add_header(self, response):
+        stats = _current.get()
+
+        if stats is not None:
+            stats.status = response.status_code
+            if self.header:
+                response.headers.add('Server-Timing', stats.server_timing())
+
+        return response
+
+    def _finish(self, exc):
+        stats = _current.get()
+
+        if stats is None:
+            return
+
+        _current.set(None)
+
+        if self.log:
+            logger.info(json.dumps(dict(
+                method=request.method,
+                path=request.path,
+                status=stats.status,
+                **stats.as_dict(),
+            )))
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        if _current.get() is not None:
+            conn.info['sql_stats_start'] = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        stats = _current.get()
+        start = conn.info.pop('sql_stats_start', None)
+
+        if stats is not None and start is not None:
+            stats.record(statement, time.perf_counter() - start)
+
+
+def connect_sql_stats(app):
+    """Set up SQL instrumentation for `app`.
+
+    SQL_STATS_SAMPLE_RATE is the fraction of requests measured (0 turns it
+    off); SQL_STATS_HEADER and SQL_STATS_LOG turn the Server-Timing header
+    and the log line on or off.
+    """
+
+    sql_stats = SQLStats(
+        sample_rate=app.config.get('SQL_STATS_SAMPLE_RATE', 0.0),
+        slowest=app.config.get('SQL_STATS_SLOWEST', SQL_STATS_SLOWEST),
+        duplicates=app.config.get('SQL_STATS_DUPLICATES',
+                                  SQL_STATS_DUPLICATES),
+        header=app.config.get('SQL_STATS_HEADER', True),
+        log=app.config.get('SQL_STATS_LOG', True),
+    )
+    sql_stats.init_app(app, db.engine)
+    app.extensions['sql_stats'] = sql_stats
+
+    # like Flask does for app.logger: log somewhere, unless logging has
+    # been set up to already
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+    if not has_level_handler(logger):
+        logger.addHandler(default_handler)
+
+    return sql_stats
@@ -0,0 +1,153 @@
+"""Fingerprinted static asset tests."""
+
+import gzip
+import json
+import os
+import tempfile
+from unittest import TestCase, skipIf
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, assets
+import assets as asset_pipeline
+from assets import build, fingerprint
+
+CSS = b'body { background: url("/static/images/bg.png"); }\n' * 20
+PNG = b"\x89PNG not really"
+
+
+class AssetsTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.static = os.path.join(self.directory.name, "static")
+        self.out = os.path.join(self.directory.name, "assets")
+
+        self.write("stylesheets/style.css", CSS)
+        self.write("images/bg.png", PNG)
+
+        self.previous = assets.directory
+
+    def tearDown(self):
+        assets.load(self.previous)
+        self.directory.cleanup()
+
+    def write(self, path, data):
+        path = os.path.join(self.static, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, 'wb') as file:
+            file.write(data)
+
+    def read(self, name):
+        with open(os.path.join(self.out, name), 'rb') as file:
+            return file.read()
+
+    def test_build(self):
+        manifest = build(self.static, self.out, variants={})
+
+        png = manifest['files']['images/bg.png']
+        css = manifest['files']['stylesheets/style.css']
+        self.assertEqual(png, fingerprint("images/bg.png", PNG))
+        self.assertRegex(css, r"^stylesheets/style\.[0-9a-f]{10}\.css$")
+
+        # the stylesheet points at the fingerprinted image
+        self.assertIn(f'url("/assets/{png}")', self.read(css).decode())
+        self.assertNotIn("/static/", self.read(css).decode())
+
+        self.assertEqual(gzip.decompress(self.read(css + ".gz")),
+                         self.read(css))
+        self.assertFalse(os.path.exists(os.path.join(self.out, png + ".gz")))
+
+        with open(os.path.join(self.out, "manifest.json")) as file:
+            self.assertEqual(json.load(file), manifest)
+
+    def test_changed_image_changes_stylesheet(self):
+        before = build(self.static, self.out, variants={})
+        self.write("images/bg.png", PNG + b"!")
+        after = build(self.static, self.out, variants={})
+
+        self.assertNotEqual(before['files']['images/bg.png'],
+                            after['files']['images/bg.png'])
+        self.assertNotEqual(before['files']['stylesheets/style.css'],
+                            after['files']['stylesheets/style.css'])
+
+        # the old files are still there for pages built before
+        self.read(before['files']['stylesheets/style.css'])
+
+    @skipIf(asset_pipeline.Image is None, "Pillow isn't installed")
+    def test_downscaled_variants(self):
+        image = asset_pipeline.Image.new('RGB', (800, 400), 'blue')
+        image.save(os.path.join(self.static, "images", "hero.jpg"))
+
+        manifest = build(self.static, self.out,
+                         variants={'images/hero.jpg': (200, 400, 1000)})
+
+        self.assertEqual(sorted(manifest['variants']['images/hero.jpg']),
+                         ['200', '400'])
+
+        assets.load(self.out)
+        with app.test_request_context():
+            self.assertEqual(
+                assets.url('/static/images/hero.jpg', width=300),
+                f"/assets/{manifest['variants']['images/hero.jpg']['400']}")
+            self.assertEqual(
+                assets.url('images/hero.jpg', width=600),
+                f"/assets/{manifest['files']['images/hero.jpg']}")
+
+    def test_urls(self):
+        manifest = build(self.static, self.out, variants={})
+        assets.load(self.out)
+
+        with app.test_request_context():
+            self.assertEqual(
+                assets.url('stylesheets/style.css'),
+                f"/assets/{manifest['files']['stylesheets/style.css']}")
+            self.assertEqual(assets.url('/static/images/bg.png'),
+                             f"/assets/{manifest['files']['images/bg.png']}")
+            self.assertEqual(assets.url('images/missing.png'),
+                             "/static/images/missing.png")
+            self.assertEqual(assets.url('/static/images/missing.png'),
+                             "/static/images/missing.png")
+            self.assertEqual(assets.url('https://example.com/a.png'),
+                             'https://example.com/a.png')
+            self.assertEqual(assets.url(''), '')
+
+        assets.load(os.path.join(self.directory.name, "not-built"))
+        with app.test_request_context():
+            self.assertEqual(assets.url('stylesheets/style.css'),
+                             "/static/stylesheets/style.css")
+
+    def test_serving(self):
+        manifest = build(self.static, self.out, variants={})
+        assets.load(self.out)
+        css = manifest['files']['stylesheets/style.css']
+
+        with app.test_client() as client:
+            resp = client.get(f"/assets/{css}",
+                              headers={'Accept-Encoding': 'gzip'})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(resp.mimetype, 'text/css')
+            self.assertEqual(gzip.decompress(resp.get_data()), self.read(css))
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            self.assertIn('max-age=31536000', resp.headers['Cache-Control'])
+            self.assertNotIn('no-store', resp.headers['Cache-Control'])
+            self.assertIn('Accept-Encoding', resp.headers['Vary'])
+
+            resp = client.get(f"/assets/{css}")
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertEqual(resp.get_data(), self.read(css))
+
+            resp = client.get("/assets/nothing.css")
+            self.assertEqual(resp.status_code, 404)
+
+    def test_pages_use_fingerprinted_urls(self):
+        manifest = build(self.static, self.out, variants={})
+        assets.load(self.out)
+
+        with app.test_client() as client:
+            html = client.get("/login").get_data(as_text=True)
+
+        self.assertIn(
+            f"/assets/{manifest['files']['stylesheets/style.css']}", html)
@@ -0,0 +1,129 @@
+"""Bulk loader tests."""
+
+import csv
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, timelines, user_cache
+from bulk_load import load
+
+db.drop_all()
+db.create_all()
+
+CSVS = {
+    'users': [
+        ['id', 'email', 'username', 'password', 'image_url',
+         'header_image_url', 'bio', 'location'],
+        [1, 'u1@email.com', 'u1', 'x', '/u1.jpg', '/h.jpg', 'Hi.', ''],
+        [2, 'u2@email.com', 'u2', 'x', '/u2.jpg', '/h.jpg', '', ''],
+        [3, 'u3@email.com', 'u3', 'x', '/u3.jpg', '/h.jpg', '', ''],
+    ],
+    'messages': [
+        ['id', 'text', 'timestamp', 'user_id'],
+        [1, 'hello, "world"', '2023-01-01 00:00:00', 1],
+        [2, 'second', '2023-01-02 00:00:00', 2],
+    ],
+    'follows': [
+        ['user_being_followed_id', 'user_following_id'],
+        [1, 2],
+        [1, 3],
+        [2, 3],
+    ],
+    'likes': [
+        ['user_id', 'message_id'],
+        [2, 1],
+        [3, 1],
+    ],
+}
+
+
+def index_names():
+    return set(db.session.scalars(db.text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = 'public'")))
+
+
+def constraint_names():
+    return set(db.session.scalars(db.text(
+        "SELECT conname FROM pg_constraint "
+        "WHERE connamespace = 'public'::regnamespace")))
+
+
+class BulkLoadTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+
+        self.directory = tempfile.TemporaryDirectory()
+
+        for name, rows in CSVS.items():
+            path = os.path.join(self.directory.name, f"{name}.csv")
+            with open(path, 'w', newline='') as file:
+                csv.writer(file).writerows(rows)
+
+    def tearDown(self):
+        db.session.rollback()
+        self.directory.cleanup()
+
+        # ids have been reused
+        user_cache.clear()
+        timelines.store.clear()
+
+        Like.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def check_loaded(self, steps):
+        self.assertEqual(
+            {step.name: step.rows for step in steps},
+            {'users': 3, 'messages': 2, 'follows': 3, 'likes': 2,
+             'indexes': None, 'counts': None})
+
+        self.assertEqual(Message.query.get(1).text, 'hello, "world"')
+        self.assertEqual(Follow.query.count(), 3)
+
+        u1 = User.query.get(1)
+        self.assertEqual((u1.bio, u1.location), ("Hi.", ""))
+        self.assertEqual(u1.followers_count, 2)
+        self.assertEqual(u1.likes_received_count, 2)
+        self.assertEqual(Message.query.get(1).likes_count, 2)
+
+        # new rows get ids after the loaded ones
+        user = User(username="new", email="new@email.com", password="x")
+        db.session.add(user)
+        db.session.commit()
+        self.assertEqual(user.id, 4)
+
+    def test_copy(self):
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+        indexes = index_names()
+        constraints = constraint_names()
+
+        self.check_loaded(load(self.directory.name, parallel=True))
+
+        self.assertEqual(index_names(), indexes)
+        self.assertEqual(constraint_names(), constraints)
+
+    def test_chunked_inserts(self):
+        self.check_loaded(
+            load(self.directory.name, chunk_size=2, use_copy=False))
+
+    def test_unknown_column(self):
+        User.query.delete()
+        db.session.add(User(username="kept", email="kept@email.com",
+                            password="x"))
+        db.session.commit()
+
+        with open(os.path.join(self.directory.name, 'likes.csv'), 'w') as file:
+            file.write("user_id,message_id,score\n1,1,5\n")
+
+        with self.assertRaises(ValueError):
+            load(self.directory.name)
+
+        # nothing was dropped
+        self.assertEqual([user.username for user in User.query], ["kept"])
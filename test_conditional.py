@@ -0,0 +1,153 @@
+"""Conditional GET tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from query_budget import count_queries
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.clear()
+
+        u1 = User(username="u1", email="u1@email.com", password="x")
+        u2 = User(username="u2", email="u2@email.com", password="x")
+        u3 = User(username="u3", email="u3@email.com", password="x")
+        db.session.add_all([u1, u2, u3])
+        db.session.flush()
+
+        msg = Message(text="warble", user_id=u2.id)
+        db.session.add_all([
+            msg,
+            Follow(user_being_followed_id=u2.id, user_following_id=u3.id),
+        ])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+        self.msg_id = msg.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+        self.clear()
+
+    def clear(self):
+        # likes don't cascade, so clear them before deleting users
+        Like.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def revalidate(self, url):
+        """GET `url`, then again with its ETag; returns (first response,
+        second response, queries the second ran)."""
+
+        first = self.client.get(url)
+        first.get_data()
+
+        with count_queries() as queries:
+            second = self.client.get(url, headers={
+                'If-None-Match': first.headers['ETag']})
+            second.get_data()
+
+        return first, second, queries
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in [f"/users/{self.u2_id}",
+                    f"/users/{self.u2_id}/followers",
+                    f"/users/{self.u3_id}/following",
+                    f"/messages/{self.msg_id}"]:
+            first, second, queries = self.revalidate(url)
+
+            self.assertEqual(first.status_code, 200)
+            self.assertTrue(first.headers['ETag'].startswith('W/"'))
+            self.assertIn('private', first.headers['Cache-Control'])
+            self.assertIn('no-cache', first.headers['Cache-Control'])
+            self.assertNotIn('no-store', first.headers['Cache-Control'])
+
+            self.assertEqual(second.status_code, 304, url)
+            self.assertEqual(second.get_data(), b"")
+            self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+            self.assertEqual(queries.count, 1, f"{url}: {queries}")
+
+    def test_changes_make_new_etags(self):
+        url = f"/users/{self.u2_id}/followers"
+        first = self.client.get(url)
+        first.get_data()
+        etags = {first.headers['ETag']}
+
+        def changed():
+            resp = self.client.get(url, headers={
+                'If-None-Match': first.headers['ETag']})
+            resp.get_data()
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn(resp.headers['ETag'], etags)
+            etags.add(resp.headers['ETag'])
+
+        # a follower edits their profile
+        db.session.execute(db.update(User)
+                           .where(User.id == self.u3_id)
+                           .values(bio="new bio", version=User.version + 1))
+        db.session.commit()
+        changed()
+
+        # the viewer follows someone (the page shows who they follow);
+        # following the redirect shows the flashed message
+        self.client.post(f"/users/follow/{self.u3_id}", follow_redirects=True)
+        changed()
+
+        # someone new follows u2
+        self.client.post(f"/users/follow/{self.u2_id}", follow_redirects=True)
+        changed()
+
+        # a different viewer
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u3_id
+        changed()
+
+    def test_likes_change_message_etag(self):
+        url = f"/messages/{self.msg_id}"
+        first = self.client.get(url)
+
+        self.client.post(f"/messages/{self.msg_id}/toggle_like?page=")
+
+        second = self.client.get(url, headers={
+            'If-None-Match': first.headers['ETag']})
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second.headers['ETag'], first.headers['ETag'])
+
+    def test_other_pages_are_not_stored(self):
+        resp = self.client.get("/messages/new")
+
+        self.assertNotIn('ETag', resp.headers)
+        self.assertIn('no-store', resp.headers['Cache-Control'])
+
+    def test_flashed_messages_are_not_cached(self):
+        with self.client.session_transaction() as sess:
+            sess['_flashes'] = [('success', "Hello!")]
+
+        resp = self.client.get(f"/users/{self.u2_id}")
+
+        self.assertIn("Hello!", resp.get_data(as_text=True))
+        self.assertNotIn('ETag', resp.headers)
+        self.assertIn('no-store', resp.headers['Cache-Control'])
+
+    def test_missing_pages(self):
+        resp = self.client.get("/messages/0", headers={
+            'If-None-Match': 'W/"anything"'})
+
+        self.assertEqual(resp.status_code, 404)
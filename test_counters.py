@@ -0,0 +1,148 @@
+"""Stored counter tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Like, Follow
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from counters import recount
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class CounterViewsTestCase(TestCase):
+    """Tests that the write routes keep stored counts in step."""
+
+    def setUp(self):
+        Like.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+        # likes don't cascade, so clear them before other tests delete users
+        Like.query.delete()
+        db.session.commit()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def counts(self, user_id):
+        user = db.session.get(User, user_id)
+        db.session.refresh(user)
+
+        return dict(
+            messages=user.messages_count,
+            followers=user.followers_count,
+            following=user.following_count,
+            likes=user.likes_count,
+            likes_received=user.likes_received_count,
+        )
+
+    def test_follow_counts(self):
+        self.login(self.u1_id)
+
+        self.client.post(f"/users/follow/{self.u2_id}")
+        # following twice is a no-op
+        self.client.post(f"/users/follow/{self.u2_id}")
+        self.assertEqual(self.counts(self.u1_id)['following'], 1)
+        self.assertEqual(self.counts(self.u2_id)['followers'], 1)
+
+        self.client.post(f"/users/stop-following/{self.u2_id}")
+        self.client.post(f"/users/stop-following/{self.u2_id}")
+        self.assertEqual(self.counts(self.u1_id)['following'], 0)
+        self.assertEqual(self.counts(self.u2_id)['followers'], 0)
+
+    def test_message_and_like_counts(self):
+        self.login(self.u2_id)
+        self.client.post("/messages/new", data={"text": "hello"})
+        msg = Message.query.filter_by(text="hello").one()
+        self.assertEqual(self.counts(self.u2_id)['messages'], 1)
+
+        self.login(self.u1_id)
+        self.client.post(f"/messages/{msg.id}/toggle_like?page=")
+        self.assertEqual(self.counts(self.u1_id)['likes'], 1)
+        self.assertEqual(self.counts(self.u2_id)['likes_received'], 1)
+        db.session.refresh(msg)
+        self.assertEqual(msg.likes_count, 1)
+
+        # deleting a liked message takes its likes with it
+        self.login(self.u2_id)
+        self.client.post(f"/messages/{msg.id}/delete")
+        self.assertEqual(self.counts(self.u1_id)['likes'], 0)
+        self.assertEqual(
+            self.counts(self.u2_id),
+            dict(messages=0, followers=0, following=0, likes=0,
+                 likes_received=0))
+
+    def test_delete_user_settles_counts(self):
+        self.login(self.u2_id)
+        self.client.post("/messages/new", data={"text": "u2 msg"})
+        self.client.post(f"/users/follow/{self.u1_id}")
+
+        self.login(self.u1_id)
+        self.client.post("/messages/new", data={"text": "u1 msg"})
+        self.client.post(f"/users/follow/{self.u2_id}")
+        u2_msg = Message.query.filter_by(text="u2 msg").one()
+        self.client.post(f"/messages/{u2_msg.id}/toggle_like?page=")
+
+        self.login(self.u2_id)
+        u1_msg = Message.query.filter_by(text="u1 msg").one()
+        self.client.post(f"/messages/{u1_msg.id}/toggle_like?page=")
+
+        self.login(self.u1_id)
+        resp = self.client.post("/users/delete")
+        self.assertEqual(resp.location, "/signup")
+
+        self.assertIsNone(db.session.get(User, self.u1_id))
+        self.assertEqual(
+            self.counts(self.u2_id),
+            dict(messages=1, followers=0, following=0, likes=0,
+                 likes_received=0))
+
+        db.session.refresh(u2_msg)
+        self.assertEqual(u2_msg.likes_count, 0)
+
+    def test_recount(self):
+        m1 = Message(text="m1", user_id=self.u2_id)
+        db.session.add_all([
+            m1,
+            Follow(user_being_followed_id=self.u2_id,
+                   user_following_id=self.u1_id),
+        ])
+        db.session.flush()
+        db.session.add(Like(user_id=self.u1_id, message_id=m1.id))
+        db.session.commit()
+
+        # rows written behind the routes' backs aren't counted...
+        self.assertEqual(self.counts(self.u2_id)['followers'], 0)
+
+        # ... until a recount
+        recount()
+
+        self.assertEqual(
+            self.counts(self.u1_id),
+            dict(messages=0, followers=0, following=1, likes=1,
+                 likes_received=0))
+        self.assertEqual(
+            self.counts(self.u2_id),
+            dict(messages=1, followers=1, following=0, likes=0,
+                 likes_received=1))
+
+        db.session.refresh(m1)
+        self.assertEqual(m1.likes_count, 1)
@@ -0,0 +1,208 @@
+"""Message card cache tests."""
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, assets, message_cards, CURR_USER_KEY
+from assets import build
+from fragments import MemoryFragmentStore, SQLiteFragmentStore
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class FragmentStoreTests:
+    """Tests every store backend must pass; mixed into a TestCase that sets
+    `self.store` (with a max_size of 3)."""
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.store.get("1:a"))
+
+        self.store.set("1:a", 1, 10, ["<a>", "</a>"])
+
+        self.assertEqual(self.store.get("1:a"), ["<a>", "</a>"])
+        self.assertEqual(len(self.store), 1)
+
+    def test_evicts_past_max_size(self):
+        for i in range(1, 5):
+            self.store.set(f"{i}:a", i, 10, [str(i)])
+
+        self.assertEqual(len(self.store), 3)
+        self.assertIsNone(self.store.get("1:a"))
+        self.assertEqual(self.store.get("4:a"), ["4"])
+
+    def test_forget(self):
+        self.store.set("1:a", 1, 10, ["1"])
+        self.store.set("1:b", 1, 10, ["1 again"])
+        self.store.set("2:a", 2, 10, ["2"])
+        self.store.set("3:a", 3, 20, ["3"])
+
+        self.store.forget_message(1)
+        self.assertIsNone(self.store.get("1:a"))
+        self.assertIsNone(self.store.get("1:b"))
+        self.assertEqual(self.store.get("2:a"), ["2"])
+
+        self.store.forget_author(10)
+        self.assertIsNone(self.store.get("2:a"))
+        self.assertEqual(self.store.get("3:a"), ["3"])
+
+        self.store.clear()
+        self.assertEqual(len(self.store), 0)
+
+
+class MemoryFragmentStoreTestCase(FragmentStoreTests, TestCase):
+    def setUp(self):
+        self.store = MemoryFragmentStore(max_size=3)
+
+    def test_evicts_least_recently_used(self):
+        for i in range(1, 4):
+            self.store.set(f"{i}:a", i, 10, [str(i)])
+
+        self.store.get("1:a")
+        self.store.set("4:a", 4, 10, ["4"])
+
+        self.assertEqual(self.store.get("1:a"), ["1"])
+        self.assertIsNone(self.store.get("2:a"))
+
+
+class SQLiteFragmentStoreTestCase(FragmentStoreTests, TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = SQLiteFragmentStore(
+            os.path.join(self.directory.name, "fragments.sqlite"),
+            max_size=3)
+
+    def tearDown(self):
+        self.store._conn.close()
+        self.directory.cleanup()
+
+
+class MessageCardsViewTestCase(TestCase):
+    def setUp(self):
+        self.clear()
+
+        u1 = User(username="u1", email="u1@email.com", password="x")
+        u2 = User(username="u2", email="u2@email.com", password="x")
+        db.session.add_all([u1, u2])
+        db.session.flush()
+
+        msg = Message(text="cached <warble>", user_id=u2.id)
+        db.session.add(msg)
+        db.session.flush()
+        db.session.add(Like(user_id=u1.id, message_id=msg.id))
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.msg_id = msg.id
+
+        message_cards.store.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.clear()
+
+    def clear(self):
+        # likes don't cascade, so clear them before deleting users
+        Like.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def view_as(self, user_id, url):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        return self.client.get(url).get_data(as_text=True)
+
+    def test_cards_are_shared_between_pages_and_viewers(self):
+        before = message_cards.stats()
+
+        u1_html = self.view_as(self.u1_id, f"/users/{self.u2_id}")
+        u2_html = self.view_as(self.u2_id, f"/users/{self.u2_id}")
+        liked_html = self.view_as(self.u1_id,
+                                  f"/users/{self.u1_id}/liked_messages")
+
+        after = message_cards.stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 2)
+        self.assertGreater(after['hit_rate'], 0)
+
+        for html in [u1_html, u2_html, liked_html]:
+            self.assertIn("cached &lt;warble&gt;", html)
+            self.assertIn("@u2", html)
+
+        # the star is the viewer's own (u2 can't like their own message)
+        self.assertIn("bi-star-fill", u1_html)
+        self.assertNotIn("toggle_like", u2_html)
+
+    def test_message_page_card(self):
+        html = self.view_as(self.u1_id, f"/messages/{self.msg_id}")
+
+        self.assertIn('<p class="single-message">cached &lt;warble&gt;</p>',
+                      html)
+        self.assertIn("Follow", html)
+        self.assertIn("bi-star-fill", html)
+
+    def test_profile_edits_show_up(self):
+        self.view_as(self.u1_id, f"/users/{self.u2_id}")
+
+        # even in a worker that wasn't told (the card's key changes)
+        db.session.execute(db.update(User)
+                           .where(User.id == self.u2_id)
+                           .values(username="renamed"))
+        db.session.commit()
+
+        html = self.view_as(self.u1_id, f"/users/{self.u2_id}")
+        self.assertIn("@renamed", html)
+        self.assertEqual(len(message_cards.store), 2)
+
+        message_cards.on_profile_changed(self.u2_id)
+        self.assertEqual(len(message_cards.store), 0)
+
+    def test_deleted_messages_are_forgotten(self):
+        self.view_as(self.u2_id, f"/users/{self.u2_id}")
+        self.assertEqual(len(message_cards.store), 1)
+
+        self.client.post(f"/messages/{self.msg_id}/delete")
+
+        self.assertEqual(len(message_cards.store), 0)
+
+    def test_rebuilt_assets_change_cards(self):
+        db.session.execute(db.update(User)
+                           .where(User.id == self.u2_id)
+                           .values(image_url="/static/images/u2.png"))
+        db.session.commit()
+
+        previous = assets.directory
+        directory = tempfile.TemporaryDirectory()
+        static = os.path.join(directory.name, "static")
+        out = os.path.join(directory.name, "assets")
+        os.makedirs(os.path.join(static, "images"))
+
+        def build_avatar(data):
+            with open(os.path.join(static, "images", "u2.png"), 'wb') as file:
+                file.write(data)
+            return build(static, out, variants={})['files']['images/u2.png']
+
+        try:
+            before = build_avatar(b"old")
+            assets.load(out)
+            self.assertIn(f"/assets/{before}",
+                          self.view_as(self.u1_id, f"/users/{self.u2_id}"))
+
+            after = build_avatar(b"new")
+            assets.load(out)
+            html = self.view_as(self.u1_id, f"/users/{self.u2_id}")
+            self.assertIn(f"/assets/{after}", html)
+            self.assertNotIn(f"/assets/{before}", html)
+        finally:
+            assets.load(previous)
+            directory.cleanup()
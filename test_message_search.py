@@ -0,0 +1,162 @@
+"""Message search tests."""
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from message_search import (
+    MemoryMessageSearch, PostgresMessageSearch, decode_result_cursor)
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class MessageSearchTests:
+    """Behaviour every search backend must share.
+
+    Mixed into a TestCase per backend, which provides `make_search`.
+    """
+
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User(username="u1", email="u1@email.com", password="x")
+        u2 = User(username="u2", email="u2@email.com", password="x")
+        u3 = User(username="u3", email="u3@email.com", password="x")
+        db.session.add_all([u1, u2, u3])
+        db.session.flush()
+
+        db.session.add(
+            Follow(user_being_followed_id=u2.id, user_following_id=u1.id))
+
+        start = datetime(2023, 1, 1)
+        texts = [
+            (u2, "warbler warbler warbler"),
+            (u3, "a warbler sang"),
+            (u2, "no birds here"),
+            (u3, "warbler nest"),
+            (u1, "my own warbler post"),
+        ]
+        messages = [
+            Message(text=text, user_id=user.id,
+                    timestamp=start + timedelta(minutes=i))
+            for i, (user, text) in enumerate(texts)
+        ]
+        db.session.add_all(messages)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.ids = [msg.id for msg in messages]
+        self.search = self.make_search()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def texts(self, page):
+        return [msg.text for msg in page]
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.texts(self.search.search("warbler nest")),
+                         ["warbler nest"])
+        self.assertEqual(self.texts(self.search.search("nest birds")), [])
+
+    def test_most_relevant_first(self):
+        page = self.search.search("warbler")
+
+        self.assertEqual(len(page), 4)
+        self.assertEqual(page.messages[0].text, "warbler warbler warbler")
+        self.assertIsNone(page.after)
+
+    def test_scoped_to_following(self):
+        page = self.search.search("warbler", viewer_id=self.u1_id)
+
+        self.assertEqual(sorted(self.texts(page)),
+                         ["my own warbler post", "warbler warbler warbler"])
+
+    def test_pages_visit_every_match_once(self):
+        seen = []
+        after = None
+
+        while True:
+            page = self.search.search("warbler", after=after, per_page=1)
+            seen.extend(self.texts(page))
+            if page.after is None:
+                break
+            after = decode_result_cursor(page.after)
+
+        self.assertEqual(seen, self.texts(self.search.search("warbler")))
+
+    def test_index_follows_writes(self):
+        self.search.search("warbler")
+
+        msg = Message(text="fresh warbler", user_id=self.u1_id)
+        db.session.add(msg)
+        db.session.commit()
+        self.search.on_message_added(msg)
+
+        self.assertIn("fresh warbler", self.texts(self.search.search("fresh")))
+
+        Message.query.filter_by(id=msg.id).delete()
+        db.session.commit()
+        self.search.on_message_deleted(msg.id)
+
+        self.assertEqual(self.texts(self.search.search("fresh")), [])
+
+
+class PostgresMessageSearchTestCase(MessageSearchTests, TestCase):
+    def make_search(self):
+        return PostgresMessageSearch()
+
+    def test_words_are_stemmed(self):
+        self.assertEqual(self.texts(self.search.search("nesting")),
+                         ["warbler nest"])
+
+
+class MemoryMessageSearchTestCase(MessageSearchTests, TestCase):
+    def make_search(self):
+        return MemoryMessageSearch()
+
+
+class MessageSearchViewTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        User.query.delete()
+
+        u1 = User(username="u1", email="u1@email.com", password="x")
+        db.session.add(u1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_add_search_delete(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            client.post("/messages/new", data={"text": "findable warble"})
+
+            html = client.get("/messages/search?q=findable").get_data(
+                as_text=True)
+            self.assertIn("messages-search-test", html)
+            self.assertIn("findable warble", html)
+
+            msg = Message.query.filter_by(text="findable warble").one()
+            client.post(f"/messages/{msg.id}/delete")
+
+            html = client.get(
+                "/messages/search?q=findable&scope=following").get_data(
+                as_text=True)
+            self.assertIn("no messages found", html)
+
+            resp = client.get("/messages/search?q=findable&after=junk")
+            self.assertEqual(resp.status_code, 400)
@@ -8,7 +8,7 @@
 import os
 from unittest import TestCase
 
-from models import db, Message, User
+from models import db, Message, User, Follow, Like
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -20,6 +20,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
 # Now we can import app
 
 from app import app, CURR_USER_KEY
+from query_budget import count_queries
 
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 
@@ -68,3 +69,114 @@ class MessageAddViewTestCase(MessageBaseViewTestCase):
             self.assertEqual(resp.status_code, 302)
 
             Message.query.filter_by(text="Hello").one()
+
+
+class HomepageQueryCountTestCase(MessageBaseViewTestCase):
+    """The homepage's query count shouldn't grow with the page size."""
+
+    def tearDown(self):
+        db.session.rollback()
+
+        # likes don't cascade, so clear them before other tests delete users
+        Like.query.delete()
+        db.session.commit()
+
+    def add_followed_authors(self, count):
+        """Have u1 follow `count` new users, each with a message u1 liked."""
+
+        for i in range(User.query.count(), User.query.count() + count):
+            author = User(username=f"a{i}", email=f"a{i}@email.com",
+                          password="password")
+            db.session.add(author)
+            db.session.flush()
+
+            msg = Message(text=f"a{i}-text", user_id=author.id)
+            db.session.add_all([
+                msg,
+                Follow(user_being_followed_id=author.id,
+                       user_following_id=self.u1_id),
+            ])
+            db.session.flush()
+            db.session.add(Like(user_id=self.u1_id, message_id=msg.id))
+
+        db.session.commit()
+
+    def homepage_queries(self):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            # the first visit builds u1's home timeline; count the next one
+            c.get("/")
+
+            with count_queries() as queries:
+                resp = c.get("/")
+            self.assertEqual(resp.status_code, 200)
+
+            return queries.count
+
+    def test_query_count_is_constant(self):
+        self.add_followed_authors(2)
+        small = self.homepage_queries()
+
+        self.add_followed_authors(20)
+        large = self.homepage_queries()
+
+        self.assertEqual(small, large)
+
+
+class MessageShowViewTestCase(MessageBaseViewTestCase):
+    def setUp(self):
+        super().setUp()
+
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m2 = Message(text="m2-text", user_id=u2.id)
+        db.session.add(m2)
+        db.session.flush()
+
+        db.session.add_all([
+            Like(user_id=self.u1_id, message_id=m2.id),
+            Follow(user_being_followed_id=u2.id,
+                   user_following_id=self.u1_id),
+        ])
+        db.session.commit()
+
+        self.m2_id = m2.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+        # likes don't cascade, so clear them before other tests delete users
+        Like.query.delete()
+        db.session.commit()
+
+    def test_show_message(self):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            with count_queries() as queries:
+                html = c.get(f"/messages/{self.m2_id}").get_data(as_text=True)
+
+            self.assertIn("m2-text", html)
+            self.assertIn("Unfollow", html)
+            self.assertIn("bi-star-fill", html)
+
+            # only this message's like and author's follow are looked up,
+            # not everything the viewer has written, liked or followed
+            for statement in queries.statements:
+                statement = ' '.join(statement.split())
+                self.assertNotIn("FROM messages, likes", statement)
+                self.assertNotIn(
+                    "FROM messages WHERE %(param_1)s = messages.user_id",
+                    statement)
+                if "FROM follows" in statement:
+                    self.assertIn("follows.user_being_followed_id IN",
+                                  statement)
+
+            html = c.get(f"/messages/{self.m1_id}").get_data(as_text=True)
+
+            self.assertIn("Delete", html)
+            self.assertNotIn("toggle_star_form", html)
@@ -0,0 +1,117 @@
+"""Request metrics tests."""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from metrics import Metrics
+
+db.drop_all()
+db.create_all()
+
+
+class MetricsTestCase(TestCase):
+    def test_histograms_are_cumulative(self):
+        metrics = Metrics()
+
+        for value in [0.001, 0.02, 0.02, 30]:
+            metrics.observe('warbler_request_duration_seconds',
+                            dict(endpoint="homepage", method="GET"), value)
+
+        text = metrics.render()
+        labels = 'endpoint="homepage",method="GET"'
+
+        self.assertIn(f'warbler_request_duration_seconds_bucket'
+                      f'{{{labels},le="0.005"}} 1', text)
+        self.assertIn(f'warbler_request_duration_seconds_bucket'
+                      f'{{{labels},le="0.025"}} 3', text)
+        self.assertIn(f'warbler_request_duration_seconds_bucket'
+                      f'{{{labels},le="10"}} 3', text)
+        self.assertIn(f'warbler_request_duration_seconds_bucket'
+                      f'{{{labels},le="+Inf"}} 4', text)
+        self.assertIn(f'warbler_request_duration_seconds_count{{{labels}}} 4',
+                      text)
+        self.assertIn("# TYPE warbler_request_duration_seconds histogram",
+                      text)
+
+    def test_labels_are_escaped(self):
+        metrics = Metrics()
+        metrics.inc('warbler_requests_total', dict(endpoint='a"b\\c'))
+
+        self.assertIn('warbler_requests_total{endpoint="a\\"b\\\\c"} 1',
+                      metrics.render())
+
+    def test_workers_are_added_up(self):
+        with tempfile.TemporaryDirectory() as directory:
+            metrics = Metrics(directory)
+            metrics.inc('warbler_requests_total', dict(endpoint="homepage"), 2)
+            metrics.in_flight = 1
+
+            # a worker that has since exited
+            worker = subprocess.Popen([sys.executable, "-c", "pass"])
+            worker.wait()
+            with open(os.path.join(directory, f"{worker.pid}.json"),
+                      'w') as file:
+                json.dump(dict(
+                    pid=worker.pid,
+                    counters=[['warbler_requests_total',
+                               [['endpoint', 'homepage']], 3]],
+                    histograms=[],
+                    gauges=[['warbler_requests_in_flight', [], 5]],
+                ), file)
+
+            text = metrics.render()
+
+        self.assertIn('warbler_requests_total{endpoint="homepage"} 5', text)
+        self.assertIn('warbler_requests_in_flight 1', text)
+
+
+class MetricsViewTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User(username="u1", email="u1@email.com", password="x")
+        db.session.add(u1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_metrics_endpoint(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            client.get(f"/users/{self.u1_id}")
+            client.get("/users").get_data()
+            client.get("/no/such/page")
+
+            resp = client.get("/metrics")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "text/plain")
+
+        text = resp.get_data(as_text=True)
+        self.assertIn('warbler_requests_total{endpoint="show_user",'
+                      'method="GET",status="200"}', text)
+        self.assertIn('warbler_requests_total{endpoint="unmatched",'
+                      'method="GET",status="404"}', text)
+        self.assertIn('warbler_request_db_seconds_count{endpoint="show_user"',
+                      text)
+        self.assertIn('warbler_response_size_bytes_count{endpoint="show_user"',
+                      text)
+        self.assertIn('warbler_template_render_seconds_count'
+                      '{template="users/index.html"}', text)
+        self.assertIn('warbler_requests_in_flight 1', text)
+        self.assertIn('warbler_user_cache_hits_total', text)
+        self.assertIn('warbler_password_pool_in_use 0', text)
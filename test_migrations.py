@@ -0,0 +1,126 @@
+"""Schema migration tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app
+import migrations
+from migrations import MIGRATIONS, applied, migrate, pending
+
+db.drop_all()
+db.create_all()
+
+
+def index_names():
+    return set(db.session.scalars(db.text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = 'public'")))
+
+
+def column_names(table):
+    return {column['name']
+            for column in db.inspect(db.session.connection()).get_columns(
+                table)}
+
+
+class MigrationsTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        self.clear()
+
+        u1 = User(username="u1", email="u1@email.com", password="x")
+        u2 = User(username="u2", email="u2@email.com", password="x")
+        db.session.add_all([u1, u2])
+        db.session.flush()
+
+        msg = Message(text="warble", user_id=u1.id)
+        db.session.add_all([
+            msg,
+            Follow(user_being_followed_id=u1.id, user_following_id=u2.id),
+        ])
+        db.session.flush()
+        db.session.add(Like(user_id=u2.id, message_id=msg.id))
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.msg_id = msg.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+        # whatever a test took away, put it back
+        migrate()
+        self.clear()
+
+    def clear(self):
+        # likes don't cascade, so clear them before deleting users
+        Like.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_new_database_needs_nothing(self):
+        self.assertEqual(applied(),
+                         {migration.__name__ for migration in MIGRATIONS})
+        self.assertEqual(pending(), [])
+        self.assertEqual(migrate(), [])
+
+    def test_upgrades_old_database(self):
+        indexes = index_names()
+
+        # a database from before counters, versions and the hot query indexes
+        for statement in [
+            "DROP INDEX ix_messages_user_id_timestamp",
+            "DROP INDEX ix_likes_user_id",
+            "DROP INDEX ix_follows_following",
+            "ALTER TABLE users DROP COLUMN version, "
+            "DROP COLUMN followers_count, DROP COLUMN likes_received_count",
+            "ALTER TABLE messages DROP COLUMN version, "
+            "DROP COLUMN likes_count",
+            "DELETE FROM schema_migrations WHERE name <> 'add_search_indexes'",
+        ]:
+            db.session.execute(db.text(statement))
+        db.session.commit()
+
+        upgrades = ['add_counters', 'add_versions', 'add_hot_query_indexes',
+                    'add_follows_index']
+        self.assertEqual(
+            [migration.__name__ for migration in pending()], upgrades)
+
+        self.assertEqual(migrate(), upgrades)
+
+        self.assertEqual(index_names(), indexes)
+        self.assertIn('ix_follows_following', indexes)
+        self.assertLessEqual({'version', 'followers_count'},
+                             column_names('users'))
+        self.assertLessEqual({'version', 'likes_count'},
+                             column_names('messages'))
+        self.assertEqual(pending(), [])
+
+        # the new counters were counted
+        u1 = db.session.get(User, self.u1_id)
+        self.assertEqual((u1.followers_count, u1.likes_received_count), (1, 1))
+        self.assertEqual(db.session.get(Message, self.msg_id).likes_count, 1)
+
+    def test_adds_follows_index(self):
+        # a database migrated before the follows index was
+        db.session.execute(db.text("DROP INDEX ix_follows_following"))
+        db.session.execute(db.delete(migrations.schema_migrations).where(
+            migrations.schema_migrations.c.name == 'add_follows_index'))
+        db.session.commit()
+
+        self.assertEqual(migrate(), ['add_follows_index'])
+        self.assertIn('ix_follows_following', index_names())
+
+    def test_migrations_check_first(self):
+        db.session.execute(db.delete(migrations.schema_migrations))
+        db.session.commit()
+
+        # everything's there already, so these change nothing: the counts
+        # aren't rebuilt (adding the follow directly never counted it)
+        self.assertEqual(
+            migrate(), [migration.__name__ for migration in MIGRATIONS])
+        self.assertEqual(
+            db.session.get(User, self.u1_id).followers_count, 0)
@@ -0,0 +1,126 @@
+"""Keyset pagination tests."""
+
+import os
+import re
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Like, Follow
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from pagination import (
+    MESSAGES_PER_PAGE, encode_cursor, decode_cursor, paginate_messages)
+from timelines import HomeTimelines, MemoryTimelineStore
+from werkzeug.exceptions import BadRequest
+
+db.drop_all()
+db.create_all()
+
+NUM_MESSAGES = MESSAGES_PER_PAGE + 5
+
+
+class PaginationTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        # every other message shares its timestamp with the next one, so
+        # ties have to be broken by id
+        start = datetime(2023, 1, 1)
+        messages = [
+            Message(text=f"msg-{i}",
+                    user_id=u2.id,
+                    timestamp=start + timedelta(minutes=i // 2))
+            for i in range(NUM_MESSAGES)
+        ]
+        db.session.add_all(messages)
+        db.session.flush()
+
+        db.session.add_all(Like(user_id=u1.id, message_id=msg.id)
+                           for msg in messages)
+        db.session.add(
+            Follow(user_being_followed_id=u2.id, user_following_id=u1.id))
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.message_ids = [msg.id for msg in messages]
+
+    def tearDown(self):
+        db.session.rollback()
+
+        # likes don't cascade, so clear them before other tests delete users
+        Like.query.delete()
+        db.session.commit()
+
+    def test_cursor_round_trip(self):
+        msg = Message.query.get(self.message_ids[0])
+
+        self.assertEqual(decode_cursor(encode_cursor(msg)),
+                         (msg.timestamp, msg.id))
+
+        with self.assertRaises(BadRequest):
+            decode_cursor("not-a-cursor")
+
+    def test_paging_visits_every_message_once(self):
+        query = Message.query.filter_by(user_id=self.u2_id)
+        seen = []
+
+        page = paginate_messages(query, per_page=7)
+        self.assertIsNone(page.newer)
+        seen.extend(msg.id for msg in page)
+
+        while page.older:
+            page = paginate_messages(
+                query, before=decode_cursor(page.older), per_page=7)
+            seen.extend(msg.id for msg in page)
+
+        self.assertEqual(seen, self.message_ids[::-1])
+
+        # and back again
+        page = paginate_messages(
+            query, after=decode_cursor(page.newer), per_page=7)
+        self.assertEqual([msg.id for msg in page],
+                         self.message_ids[7:14][::-1])
+
+    def test_timeline_paging_falls_back_past_store(self):
+        timelines = HomeTimelines(MemoryTimelineStore(max_length=10))
+        seen = []
+        before = None
+
+        while True:
+            ids = timelines.message_ids(self.u1_id, limit=4, before=before)
+            seen.extend(ids)
+            if len(ids) < 4:
+                break
+            msg = Message.query.get(ids[-1])
+            before = (msg.timestamp, msg.id)
+
+        self.assertEqual(seen, self.message_ids[::-1])
+
+    def test_views_page(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            for url in ["/",
+                        f"/users/{self.u2_id}",
+                        f"/users/{self.u1_id}/liked_messages"]:
+                html = client.get(url).get_data(as_text=True)
+                self.assertIn(f"msg-{NUM_MESSAGES - 1}<", html)
+                self.assertNotIn("msg-0<", html)
+
+                older = re.search(r'\?before=([\w-]+)', html).group(1)
+                html = client.get(f"{url}?before={older}").get_data(
+                    as_text=True)
+                self.assertIn("msg-0<", html)
+                self.assertNotIn(f"msg-{NUM_MESSAGES - 1}<", html)
+                self.assertIn("?after=", html)
+
+            resp = client.get(f"/users/{self.u2_id}?before=garbage")
+            self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,97 @@
+"""Password pool tests."""
+
+import os
+import threading
+from unittest import TestCase
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app
+from passwords import PasswordPool, PasswordPoolBusy, passwords
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class PasswordPoolTestCase(TestCase):
+    def test_hash_and_check(self):
+        pool = PasswordPool(workers=2, rounds=4)
+        pw_hash = pool.hash("password")
+
+        self.assertTrue(pw_hash.startswith("$2b$04$"))
+        self.assertTrue(pool.check(pw_hash, "password"))
+        self.assertFalse(pool.check(pw_hash, "wrong"))
+        self.assertFalse(pool.needs_rehash(pw_hash))
+
+        pool.configure(rounds=5)
+        self.assertTrue(pool.needs_rehash(pw_hash))
+
+        pool.shutdown()
+
+    def test_full_pool_pushes_back(self):
+        pool = PasswordPool(workers=1, max_waiting=0, wait=0)
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_hash():
+            started.set()
+            release.wait()
+
+        busy = threading.Thread(target=pool._run, args=(slow_hash,))
+        busy.start()
+        started.wait()
+
+        with self.assertRaises(PasswordPoolBusy):
+            pool.check("$2b$04$" + "x" * 53, "password")
+
+        release.set()
+        busy.join()
+
+        self.assertEqual(pool.rejected, 1)
+        self.assertEqual(pool.in_use, 0)
+
+        pool.shutdown()
+
+    def test_reconfigure_while_running(self):
+        pool = PasswordPool(workers=1, max_waiting=0, wait=0)
+
+        # the call finishes on the old pool, and gives its place back there
+        pool._run(pool.configure, 1, 0, 0, 4)
+
+        self.assertEqual(pool.in_use, 0)
+        self.assertTrue(pool._slots.acquire(blocking=False))
+        pool._slots.release()
+        self.assertTrue(pool.check(pool.hash("password"), "password"))
+
+        pool.shutdown()
+
+
+class RehashOnLoginTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        passwords.configure(rounds=4)
+        User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        passwords.init_app(app)
+
+    def test_login_upgrades_work_factor(self):
+        passwords.configure(rounds=5)
+
+        with app.test_client() as client:
+            resp = client.post(
+                "/login", data={"username": "u1", "password": "password"})
+            self.assertEqual(resp.status_code, 302)
+
+        db.session.expunge_all()
+        user = User.query.filter_by(username="u1").one()
+
+        self.assertTrue(user.password.startswith("$2b$05$"))
+        self.assertTrue(User.authenticate("u1", "password"))
@@ -0,0 +1,158 @@
+"""Query-budget tests: the core views run a fixed number of queries."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like, TOGGLE_LIKE_SQL
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from query_budget import QueryBudgetMixin, count_queries, statement_kind
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+SMALL = 2
+LARGE = 30
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    """Each view's query count stays within budget and doesn't change
+    between SMALL and LARGE numbers of followers, messages and likes."""
+
+    QUERY_BUDGETS = {
+        'homepage': 3,
+        'show_user': 4,
+        'show_following': 4,
+        'show_followers': 4,
+        'list_users': 2,
+        'get_liked_messages': 3,
+        'show_message': 5,
+        'search_messages': 2,
+        'toggle_like': 5,
+        'add_message': 5,
+        'start_following': 7,
+        'stop_following': 5,
+    }
+
+    def setUp(self):
+        self.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.clear()
+
+    def clear(self):
+        # likes don't cascade, so clear them before deleting users
+        Like.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def make_data(self, size):
+        """u1 follows u2 and `size` fans of u2; u2 and each fan have
+        written messages (`size` of them by u2), all liked by u1.
+
+        Returns a dict of the ids the requests need.
+        """
+
+        self.clear()
+
+        u1 = User(username="u1", email="u1@email.com", password="x")
+        u2 = User(username="u2", email="u2@email.com", password="x")
+        loner = User(username="loner", email="loner@email.com", password="x")
+        fans = [User(username=f"fan{i}", email=f"fan{i}@email.com",
+                     password="x")
+                for i in range(size)]
+        db.session.add_all([u1, u2, loner, *fans])
+        db.session.flush()
+
+        messages = [Message(text=f"warble {i}", user_id=u2.id)
+                    for i in range(size)]
+        messages += [Message(text="fan warble", user_id=fan.id)
+                     for fan in fans]
+        db.session.add_all(messages)
+        db.session.add(Follow(user_being_followed_id=u2.id,
+                              user_following_id=u1.id))
+        for fan in fans:
+            db.session.add_all([
+                Follow(user_being_followed_id=u2.id,
+                       user_following_id=fan.id),
+                Follow(user_being_followed_id=fan.id,
+                       user_following_id=u1.id),
+            ])
+        db.session.flush()
+
+        db.session.add_all(Like(user_id=u1.id, message_id=msg.id)
+                           for msg in messages)
+        db.session.commit()
+
+        return dict(u1=u1.id, u2=u2.id, loner=loner.id,
+                    message=messages[0].id)
+
+    def requests(self, ids):
+        """(method, url, form data) of a request to each core view."""
+
+        return [
+            ("GET", "/", None),
+            ("GET", f"/users/{ids['u2']}", None),
+            ("GET", f"/users/{ids['u1']}/following", None),
+            ("GET", f"/users/{ids['u2']}/followers", None),
+            ("GET", "/users", None),
+            ("GET", f"/users/{ids['u1']}/liked_messages", None),
+            ("GET", f"/messages/{ids['message']}", None),
+            ("GET", "/messages/search?q=warble", None),
+            ("POST", f"/messages/{ids['message']}/toggle_like?page=", None),
+            ("POST", "/messages/new", {"text": "new warble"}),
+            ("POST", f"/users/follow/{ids['loner']}", None),
+            ("POST", f"/users/stop-following/{ids['u2']}", None),
+        ]
+
+    def query_counts(self, size):
+        """Number of queries each of `requests` ran, with `size` rows."""
+
+        ids = self.make_data(size)
+        counts = []
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = ids['u1']
+
+            # fill the per-worker caches (the user, home timeline) first
+            for method, url, data in self.requests(ids):
+                if method == "GET":
+                    client.get(url).get_data()
+
+            for method, url, data in self.requests(ids):
+                resp, queries = self.request_within_budget(
+                    client, method, url, data)
+                self.assertLess(resp.status_code, 400, url)
+                counts.append(queries.count)
+
+        return counts
+
+    def test_core_views_stay_within_budget(self):
+        small = self.query_counts(SMALL)
+        large = self.query_counts(LARGE)
+
+        self.assertEqual(small, large)
+
+
+class CountQueriesTestCase(TestCase):
+    def test_counts_and_kinds(self):
+        with count_queries() as queries:
+            db.session.execute(db.select(User.id)).all()
+            db.session.execute(db.update(User).values(bio="x"))
+            db.session.rollback()
+
+        self.assertEqual(queries.count, 2)
+        self.assertEqual(queries.kinds(), {'select': 1, 'update': 1})
+        self.assertIn("2 queries (1 select, 1 update)", str(queries))
+
+        self.assertEqual(statement_kind("  INSERT INTO x"), 'insert')
+        self.assertEqual(statement_kind("SET x = 1"), 'other')
+        self.assertEqual(
+            statement_kind("WITH a AS (SELECT 1) SELECT * FROM a"), 'select')
+        self.assertEqual(statement_kind(str(TOGGLE_LIKE_SQL)), 'delete')
@@ -0,0 +1,204 @@
+"""Query plan tests: the hot routes' queries must be served by indexes.
+
+Loads the generated dataset in generator/ (as seed.py does) plus some
+likes, then requests each hot route, capturing the statements it runs, and
+EXPLAINs each one. With sequential scans turned off, PostgreSQL only plans
+one when no index can serve the query, so a sequential scan in a plan means
+an index is missing (or a query can't use the one there is). So does an
+index scan without a condition on the index's first column, which reads the
+whole index instead.
+"""
+
+import os
+import re
+from unittest import TestCase
+
+from models import db, User, Message, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, timelines, user_cache, message_cards, CURR_USER_KEY
+from bulk_load import load, CSV_DIRECTORY
+from query_budget import count_queries, statement_kind
+import counters
+import migrations
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+# a like for every message whose id matches the user's, mod this
+LIKE_EVERY = 30
+
+LIKES_SQL = db.text("""
+    INSERT INTO likes (user_id, message_id)
+    SELECT users.id, messages.id
+    FROM users JOIN messages
+        ON messages.id % :n = users.id % :n AND messages.user_id <> users.id
+""")
+
+
+INDEX_SCANS = {'Index Scan', 'Index Only Scan', 'Bitmap Index Scan'}
+
+LEADING_COLUMN_SQL = db.text(
+    "SELECT pg_get_indexdef(CAST(:index AS regclass), 1, true)")
+
+
+def explain(statement, parameters):
+    """PostgreSQL's plan for `statement` (its top node, as a dict), without
+    sequential scans unless there's no other way."""
+
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql("SET enable_seqscan = off")
+        plan = connection.exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+        connection.rollback()
+
+    return plan[0]['Plan']
+
+
+def leading_column(index):
+    """The first column (or expression) of `index`."""
+
+    return db.session.scalar(LEADING_COLUMN_SQL, dict(index=index))
+
+
+def full_scans(node):
+    """Descriptions of the nodes in plan `node` that read a whole table or
+    index."""
+
+    kind = node['Node Type']
+
+    if kind == 'Seq Scan':
+        yield f"Seq Scan on {node['Relation Name']}"
+    elif kind in INDEX_SCANS:
+        column = leading_column(node['Index Name'])
+
+        if not re.search(rf"\b{re.escape(column)}\b",
+                         node.get('Index Cond', '')):
+            yield f"{kind} on {node['Index Name']} without {column}"
+
+    for child in node.get('Plans', []):
+        yield from full_scans(child)
+
+
+class QueryPlansTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        load(CSV_DIRECTORY)
+
+        db.session.execute(LIKES_SQL, dict(n=LIKE_EVERY))
+        db.session.commit()
+        counters.recount()
+
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT')
+            connection.exec_driver_sql("ANALYZE")
+
+        # ids have been reused
+        user_cache.clear()
+        timelines.store.clear()
+        message_cards.store.clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        db.session.rollback()
+        user_cache.clear()
+        timelines.store.clear()
+        message_cards.store.clear()
+
+        Like.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def setUp(self):
+        # someone who follows people, is followed and has liked things
+        self.user_id = db.session.scalar(
+            db.select(User.id)
+            .where(User.following_count > 0,
+                   User.followers_count > 0,
+                   User.likes_count > 0)
+            .order_by(User.following_count.desc())
+            .limit(1))
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def tearDown(self):
+        db.session.rollback()
+        timelines.fanout_threshold = app.config.get(
+            'TIMELINE_FANOUT_THRESHOLD')
+
+    def check_plans(self, method, url):
+        """Request `url`, and fail if any of the statements it ran would
+        scan a whole table; returns the statements checked."""
+
+        with count_queries() as queries:
+            resp = self.client.open(url, method=method)
+            resp.get_data()
+
+        self.assertLess(resp.status_code, 400, url)
+
+        explained = []
+        for statement, parameters in zip(queries.statements,
+                                         queries.parameters):
+            if (statement_kind(statement) == 'other'
+                    or isinstance(parameters, list)):
+                continue
+
+            plan = explain(statement, parameters)
+            explained.append(statement)
+
+            self.assertEqual(
+                list(full_scans(plan)), [],
+                f"{method} {url}: {' '.join(statement.split())}")
+
+        self.assertNotEqual(explained, [])
+
+        return explained
+
+    def test_homepage(self):
+        # once building the timeline, then once reading it
+        timelines.store.clear()
+        self.check_plans("GET", "/")
+        self.check_plans("GET", "/")
+
+    def test_homepage_pulling_popular_authors(self):
+        timelines.store.clear()
+        timelines.fanout_threshold = 0
+        self.check_plans("GET", "/")
+
+    def test_profile(self):
+        author_id = db.session.scalar(
+            db.select(Message.user_id)
+            .group_by(Message.user_id)
+            .order_by(db.func.count().desc())
+            .limit(1))
+
+        self.check_plans("GET", f"/users/{author_id}")
+
+    def test_followers(self):
+        self.check_plans("GET", f"/users/{self.user_id}/followers")
+        self.check_plans("GET", f"/users/{self.user_id}/following")
+
+    def test_liked_messages(self):
+        self.check_plans("GET", f"/users/{self.user_id}/liked_messages")
+
+    def test_toggle_like(self):
+        message_id = db.session.scalar(
+            db.select(Message.id)
+            .where(Message.user_id != self.user_id)
+            .order_by(Message.id)
+            .limit(1))
+        url = f"/messages/{message_id}/toggle_like?page="
+
+        # like, then unlike: either way, one statement on likes (a WITH)
+        for _ in range(2):
+            explained = self.check_plans("POST", url)
+            self.assertIn('delete', [statement_kind(statement)
+                                     for statement in explained])
+
+    def test_seeded_database_is_migrated(self):
+        self.assertEqual(migrations.pending(), [])
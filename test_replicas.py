@@ -0,0 +1,217 @@
+"""Read replica routing tests.
+
+The replica is a SQLite file holding the same users as the primary, but a
+different message text, so each page shows which database it was read
+from.
+"""
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from models import db, User, Message, Follow, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import (
+    app, replicas, timelines, user_cache, message_cards, CURR_USER_KEY)
+from replicas import ReplicaRouter, STICKY_KEY, replica_binds
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class ReplicaRoutingTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.replica = create_engine(
+            f"sqlite:///{os.path.join(cls.directory.name, 'replica.db')}")
+        db.metadata.create_all(cls.replica)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.replica.dispose()
+        cls.directory.cleanup()
+
+    def setUp(self):
+        db.session.rollback()
+        self.clear()
+
+        u1 = User(username="u1", email="u1@email.com", password="x")
+        u2 = User(username="u2", email="u2@email.com", password="x")
+        db.session.add_all([u1, u2])
+        db.session.flush()
+
+        msg = Message(text="from the primary", user_id=u2.id)
+        db.session.add_all([
+            msg,
+            Follow(user_being_followed_id=u2.id, user_following_id=u1.id),
+        ])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.msg_id = msg.id
+
+        # the same rows on the replica, but for the message's text
+        with self.replica.begin() as connection:
+            for model in [User, Message, Follow]:
+                rows = [dict(row._mapping) for row in db.session.execute(
+                    db.select(model.__table__))]
+                if model is Message:
+                    rows[0]['text'] = "from the replica"
+                connection.execute(db.insert(model.__table__), rows)
+        db.session.commit()
+
+        self.now = 1000.0
+        self.previous = (replicas.engines, replicas.clock)
+        replicas.engines = [self.replica]
+        replicas.clock = lambda: self.now
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        replicas.engines, replicas.clock = self.previous
+        db.session.rollback()
+        self.clear()
+
+    def clear(self):
+        with self.replica.begin() as connection:
+            for model in [Like, Follow, Message, User]:
+                connection.execute(db.delete(model.__table__))
+
+        # likes don't cascade, so clear them before deleting users
+        Like.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        # ids are reused
+        user_cache.clear()
+        timelines.store.clear()
+        message_cards.store.clear()
+
+    def read(self, url):
+        resp = self.client.get(url)
+        html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200, url)
+
+        if "from the replica" in html:
+            return "replica"
+        if "from the primary" in html:
+            return "primary"
+        return html
+
+    def test_read_only_views_read_from_replica(self):
+        self.assertEqual(self.read("/"), "replica")
+        self.assertEqual(self.read(f"/users/{self.u2_id}"), "replica")
+        self.assertEqual(self.read(f"/messages/{self.msg_id}"), "replica")
+
+        # no messages on these, but they come from the replica all the same
+        for url in ["/users", f"/users/{self.u2_id}/followers",
+                    f"/users/{self.u1_id}/following"]:
+            with self.replica.begin() as connection:
+                connection.execute(db.update(User.__table__)
+                                   .where(User.id == self.u2_id)
+                                   .values(username="replicated"))
+
+            self.assertIn("replicated", self.client.get(url).get_data(
+                as_text=True), url)
+
+    def test_other_views_read_from_primary(self):
+        self.client.post(f"/messages/{self.msg_id}/toggle_like?page=")
+        self.assertEqual(self.read(f"/users/{self.u1_id}/liked_messages"),
+                         "primary")
+
+        # the like went to the primary only
+        with self.replica.connect() as connection:
+            self.assertEqual(connection.scalar(
+                db.select(db.func.count()).select_from(Like.__table__)), 0)
+        self.assertEqual(Like.query.count(), 1)
+
+    def test_reads_your_writes(self):
+        self.assertEqual(self.read(f"/users/{self.u2_id}"), "replica")
+
+        self.client.post(f"/users/stop-following/{self.u2_id}")
+
+        with self.client.session_transaction() as sess:
+            self.assertEqual(sess[STICKY_KEY],
+                             self.now + replicas.sticky_seconds)
+
+        self.now += replicas.sticky_seconds - 1
+        self.assertEqual(self.read(f"/users/{self.u2_id}"), "primary")
+
+        self.now += 1
+        self.assertEqual(self.read(f"/users/{self.u2_id}"), "replica")
+
+    def test_reads_dont_stick(self):
+        self.read(f"/users/{self.u2_id}")
+        self.read(f"/users/{self.u1_id}/liked_messages")
+
+        with self.client.session_transaction() as sess:
+            self.assertNotIn(STICKY_KEY, sess)
+
+    def test_timelines_are_built_from_primary(self):
+        self.assertEqual(self.read("/"), "replica")
+
+        # the replica hasn't caught up on a new message yet
+        newer = Message(text="newer", user_id=self.u2_id)
+        db.session.add(newer)
+        db.session.commit()
+        timelines.store.clear()
+
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertNotIn("newer", html)
+        self.assertIn(f"/messages/{self.msg_id}", html)
+
+        # it shows up once it's replicated: the timeline has its id
+        with self.replica.begin() as connection:
+            connection.execute(db.insert(Message.__table__).values(
+                id=newer.id, text="newer", user_id=self.u2_id,
+                timestamp=newer.timestamp))
+
+        self.assertIn("newer", self.client.get("/").get_data(as_text=True))
+
+    def test_user_cache_is_filled_from_primary(self):
+        # the replica hasn't caught up on u1's profile edit yet
+        db.session.execute(db.update(User)
+                           .where(User.id == self.u1_id)
+                           .values(username="edited"))
+        db.session.commit()
+        user_cache.invalidate(self.u1_id)
+
+        self.assertEqual(self.read(f"/users/{self.u2_id}"), "replica")
+
+        # what's cached is what other requests (on the primary) will see
+        snapshot, _ = user_cache._lookup(self.u1_id)
+        self.assertEqual(snapshot['username'], "edited")
+
+    def test_without_replicas(self):
+        replicas.engines = []
+
+        self.assertEqual(self.read(f"/users/{self.u2_id}"), "primary")
+
+
+class ReplicaConfigTestCase(TestCase):
+    def test_replica_binds(self):
+        self.assertEqual(replica_binds(""), {})
+        self.assertEqual(
+            replica_binds("postgresql:///a, postgresql:///b"),
+            {'replica1': "postgresql:///a", 'replica2': "postgresql:///b"})
+
+    def test_picks_a_replica(self):
+        router = ReplicaRouter(engines=["a", "b"],
+                               choose=lambda engines: engines[-1])
+
+        with app.test_request_context("/"):
+            router._start()
+            router.read_only(lambda: None)()
+
+            self.assertEqual(router.current(), "b")
+            router._finish(None)
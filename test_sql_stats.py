@@ -0,0 +1,78 @@
+"""SQL instrumentation tests."""
+
+import json
+import os
+from unittest import TestCase
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, sql_stats, CURR_USER_KEY
+from sql_stats import QueryStats
+
+db.drop_all()
+db.create_all()
+
+
+class QueryStatsTestCase(TestCase):
+    def test_totals_slowest_and_duplicates(self):
+        stats = QueryStats(slowest=2, duplicates=3)
+
+        for i in range(4):
+            stats.record("SELECT * FROM messages WHERE id = %(id)s", 0.001)
+        stats.record("SELECT * FROM users", 0.005)
+        stats.record("SELECT * FROM likes", 0.003)
+
+        self.assertEqual(stats.count, 6)
+        self.assertAlmostEqual(stats.seconds, 0.012)
+        self.assertEqual(stats.slowest(), [
+            (0.005, "SELECT * FROM users"),
+            (0.003, "SELECT * FROM likes"),
+        ])
+        self.assertEqual(stats.duplicates(), [
+            (4, "SELECT * FROM messages WHERE id = %(id)s"),
+        ])
+        self.assertEqual(stats.server_timing(), 'db;dur=12.0;desc="6 queries"')
+
+
+class SQLStatsViewTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User(username="u1", email="u1@email.com", password="x")
+        db.session.add(u1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+        sql_stats.sample_rate = app.config['SQL_STATS_SAMPLE_RATE']
+
+    def test_sampled_request(self):
+        sql_stats.sample_rate = 1
+
+        with self.assertLogs('warbler.sql', level='INFO') as logs:
+            resp = self.client.get(f"/users/{self.u1_id}")
+
+        self.assertIn('desc="', resp.headers['Server-Timing'])
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['path'], f"/users/{self.u1_id}")
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertIn(f'{record["queries"]} queries',
+                      resp.headers['Server-Timing'])
+        self.assertLessEqual(len(record['slowest']), 3)
+
+    def test_unsampled_request(self):
+        sql_stats.sample_rate = 0
+
+        resp = self.client.get(f"/users/{self.u1_id}")
+
+        self.assertNotIn('Server-Timing', resp.headers)
+        self.assertIsNone(sql_stats.current())
@@ -0,0 +1,251 @@
+"""Home timeline tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, timelines, CURR_USER_KEY
+from counters import recount
+from migrations import database_id
+from timelines import (
+    HomeTimelines, MemoryTimelineStore, SQLiteTimelineStore, home_key)
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class TimelineStoreTests:
+    """Behaviour every timeline store must share.
+
+    Mixed into a TestCase per backend, which provides `make_store`.
+    """
+
+    def setUp(self):
+        self.store = self.make_store(max_length=3)
+
+    def test_missing_timeline(self):
+        self.assertFalse(self.store.exists("home:1"))
+        self.assertEqual(self.store.range("home:1", 10), [])
+
+    def test_push_keeps_newest_first_and_caps(self):
+        self.store.replace("home:1", [])
+        self.store.push(["home:1"], (10, 1, 7))
+        self.store.push(["home:1"], (30, 3, 7))
+        self.store.push(["home:1"], (20, 2, 8))
+        self.store.push(["home:1"], (5, 4, 8))
+
+        self.assertEqual(
+            [tuple(e) for e in self.store.range("home:1", 10)],
+            [(30, 3, 7), (20, 2, 8), (10, 1, 7)])
+
+    def test_push_skips_unbuilt_timelines(self):
+        self.store.push(["home:2"], (10, 1, 7))
+
+        self.assertFalse(self.store.exists("home:2"))
+
+    def test_add_many_merges_and_caps(self):
+        self.store.replace("home:1", [(10, 1, 7), (40, 4, 7)])
+        self.store.add_many("home:1", [(30, 3, 8), (10, 1, 7), (5, 5, 8)])
+
+        self.assertEqual(
+            [tuple(e) for e in self.store.range("home:1", 10)],
+            [(40, 4, 7), (30, 3, 8), (10, 1, 7)])
+
+        self.store.add_many("home:2", [(10, 1, 7)])
+        self.assertFalse(self.store.exists("home:2"))
+
+    def test_remove_and_remove_author(self):
+        self.store.replace("home:1", [(10, 1, 7), (20, 2, 8), (30, 3, 7)])
+
+        self.store.remove(["home:1"], 2)
+        self.assertEqual(
+            [e[1] for e in self.store.range("home:1", 10)], [3, 1])
+
+        self.store.remove_author("home:1", 7)
+        self.assertEqual(self.store.range("home:1", 10), [])
+        self.assertTrue(self.store.exists("home:1"))
+
+    def test_range_before_and_after(self):
+        self.store.replace("home:1", [(10, 1, 7), (20, 2, 8), (20, 3, 7)])
+
+        older = self.store.range("home:1", 10, before=(20, 3))
+        self.assertEqual([e[1] for e in older], [2, 1])
+
+        newer = self.store.range("home:1", 1, after=(10, 1))
+        self.assertEqual([e[1] for e in newer], [2])
+
+    def test_delete(self):
+        self.store.replace("home:1", [(10, 1, 7)])
+        self.store.delete("home:1")
+
+        self.assertFalse(self.store.exists("home:1"))
+
+    def test_reset(self):
+        self.store.replace("home:1", [(10, 1, 7)])
+        self.assertIsNone(self.store.database())
+
+        self.store.reset("db1")
+
+        self.assertFalse(self.store.exists("home:1"))
+        self.assertEqual(self.store.database(), "db1")
+
+
+class MemoryTimelineStoreTestCase(TimelineStoreTests, TestCase):
+    def make_store(self, max_length):
+        return MemoryTimelineStore(max_length=max_length)
+
+
+class SQLiteTimelineStoreTestCase(TimelineStoreTests, TestCase):
+    def make_store(self, max_length):
+        return SQLiteTimelineStore(":memory:", max_length=max_length)
+
+
+class HomeTimelineViewsTestCase(TestCase):
+    """Tests that the write routes keep home timelines up to date."""
+
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m1 = Message(text="u2-first", user_id=u2.id)
+        db.session.add(m1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, client, user_id):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        with app.test_client() as client:
+            self.login(client, self.u1_id)
+
+            # build u1's (empty) timeline before following
+            html = client.get("/").get_data(as_text=True)
+            self.assertNotIn("u2-first", html)
+
+            client.post(f"/users/follow/{self.u2_id}")
+            html = client.get("/").get_data(as_text=True)
+            self.assertIn("u2-first", html)
+
+            client.post(f"/users/stop-following/{self.u2_id}")
+            html = client.get("/").get_data(as_text=True)
+            self.assertNotIn("u2-first", html)
+
+    def test_store_from_another_database_is_wiped(self):
+        store = MemoryTimelineStore()
+        store.reset("another database")
+        store.replace(home_key(self.u1_id), [(10, 12345, self.u2_id)])
+
+        self.assertEqual(HomeTimelines(store).message_ids(self.u1_id), [])
+        self.assertEqual(store.database(), database_id())
+
+    def test_recreating_the_database_wipes_the_store(self):
+        timelines.store.replace(home_key(self.u1_id),
+                                [(10, 12345, self.u2_id)])
+        old = timelines.store.database()
+
+        db.session.commit()
+        db.drop_all()
+        db.create_all()
+
+        self.assertFalse(timelines.store.exists(home_key(self.u1_id)))
+        self.assertNotEqual(timelines.store.database(), old)
+        self.assertEqual(timelines.store.database(), database_id())
+
+    def test_new_messages_fan_out_to_followers(self):
+        with app.test_client() as client:
+            self.login(client, self.u1_id)
+            client.post(f"/users/follow/{self.u2_id}")
+            client.get("/")
+
+            self.login(client, self.u2_id)
+            client.post("/messages/new", data={"text": "u2-second"})
+
+            self.login(client, self.u1_id)
+            html = client.get("/").get_data(as_text=True)
+            self.assertIn("u2-second", html)
+
+            self.login(client, self.u2_id)
+            msg = Message.query.filter_by(text="u2-second").one()
+            client.post(f"/messages/{msg.id}/delete")
+
+            self.assertNotIn(
+                msg.id,
+                timelines.message_ids(self.u1_id))
+            self.assertTrue(timelines.store.exists(home_key(self.u1_id)))
+
+
+class HybridTimelineTestCase(TestCase):
+    """Tests for pulling posts of heavily-followed accounts at read time."""
+
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+
+        # u2 has two followers, u3 has one
+        db.session.add_all([
+            Follow(user_being_followed_id=u2.id, user_following_id=u1.id),
+            Follow(user_being_followed_id=u2.id, user_following_id=u3.id),
+            Follow(user_being_followed_id=u3.id, user_following_id=u1.id),
+        ])
+        db.session.commit()
+        recount()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+
+        self.timelines = HomeTimelines(
+            MemoryTimelineStore(), fanout_threshold=1)
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def post(self, user_id, text):
+        msg = Message(text=text, user_id=user_id)
+        db.session.add(msg)
+        db.session.commit()
+        self.timelines.on_message_added(msg)
+        return msg.id
+
+    def test_big_accounts_are_pulled_and_merged(self):
+        self.timelines.rebuild(self.u1_id)
+
+        m1 = self.post(self.u2_id, "from u2")
+        m2 = self.post(self.u3_id, "from u3")
+        m3 = self.post(self.u2_id, "from u2 again")
+
+        # u2 is above the threshold, so only u3's post was pushed to u1
+        pushed = self.timelines.store.range(home_key(self.u1_id), 10)
+        self.assertEqual([entry[1] for entry in pushed], [m2])
+
+        self.assertEqual(self.timelines.message_ids(self.u1_id), [m3, m2, m1])
+        self.assertEqual(self.timelines.message_ids(self.u1_id, 2), [m3, m2])
+
+    def test_deleted_posts_leave_outbox(self):
+        m1 = self.post(self.u2_id, "from u2")
+        self.assertEqual(self.timelines.message_ids(self.u1_id), [m1])
+
+        Message.query.filter_by(id=m1).delete()
+        db.session.commit()
+        self.timelines.on_message_deleted(m1, self.u2_id)
+
+        self.assertEqual(self.timelines.message_ids(self.u1_id), [])
@@ -0,0 +1,169 @@
+"""Current-user cache tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, user_cache, CURR_USER_KEY
+from sqlalchemy import event
+from testing import FakeClock
+from user_cache import UserCache
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class UserCacheTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        self.clock = FakeClock()
+        self.cache = UserCache(max_size=1, ttl=10, clock=self.clock)
+
+        user_cache.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def count_queries(self, fn, *args):
+        """(result of fn(*args), number of SQL statements it ran)."""
+
+        statements = []
+
+        def record(*args):
+            statements.append(args)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            result = fn(*args)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        return result, len(statements)
+
+    def test_hit_skips_database(self):
+        db.session.expunge_all()
+        user, queries = self.count_queries(self.cache.get, self.u1_id)
+        self.assertEqual(queries, 1)
+
+        db.session.expunge_all()
+        user, queries = self.count_queries(self.cache.get, self.u1_id)
+        self.assertEqual(queries, 0)
+        self.assertEqual(user.username, "u1")
+        self.assertIs(db.session.get(User, self.u1_id), user)
+
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_uncached_fields_load_from_database(self):
+        self.cache.get(self.u1_id)
+        db.session.expunge_all()
+        user = self.cache.get(self.u1_id)
+
+        User.query.filter_by(id=self.u1_id).update({'messages_count': 5})
+
+        self.assertEqual(user.messages_count, 5)
+        self.assertTrue(User.authenticate("u1", "password"))
+
+    def test_entries_expire(self):
+        self.cache.get(self.u1_id)
+
+        self.clock.now = 11
+        self.cache.get(self.u1_id)
+
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.get(self.u1_id)
+        self.cache.get(self.u2_id)
+        self.cache.get(self.u1_id)
+
+        self.assertEqual(self.cache.stats()['hits'], 0)
+        self.assertEqual(self.cache.stats()['size'], 1)
+
+    def test_invalidate_during_lookup_is_not_cached(self):
+        # the user is invalidated while their lookup is reading the database
+        original_get = db.session.get
+
+        def get_then_invalidate(model, ident):
+            user = original_get(model, ident)
+            self.cache.invalidate(ident)
+            return user
+
+        db.session.get = get_then_invalidate
+        try:
+            self.cache.get(self.u1_id)
+        finally:
+            del db.session.get
+
+        self.cache.get(self.u1_id)
+
+        self.assertEqual(self.cache.stats()['hits'], 0)
+
+    def test_missing_user(self):
+        self.assertIsNone(self.cache.get(self.u2_id + 1000))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_profile_edit_invalidates(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            client.get("/")
+            invalidations = user_cache.stats()['invalidations']
+            client.post("/users/profile", data={
+                "username": "renamed",
+                "email": "u1@email.com",
+                "image_url": "",
+                "header_image_url": "",
+                "bio": "",
+                "password": "password",
+            })
+
+            db.session.expunge_all()
+            html = client.get("/").get_data(as_text=True)
+
+            self.assertIn("renamed", html)
+            self.assertEqual(user_cache.stats()['invalidations'],
+                             invalidations + 1)
+
+    def test_delete_invalidates(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            client.get("/")
+            client.post("/users/delete")
+
+            self.assertIsNone(user_cache.get(self.u2_id))
+
+    def test_deleted_by_another_worker_logs_out(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            client.get("/")
+
+            # deleted elsewhere: this worker's cache still has them
+            db.session.execute(db.delete(User).where(User.id == self.u2_id))
+            db.session.commit()
+            db.session.expunge_all()
+
+            resp = client.get("/", follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Sign up now", resp.get_data(as_text=True))
+            with client.session_transaction() as sess:
+                self.assertNotIn(CURR_USER_KEY, sess)
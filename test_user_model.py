@@ -3,7 +3,10 @@
 import os
 from unittest import TestCase
 
-from models import db, User, Message, Follow
+from threading import Thread
+from time import sleep
+
+from models import db, User, Message, Follow, Like, TOGGLE_LIKE_SQL
 from sqlalchemy import exc
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
@@ -72,6 +75,45 @@ class UserModelTestCase(TestCase):
         self.assertFalse(u1.is_followed_by(u2))
         self.assertTrue(u2.is_followed_by(u1))
 
+    def test_following_status(self):
+        """Test that following_status answers for a batch of user ids, and
+        that the cached follow sets are dropped when the user is expired."""
+
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+
+        self.assertEqual(
+            u1.following_status([self.u2_id]), {self.u2_id: False})
+        self.assertFalse(u1.is_following(u2))
+
+        db.session.add(
+            Follow(user_being_followed_id=self.u2_id,
+                   user_following_id=self.u1_id))
+        db.session.commit()
+
+        self.assertTrue(u1.is_following(u2))
+        self.assertTrue(u2.is_followed_by(u1))
+        self.assertEqual(
+            u1.following_status([self.u1_id, self.u2_id]),
+            {self.u1_id: False, self.u2_id: True})
+
+    def test_follow_ids_last_one_request(self):
+        u1 = User.query.get(self.u1_id)
+        self.assertEqual(u1.following_ids(), set())
+
+        # followed elsewhere (another worker), so nothing expires u1 here
+        with db.engine.begin() as connection:
+            connection.execute(db.insert(Follow).values(
+                user_being_followed_id=self.u2_id,
+                user_following_id=self.u1_id))
+
+        self.assertEqual(u1.following_ids(), set())
+
+        with app.test_client() as client:
+            client.get("/")
+
+        self.assertEqual(u1.following_ids(), {self.u2_id})
+
     def test_signup(self):
         """Tests that a new user can be successfully created, with valid
         credentials, and fail if not valid """
@@ -173,6 +215,53 @@ class UserModelTestCase(TestCase):
         db.session.commit()
         self.assertFalse(m1 in u2.liked_messages)
 
+    def test_toggle_like_return_values(self):
+        """ Tests that toggle_like reports which way the like went. """
+
+        m1 = Message(text="Message 1 Text", user_id=self.u1_id)
+        db.session.add(m1)
+        db.session.commit()
+
+        u2 = User.query.get(self.u2_id)
+
+        self.assertEqual(u2.toggle_like(m1), 1)
+        self.assertEqual(u2.toggle_like(m1), -1)
+        self.assertEqual(Like.query.count(), 0)
+
+    def test_toggle_like_double_click(self):
+        """ Tests that two toggles racing to like a message like it once. """
+
+        m1 = Message(text="Message 1 Text", user_id=self.u1_id)
+        db.session.add(m1)
+        db.session.commit()
+
+        params = dict(user_id=self.u2_id, message_id=m1.id)
+        results = {}
+        engine = db.engine
+
+        def second_click():
+            with engine.connect() as conn:
+                results['second'] = conn.execute(
+                    TOGGLE_LIKE_SQL, params).scalar()
+                conn.commit()
+
+        with engine.connect() as conn:
+            results['first'] = conn.execute(TOGGLE_LIKE_SQL, params).scalar()
+
+            # the second click blocks on the first's uncommitted like
+            thread = Thread(target=second_click)
+            thread.start()
+            sleep(0.2)
+            conn.commit()
+
+        thread.join()
+
+        self.assertEqual(results, {'first': 1, 'second': 0})
+        self.assertEqual(Like.query.filter_by(**params).count(), 1)
+
+        Like.query.delete()
+        db.session.commit()
+
     def test_toggle_like_fail(self):
         """ Tests to make sure message owner can't like their own messages. """
 
@@ -0,0 +1,115 @@
+"""Username search and autocomplete tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, usernames, CURR_USER_KEY
+from testing import FakeClock
+from user_search import UsernameIndex, decode_user_cursor, search_users
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+NAMES = ["bob", "Bobby", "abob", "alice", "bobcat", "zed_bob", "carol"]
+
+
+class UserSearchTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        db.session.add_all(
+            User(username=name, email=f"{name}@email.com", password="x")
+            for name in NAMES)
+        db.session.commit()
+
+        self.ids = {user.username: user.id for user in User.query.all()}
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_exact_then_prefix_then_substring(self):
+        page = search_users("BOB")
+
+        self.assertEqual([user.username for user in page],
+                         ["bob", "Bobby", "bobcat", "abob", "zed_bob"])
+        self.assertIsNone(page.after)
+
+    def test_wildcards_are_literal(self):
+        self.assertEqual([user.username for user in search_users("_")],
+                         ["zed_bob"])
+        self.assertEqual(len(search_users("%")), 0)
+
+    def test_pages_visit_every_match_once(self):
+        for q in ["bob", None]:
+            seen = []
+            after = None
+
+            while True:
+                page = search_users(q, after=after, per_page=2)
+                seen.extend(user.username for user in page)
+                if page.after is None:
+                    break
+                after = decode_user_cursor(page.after)
+
+            self.assertEqual(seen, [user.username for user in search_users(q)])
+
+        self.assertEqual(len(seen), len(NAMES))
+
+    def test_list_users_pages(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids["alice"]
+
+            resp = client.get("/users?q=bob&after=nonsense")
+            self.assertEqual(resp.status_code, 400)
+
+            html = client.get("/users?q=bob").get_data(as_text=True)
+            self.assertIn("@zed_bob", html)
+            self.assertNotIn("More users", html)
+
+    def test_username_index(self):
+        clock = FakeClock()
+        index = UsernameIndex(max_age=60, clock=clock)
+
+        self.assertEqual(index.complete("BO"), [
+            (self.ids["bob"], "bob"),
+            (self.ids["Bobby"], "Bobby"),
+            (self.ids["bobcat"], "bobcat"),
+        ])
+        self.assertEqual(index.complete("bo", limit=1),
+                         [(self.ids["bob"], "bob")])
+
+        index.add(self.ids["carol"], "bonnie")
+        index.remove(self.ids["bobcat"])
+        self.assertEqual([name for _, name in index.complete("bo")],
+                         ["bob", "Bobby", "bonnie"])
+
+        # changes made elsewhere show up once the index is reloaded
+        User.query.filter_by(username="alice").update({'username': "boris"})
+        db.session.commit()
+        self.assertNotIn("boris", [name for _, name in index.complete("bo")])
+
+        clock.now = 61
+        self.assertEqual([name for _, name in index.complete("bo")],
+                         ["bob", "Bobby", "bobcat", "boris"])
+
+    def test_autocomplete_endpoint(self):
+        with app.test_client() as client:
+            resp = client.get("/users/autocomplete?q=bo")
+            self.assertEqual(resp.status_code, 401)
+
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids["alice"]
+
+            usernames.remove(self.ids["bob"])
+            usernames.add(self.ids["bob"], "bob")
+
+            resp = client.get("/users/autocomplete?q=bobb")
+            self.assertEqual(resp.json,
+                             [dict(id=self.ids["Bobby"], username="Bobby")])
@@ -3,12 +3,17 @@
 import os
 from unittest import TestCase
 
+import re
+
+from flask import g
 from models import db, User, Message, Follow
 from sqlalchemy import exc
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
 
 from app import app
+from pagination import USERS_PER_PAGE
+from query_budget import count_queries
 
 app.config['TESTING'] = True
 
@@ -104,7 +109,101 @@ class UserViewsTestCase(TestCase):
         html = resp.get_data(as_text=True)
         self.assertIn("users-show-test", html)
 
+    def test_unused_request_globals_are_not_loaded(self):
+        """ Tests that g.user and g.csrf_form are only set up when used """
+
+        with app.test_client() as client:
+            resp = client.get("/")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('user', g)
+            self.assertNotIn('csrf_form', g)
+            self.assertIsNone(resp.headers.get("Set-Cookie"))
+
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = self.u1_id
+
+            resp = client.get("/users")
+            resp.get_data()
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(g.user.id, self.u1_id)
+            self.assertIn('csrf_form', g)
 
     # Other Tests
     # Un-follow correctly shows as un-followed
-    # Delete user correctly deletes a user and doesn't break DB
\ No newline at end of file
+    # Delete user correctly deletes a user and doesn't break DB
+
+
+class FollowListViewsTestCase(TestCase):
+    """Tests for the paginated followers / following pages."""
+
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User(username="u1", email="u1@email.com", password="x")
+        db.session.add(u1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def add_fans(self, count):
+        """Add `count` users who follow u1 and whom u1 follows back."""
+
+        start = User.query.count()
+        fans = [User(username=f"fan{i}", email=f"fan{i}@email.com",
+                     password="x")
+                for i in range(start, start + count)]
+        db.session.add_all(fans)
+        db.session.flush()
+
+        for fan in fans:
+            db.session.add_all([
+                Follow(user_being_followed_id=self.u1_id,
+                       user_following_id=fan.id),
+                Follow(user_being_followed_id=fan.id,
+                       user_following_id=self.u1_id),
+            ])
+        db.session.commit()
+
+    def visit_all_pages(self, client, url):
+        """Usernames on every page of `url`, and the most queries a page
+        took."""
+
+        names = []
+        most_queries = 0
+
+        while url:
+            with count_queries() as queries:
+                html = client.get(url).get_data(as_text=True)
+            most_queries = max(most_queries, queries.count)
+
+            names.extend(re.findall(r"<p>@(\w+)</p>", html))
+            more = re.search(r'href="(\?after=[\w-]+)"', html)
+            url = more and url.split("?")[0] + more.group(1)
+
+        return names, most_queries
+
+    def test_follow_lists_page_in_fixed_queries(self):
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = self.u1_id
+
+            self.add_fans(2)
+            # fill the per-worker user cache first
+            client.get("/").get_data()
+            _, small = self.visit_all_pages(
+                client, f"/users/{self.u1_id}/followers")
+
+            self.add_fans(USERS_PER_PAGE + 3)
+
+            for url in [f"/users/{self.u1_id}/followers",
+                        f"/users/{self.u1_id}/following"]:
+                names, queries = self.visit_all_pages(client, url)
+
+                self.assertEqual(len(names), USERS_PER_PAGE + 5)
+                self.assertEqual(len(set(names)), len(names))
+                self.assertEqual(queries, small)
@@ -0,0 +1,684 @@
+"""Precomputed home timelines for Warbler.
+
+Instead of building each user's home feed with a query over everyone they
+follow, new messages are pushed ("fanned out") into a per-user list of
+message ids when they are written. The homepage then only has to read the
+front of that list.
+
+Timelines live in a pluggable store. Two backends ship here:
+
+- SQLiteTimelineStore: a SQLite file that every worker on a box can share
+  (the default).
+- MemoryTimelineStore: a dict of sorted lists, private to one process. Fan-out
+  only reaches the writing process's copy, so it's only right when a single
+  process serves every request (one worker, tests, benchmarks).
+
+A missing timeline is never an error: it is rebuilt from the database the
+first time it is read, so the store can be wiped at any time. It is wiped
+when it turns out to have been built from another database than the one in
+use (see `migrations.database_id`): after the database is dropped and made
+again, ids are reused, and old timelines would show other users' messages.
+
+Pure fan-out gets expensive for accounts with a huge number of followers, so
+timelines can run in a hybrid mode: posts by accounts with more than
+`fanout_threshold` followers are not pushed. Instead each of those authors
+has a short list of their own recent messages (an "outbox"), and the
+homepage merges the outboxes of the big accounts a user follows into their
+pushed timeline when it is read.
+"""
+
+import heapq
+import sqlite3
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from sqlalchemy import event
+
+from migrations import database_id
+from models import db, User, Message, Follow
+from replicas import primary
+
+TIMELINE_MAX_LENGTH = 800
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def message_score(timestamp):
+    """Sort score for a message timestamp: integer microseconds since epoch.
+
+    Integers (rather than float seconds) keep full timestamp precision, so
+    score order always matches `Message.timestamp` order.
+    """
+
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def home_key(user_id):
+    """Store key for the home timeline of `user_id`."""
+
+    return f"home:{user_id}"
+
+
+def outbox_key(user_id):
+    """Store key for the list of `user_id`'s own recent messages."""
+
+    return f"outbox:{user_id}"
+
+
+##############################################################################
+# Stores
+#
+# A store holds lists of (score, message_id, author_id) entries under string
+# keys, newest first, each capped at `max_length` entries.
+
+
+class TimelineStore:
+    """Interface every timeline backend implements."""
+
+    def __init__(self, max_length=TIMELINE_MAX_LENGTH):
+        self.max_length = max_length
+
+    def exists(self, key):
+        """Has a timeline been built for `key`? (It may still be empty.)"""
+
+        raise NotImplementedError
+
+    def replace(self, key, entries):
+        """Create or overwrite the timeline for `key` with `entries`."""
+
+        raise NotImplementedError
+
+    def push(self, keys, entry):
+        """Add `entry` to each existing timeline in `keys`.
+
+        Keys without a built timeline are skipped; they will pick the entry
+        up when they are rebuilt.
+        """
+
+        raise NotImplementedError
+
+    def add_many(self, key, entries):
+        """Add `entries` to the timeline for `key`, if it's built.
+
+        Entries it already has are kept, as are any pushed meanwhile: the
+        merge happens inside the store, not as a read and a replace.
+        """
+
+        raise NotImplementedError
+
+    def remove(self, keys, message_id):
+        """Remove `message_id` from each timeline in `keys`."""
+
+        raise NotImplementedError
+
+    def remove_author(self, key, author_id):
+        """Remove every entry written by `author_id` from `key`."""
+
+        raise NotImplementedError
+
+    def range(self, key, limit, before=None, after=None):
+        """Return up to `limit` entries of `key`, newest first.
+
+        `before` / `after` are (score, message_id) positions: only entries
+        strictly older than `before`, or the `limit` entries just newer than
+        `after`, are returned.
+        """
+
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Forget the timeline for `key` entirely."""
+
+        raise NotImplementedError
+
+    def clear(self):
+        """Forget every timeline (they are rebuilt as they are read)."""
+
+        raise NotImplementedError
+
+    def database(self):
+        """The id of the database the timelines were built from, or None."""
+
+        raise NotImplementedError
+
+    def reset(self, database):
+        """Forget every timeline, recording that new ones are built from
+        `database`."""
+
+        raise NotImplementedError
+
+
+class MemoryTimelineStore(TimelineStore):
+    """Timelines held in this process's memory.
+
+    Each list is kept sorted by (-score, -message_id) so the newest entry is
+    always at the front and inserts are a bisect away.
+    """
+
+    def __init__(self, max_length=TIMELINE_MAX_LENGTH):
+        super().__init__(max_length)
+        self._timelines = {}
+        self._database = None
+        self._lock = threading.Lock()
+
+    def exists(self, key):
+        return key in self._timelines
+
+    def replace(self, key, entries):
+        items = sorted((-score, -message_id, author_id)
+                       for score, message_id, author_id in entries)
+
+        with self._lock:
+            self._timelines[key] = items[:self.max_length]
+
+    def push(self, keys, entry):
+        score, message_id, author_id = entry
+        item = (-score, -message_id, author_id)
+
+        with self._lock:
+            for key in keys:
+                items = self._timelines.get(key)
+                if items is None:
+                    continue
+
+                i = bisect_left(items, item)
+                if i < len(items) and items[i] == item:
+                    continue
+
+                items.insert(i, item)
+                del items[self.max_length:]
+
+    def add_many(self, key, entries):
+        new = {(-score, -message_id, author_id)
+               for score, message_id, author_id in entries}
+
+        with self._lock:
+            items = self._timelines.get(key)
+            if items is None:
+                return
+
+            items[:] = sorted(new.union(items))[:self.max_length]
+
+    def remove(self, keys, message_id):
+        with self._lock:
+            for key in keys:
+                items = self._timelines.get(key)
+                if items:
+                    items[:] = [i for i in items if i[1] != -message_id]
+
+    def remove_author(self, key, author_id):
+        with self._lock:
+            items = self._timelines.get(key)
+            if items:
+                items[:] = [i for i in items if i[2] != author_id]
+
+    def range(self, key, limit, before=None, after=None):
+        items = self._timelines.get(key, [])
+        position = lambda item: item[:2]
+
+        if after is not None:
+            end = bisect_left(items, (-after[0], -after[1]), key=position)
+            items = items[max(0, end - limit):end]
+        else:
+            start = 0
+            if before is not None:
+                start = bisect_right(
+                    items, (-before[0], -before[1]), key=position)
+            items = items[start:start + limit]
+
+        return [(-score, -message_id, author_id)
+                for score, message_id, author_id in items]
+
+    def delete(self, key):
+        with self._lock:
+            self._timelines.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._timelines.clear()
+
+    def database(self):
+        return self._database
+
+    def reset(self, database):
+        with self._lock:
+            self._timelines.clear()
+            self._database = database
+
+
+class SQLiteTimelineStore(TimelineStore):
+    """Timelines kept in a SQLite file shared by every worker on the host."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS timeline_keys (
+            key TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS timeline_entries (
+            key TEXT NOT NULL,
+            score INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            author_id INTEGER NOT NULL,
+            PRIMARY KEY (key, message_id)
+        );
+        CREATE INDEX IF NOT EXISTS timeline_entries_key_score
+            ON timeline_entries (key, score DESC, message_id DESC);
+        CREATE TABLE IF NOT EXISTS timeline_database (
+            id TEXT
+        );
+    """
+
+    def __init__(self, path, max_length=TIMELINE_MAX_LENGTH):
+        super().__init__(max_length)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def exists(self, key):
+        row = self._conn.execute(
+            "SELECT 1 FROM timeline_keys WHERE key = ?", (key,)).fetchone()
+        return row is not None
+
+    def replace(self, key, entries):
+        entries = sorted(entries, reverse=True)[:self.max_length]
+
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT OR IGNORE INTO timeline_keys (key) VALUES (?)", (key,))
+            self._conn.execute(
+                "DELETE FROM timeline_entries WHERE key = ?", (key,))
+            self._conn.executemany(
+                "INSERT INTO timeline_entries VALUES (?, ?, ?, ?)",
+                [(key, *entry) for entry in entries])
+
+    def push(self, keys, entry):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            for key in keys:
+                self._conn.execute(
+                    """INSERT OR IGNORE INTO timeline_entries
+                       SELECT key, ?, ?, ? FROM timeline_keys WHERE key = ?""",
+                    (*entry, key))
+                self._trim(key)
+
+    def add_many(self, key, entries):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                """INSERT OR IGNORE INTO timeline_entries
+                   SELECT key, ?, ?, ? FROM timeline_keys WHERE key = ?""",
+                [(*entry, key) for entry in entries])
+            self._trim(key)
+
+    def remove(self, keys, message_id):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "DELETE FROM timeline_entries WHERE key = ? AND message_id = ?",
+                [(key, message_id) for key in keys])
+
+    def remove_author(self, key, author_id):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM timeline_entries WHERE key = ? AND author_id = ?",
+                (key, author_id))
+
+    def range(self, key, limit, before=None, after=None):
+        if after is not None:
+            rows = self._conn.execute(
+                """SELECT score, message_id, author_id FROM timeline_entries
+                   WHERE key = ? AND (score, message_id) > (?, ?)
+                   ORDER BY score, message_id
+                   LIMIT ?""",
+                (key, *after, limit)).fetchall()
+            return rows[::-1]
+
+        if before is None:
+            before = (float('inf'), 0)
+
+        return self._conn.execute(
+            """SELECT score, message_id, author_id FROM timeline_entries
+               WHERE key = ? AND (score, message_id) < (?, ?)
+               ORDER BY score DESC, message_id DESC
+               LIMIT ?""",
+            (key, *before, limit)).fetchall()
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "DELETE FROM timeline_entries WHERE key = ?", (key,))
+            self._conn.execute(
+                "DELETE FROM timeline_keys WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM timeline_entries")
+            self._conn.execute("DELETE FROM timeline_keys")
+
+    def database(self):
+        row = self._conn.execute(
+            "SELECT id FROM timeline_database").fetchone()
+        return row and row[0]
+
+    def reset(self, database):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM timeline_entries")
+            self._conn.execute("DELETE FROM timeline_keys")
+            self._conn.execute("DELETE FROM timeline_database")
+            self._conn.execute(
+                "INSERT INTO timeline_database VALUES (?)", (database,))
+
+    def _trim(self, key):
+        """Drop entries of `key` past `max_length`."""
+
+        self._conn.execute(
+            """DELETE FROM timeline_entries
+               WHERE key = ? AND message_id IN (
+                   SELECT message_id FROM timeline_entries
+                   WHERE key = ?
+                   ORDER BY score DESC, message_id DESC
+                   LIMIT -1 OFFSET ?)""",
+            (key, key, self.max_length))
+
+
+TIMELINE_BACKENDS = {
+    'memory': MemoryTimelineStore,
+    'sqlite': SQLiteTimelineStore,
+}
+
+
+##############################################################################
+# Home timelines
+
+
+class HomeTimelines:
+    """Keeps every user's home timeline in sync with the database.
+
+    The write routes call the `on_*` hooks after they commit; the homepage
+    calls `message_ids`.
+
+    With `fanout_threshold` left as None every post is pushed. Otherwise
+    posts by authors with more followers than that are pulled in at read
+    time instead (see the module docstring).
+    """
+
+    def __init__(self, store, fanout_threshold=None):
+        self.store = store
+        self.fanout_threshold = fanout_threshold
+
+        # the database the store has been checked against, once it has
+        self._database = None
+        self._lock = threading.Lock()
+
+    def message_ids(self, user_id, limit=100, before=None, after=None):
+        """Ids of up to `limit` messages on `user_id`'s home timeline.
+
+        Without a cursor this is the newest page. `before` / `after` are
+        (timestamp, message_id) cursors of the message a page should start
+        after (going older) or end before (going newer).
+        """
+
+        key = home_key(user_id)
+
+        if self._database is None:
+            # from the primary: a replica could be behind a reseed
+            with primary():
+                self.use_database(database_id())
+
+        if not self.store.exists(key):
+            self.rebuild(user_id)
+
+        position = dict(
+            before=before and (message_score(before[0]), before[1]),
+            after=after and (message_score(after[0]), after[1]))
+
+        timelines = [self.store.range(key, limit, **position)]
+
+        for author_id in self._pulled_authors(user_id):
+            timelines.append(self._outbox(author_id, limit, **position))
+
+        message_ids = self._merge(timelines, limit, newest=after is None)
+
+        # stores only keep the newest `max_length` entries of a timeline, so
+        # once an older page runs short, page through the database instead
+        if before is not None and len(message_ids) < limit:
+            message_ids = [message_id for _, message_id, _
+                           in self._pull(user_id, limit, before)]
+
+        return message_ids
+
+    def use_database(self, database):
+        """Build timelines from `database` (see `migrations.database_id`)
+        from now on, wiping the store if it was built from another."""
+
+        with self._lock:
+            if self.store.database() != database:
+                self.store.reset(database)
+            self._database = database
+
+    def rebuild(self, user_id):
+        """Rebuild `user_id`'s timeline from their own and followed messages."""
+
+        # from the primary, since the timeline is kept (see replicas.py)
+        with primary():
+            rows = self._pull(user_id, self.store.max_length)
+
+        self.store.replace(home_key(user_id), [
+            (message_score(timestamp), message_id, author_id)
+            for timestamp, message_id, author_id in rows
+        ])
+
+    def on_message_added(self, message):
+        """Fan `message` out to its author and everyone following them.
+
+        Authors above the fan-out threshold only get it added to their own
+        timeline and outbox; their followers pull it in when they read.
+        """
+
+        author_id = message.user_id
+        entry = (message_score(message.timestamp), message.id, author_id)
+        keys = [outbox_key(author_id), home_key(author_id)]
+
+        if not self._is_pulled(author_id):
+            keys.extend(home_key(user_id)
+                        for user_id in self._follower_ids(author_id))
+
+        self.store.push(keys, entry)
+
+    def on_message_deleted(self, message_id, author_id):
+        """Remove a deleted message from every timeline it was fanned out to.
+
+        This includes all followers even for pulled authors, since they may
+        have crossed the threshold after the message was pushed.
+        """
+
+        keys = [outbox_key(author_id), home_key(author_id)]
+        keys.extend(home_key(user_id)
+                    for user_id in self._follower_ids(author_id))
+
+        self.store.remove(keys, message_id)
+
+    def on_follow(self, follower_id, followed_id):
+        """Backfill `followed_id`'s recent messages into the follower's feed."""
+
+        key = home_key(follower_id)
+
+        if not self.store.exists(key):
+            return
+
+        rows = (db.session
+                .query(Message.timestamp, Message.id)
+                .filter(Message.user_id == followed_id)
+                .order_by(Message.timestamp.desc(), Message.id.desc())
+                .limit(self.store.max_length)
+                .all())
+
+        self.store.add_many(key, [
+            (message_score(timestamp), message_id, followed_id)
+            for timestamp, message_id in rows
+        ])
+
+    def on_unfollow(self, follower_id, followed_id):
+        """Drop `followed_id`'s messages from the follower's feed."""
+
+        self.store.remove_author(home_key(follower_id), followed_id)
+
+    def on_user_deleted(self, user_id):
+        """Forget a deleted user's own timeline and outbox."""
+
+        self.store.delete(home_key(user_id))
+        self.store.delete(outbox_key(user_id))
+
+    def _schema_created(self, metadata, connection, tables=(), **kw):
+        # db.create_all() made a new database, so ids will be reused; only
+        # when it made the whole schema, as migrations.py records then
+        if set(metadata.tables.values()) <= set(tables):
+            self.use_database(database_id(connection))
+
+    def _follower_ids(self, author_id):
+        """Ids of the users following `author_id`."""
+
+        rows = (db.session
+                .query(Follow.user_following_id)
+                .filter(Follow.user_being_followed_id == author_id)
+                .all())
+
+        return [user_id for user_id, in rows]
+
+    def _is_pulled(self, author_id):
+        """Are `author_id`'s posts pulled at read time instead of pushed?"""
+
+        if self.fanout_threshold is None:
+            return False
+
+        followers_count = (db.session
+                           .query(User.followers_count)
+                           .filter(User.id == author_id)
+                           .scalar())
+
+        return (followers_count or 0) > self.fanout_threshold
+
+    def _pulled_authors(self, user_id):
+        """Ids of the accounts `user_id` follows whose posts are pulled."""
+
+        if self.fanout_threshold is None:
+            return []
+
+        rows = (db.session
+                .query(Follow.user_being_followed_id)
+                .join(User, User.id == Follow.user_being_followed_id)
+                .filter(Follow.user_following_id == user_id,
+                        User.followers_count > self.fanout_threshold)
+                .all())
+
+        return [author_id for author_id, in rows]
+
+    def _pull(self, user_id, limit, before=None):
+        """Newest `limit` messages of `user_id` and the people they follow.
+
+        This is the query the homepage used to run on every request. Returns
+        (timestamp, message_id, author_id) rows, older than `before` if given.
+        """
+
+        # one list of authors (not `user_id = ... OR user_id IN (...)`), so
+        # each author's messages are read from the (user_id, timestamp) index
+        author_ids = db.union_all(
+            db.select(Follow.user_being_followed_id)
+            .where(Follow.user_following_id == user_id),
+            db.select(db.literal(user_id)),
+        )
+
+        query = (db.session
+                 .query(Message.timestamp, Message.id, Message.user_id)
+                 .filter(Message.user_id.in_(author_ids)))
+
+        if before is not None:
+            query = query.filter(
+                db.tuple_(Message.timestamp, Message.id) < before)
+
+        return (query
+                .order_by(Message.timestamp.desc(), Message.id.desc())
+                .limit(limit)
+                .all())
+
+    def _outbox(self, author_id, limit, before=None, after=None):
+        """Up to `limit` of `author_id`'s entries, building them if needed."""
+
+        key = outbox_key(author_id)
+
+        if not self.store.exists(key):
+            with primary():
+                rows = (db.session
+                        .query(Message.timestamp, Message.id)
+                        .filter(Message.user_id == author_id)
+                        .order_by(Message.timestamp.desc(), Message.id.desc())
+                        .limit(self.store.max_length)
+                        .all())
+
+            self.store.replace(key, [
+                (message_score(timestamp), message_id, author_id)
+                for timestamp, message_id in rows
+            ])
+
+        return self.store.range(key, limit, before=before, after=after)
+
+    @staticmethod
+    def _merge(timelines, limit, newest=True):
+        """K-way merge of newest-first `timelines` into `limit` unique ids.
+
+        Keeps the newest `limit` ids, or the oldest ones if `newest` is False
+        (when paging towards newer messages).
+        """
+
+        message_ids = []
+        seen = set()
+
+        for _, message_id, _ in heapq.merge(*timelines, reverse=True):
+            if message_id in seen:
+                continue
+
+            seen.add(message_id)
+            message_ids.append(message_id)
+
+            if newest and len(message_ids) == limit:
+                break
+
+        return message_ids if newest else message_ids[-limit:]
+
+
+def connect_timelines(app):
+    """Create the home timeline service configured for `app`.
+
+    TIMELINE_BACKEND picks the store ('sqlite' or 'memory'; memory only
+    works when one process serves every request, since other workers' copies
+    never see the fan-out); TIMELINE_SQLITE_PATH is the file the sqlite
+    backend uses. TIMELINE_FANOUT_THRESHOLD turns on hybrid mode when set.
+
+    The store is wiped whenever `db.create_all()` makes a new database.
+    """
+
+    backend = app.config.get('TIMELINE_BACKEND', 'sqlite')
+    max_length = app.config.get('TIMELINE_MAX_LENGTH', TIMELINE_MAX_LENGTH)
+
+    if backend == 'sqlite':
+        store = SQLiteTimelineStore(
+            app.config.get('TIMELINE_SQLITE_PATH', 'timelines.sqlite'),
+            max_length=max_length)
+    else:
+        store = TIMELINE_BACKENDS[backend](max_length=max_length)
+
+    timelines = HomeTimelines(
+        store,
+        fanout_threshold=app.config.get('TIMELINE_FANOUT_THRESHOLD'))
+    event.listen(db.metadata, 'after_create', timelines._schema_created)
+    app.extensions['timelines'] = timelines
+
+    return timelines
@@ -0,0 +1,180 @@
+"""Per-worker cache of logged-in users, for `add_user_to_g`.
+
+Every request used to look the current user up with `User.query.get`. Most
+pages only need a handful of profile fields from that row (the navbar shows
+the username and avatar), so each worker keeps a small LRU of lightweight
+snapshots of those fields instead, good for a short TTL.
+
+A snapshot is turned back into a User that is attached to the session
+without a query. Anything not in the snapshot (the password hash, the
+stored counts, relationships) is loaded from the database if and when it is
+used, so it is never stale.
+
+Routes that change a cached field (`profile`) or the user's existence
+(`delete_user`) call `invalidate` once they commit. That only reaches this
+worker's cache; other workers see the change when their entry expires,
+which is what the TTL bounds. A user deleted by another worker is logged
+out when a request here first loads something not in their snapshot (see
+`logged_in_user_deleted` in app.py).
+
+Each user id also has a version number, bumped by `invalidate`. A lookup
+that was already loading from the database when the user was invalidated
+sees the version has moved on and doesn't cache what it loaded.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, User
+from replicas import primary
+
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 30
+
+# the User columns a snapshot keeps
+SNAPSHOT_FIELDS = (
+    'id',
+    'username',
+    'email',
+    'image_url',
+    'header_image_url',
+    'bio',
+    'location',
+)
+
+
+class UserCache:
+    """LRU of user snapshots, each valid for `ttl` seconds.
+
+    Safe to share between the threads of one worker. A `ttl` of 0 turns
+    caching off (every lookup is a miss).
+    """
+
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL,
+                 clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+
+        # user id -> (expires at, snapshot dict), least recently used first
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        """The User with `user_id`, attached to the session, or None."""
+
+        snapshot, version = self._lookup(user_id)
+
+        if snapshot is not None:
+            return self._attach(snapshot)
+
+        # from the primary, since the snapshot is kept (see replicas.py)
+        with primary():
+            user = db.session.get(User, user_id)
+
+        if user is not None:
+            self._store(user_id, version, {
+                field: getattr(user, field) for field in SNAPSHOT_FIELDS})
+
+        return user
+
+    def invalidate(self, user_id):
+        """Forget `user_id`, including any lookup of it still in flight."""
+
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self.invalidations += 1
+
+    def clear(self):
+        """Forget everyone."""
+
+        with self._lock:
+            for user_id in self._entries:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counts since the worker started, as a dict."""
+
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                invalidations=self.invalidations,
+                size=len(self._entries),
+                hit_rate=self.hits / lookups if lookups else 0.0,
+            )
+
+    def _lookup(self, user_id):
+        """(snapshot, None) on a hit; (None, current version) on a miss."""
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+
+            if entry is not None and entry[0] > self.clock():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1], None
+
+            if entry is not None:
+                del self._entries[user_id]
+
+            self.misses += 1
+            return None, self._versions.get(user_id, 0)
+
+    def _store(self, user_id, version, snapshot):
+        """Cache `snapshot` unless `user_id` was invalidated since `version`."""
+
+        if self.ttl <= 0:
+            return
+
+        with self._lock:
+            if self._versions.get(user_id, 0) != version:
+                return
+
+            self._entries[user_id] = (self.clock() + self.ttl, snapshot)
+            self._entries.move_to_end(user_id)
+
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                # nothing can be in flight for an evicted id that matters,
+                # so don't let its version linger either
+                self._versions.pop(evicted, None)
+
+    def _attach(self, snapshot):
+        """A User built from `snapshot`, in the session, without a query.
+
+        If the session already holds this user, that instance is returned
+        (with the snapshot's fields copied onto it).
+        """
+
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+
+        return db.session.merge(user, load=False)
+
+
+def connect_user_cache(app):
+    """Create the current-user cache configured for `app`.
+
+    USER_CACHE_TTL is how long (in seconds) an entry is trusted; 0 turns the
+    cache off. USER_CACHE_SIZE is the most users one worker keeps.
+    """
+
+    cache = UserCache(
+        max_size=app.config.get('USER_CACHE_SIZE', USER_CACHE_SIZE),
+        ttl=app.config.get('USER_CACHE_TTL', USER_CACHE_TTL))
+    app.extensions['user_cache'] = cache
+
+    return cache
@@ -0,0 +1,191 @@
+"""Username search for `/users`, and autocomplete for the search box.
+
+Search matches the query anywhere in a username, ignoring case, and ranks
+exact matches first, then names that start with the query, then the rest,
+alphabetically within each group. Results come a page at a time, with a
+cursor holding the (rank, username) of the last result shown; on
+PostgreSQL the matching is served by the indexes from
+`models.create_username_search_indexes`.
+
+Autocomplete only needs prefix matches, and it's asked on every keystroke,
+so each worker answers it from a sorted in-memory list of usernames
+instead of the database. The list is loaded on first use, kept up to date
+by the signup, profile and delete routes, and reloaded every so often to
+pick up changes made through other workers.
+"""
+
+import threading
+import time
+from bisect import bisect_left, insort
+
+from models import db, User
+from pagination import (
+    USERS_PER_PAGE, StreamedPage, UserPage, pack_cursor, unpack_cursor)
+from werkzeug.exceptions import BadRequest
+
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_AGE = 300
+
+
+def encode_user_cursor(rank, username):
+    """Opaque cursor string for a search result's position."""
+
+    return pack_cursor(str(rank), username)
+
+
+def decode_user_cursor(cursor):
+    """(rank, username) position from a cursor made by `encode_user_cursor`.
+
+    Raises BadRequest for anything that isn't a valid cursor.
+    """
+
+    rank, username = unpack_cursor(cursor, 2)
+
+    try:
+        return int(rank), username
+
+    except ValueError:
+        raise BadRequest("Invalid page cursor.")
+
+
+def search_users(q=None, after=None, per_page=USERS_PER_PAGE, on_chunk=None,
+                 stream=False):
+    """The page of users matching `q` that comes after position `after`.
+
+    With no `q`, pages through everyone alphabetically.
+
+    `on_chunk` is called with the page's users (in chunks, if streamed).
+    With `stream`, returns a StreamedPage.
+    """
+
+    if q:
+        needle = q.lower()
+        name = db.func.lower(User.username)
+
+        rank = db.case(
+            (name == needle, 0),
+            (name.startswith(needle, autoescape=True), 1),
+            else_=2,
+        )
+        query = User.query.filter(name.contains(needle, autoescape=True))
+        position = db.tuple_(rank, User.username)
+        order = [rank, User.username]
+    else:
+        # everyone is ranked the same
+        rank = db.literal(0)
+        query = User.query
+        position = User.username
+        order = [User.username]
+        after = after and after[1]
+
+    if after is not None:
+        query = query.filter(position > after)
+
+    query = query.add_columns(rank).order_by(*order)
+
+    def cursor(row):
+        user, rank = row
+        return encode_user_cursor(rank, user.username)
+
+    if stream:
+        return StreamedPage(query, per_page, cursor,
+                            item=lambda row: row[0], on_chunk=on_chunk)
+
+    rows = query.limit(per_page + 1).all()
+    page = UserPage([user for user, _ in rows[:per_page]],
+                    cursor(rows[per_page - 1])
+                    if len(rows) > per_page else None)
+
+    if on_chunk:
+        on_chunk(page.users)
+
+    return page
+
+
+class UsernameIndex:
+    """Sorted list of usernames for prefix lookups, private to one worker.
+
+    Entries are (lowercased username, username, user id), so a prefix's
+    matches sit next to each other, found with one binary search.
+    """
+
+    def __init__(self, max_age=AUTOCOMPLETE_MAX_AGE, clock=time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+
+        self._entries = []
+        self._by_id = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def complete(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """Up to `limit` (user id, username) whose name starts with `prefix`.
+
+        Case is ignored; results are in alphabetical order.
+        """
+
+        prefix = prefix.lower()
+
+        with self._lock:
+            if (self._loaded_at is None
+                    or self.clock() - self._loaded_at > self.max_age):
+                self._load()
+
+            found = []
+            i = bisect_left(self._entries, (prefix,))
+
+            while len(found) < limit and i < len(self._entries):
+                key, username, user_id = self._entries[i]
+                if not key.startswith(prefix):
+                    break
+                found.append((user_id, username))
+                i += 1
+
+            return found
+
+    def add(self, user_id, username):
+        """Add a user, or update a user's username."""
+
+        with self._lock:
+            if self._loaded_at is not None:
+                self._remove(user_id)
+
+                entry = (username.lower(), username, user_id)
+                insort(self._entries, entry)
+                self._by_id[user_id] = entry
+
+    def remove(self, user_id):
+        """Forget a (deleted) user."""
+
+        with self._lock:
+            if self._loaded_at is not None:
+                self._remove(user_id)
+
+    def _remove(self, user_id):
+        entry = self._by_id.pop(user_id, None)
+
+        if entry is not None:
+            del self._entries[bisect_left(self._entries, entry)]
+
+    def _load(self):
+        rows = db.session.query(User.id, User.username).all()
+
+        self._entries = sorted(
+            (username.lower(), username, user_id)
+            for user_id, username in rows)
+        self._by_id = {entry[2]: entry for entry in self._entries}
+        self._loaded_at = self.clock()
+
+
+def connect_username_index(app):
+    """Create the autocomplete index for `app`.
+
+    AUTOCOMPLETE_MAX_AGE is how often (in seconds) it is reloaded from the
+    database.
+    """
+
+    usernames = UsernameIndex(
+        max_age=app.config.get('AUTOCOMPLETE_MAX_AGE', AUTOCOMPLETE_MAX_AGE))
+    app.extensions['usernames'] = usernames
+
+    return usernames